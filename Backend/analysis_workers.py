@@ -0,0 +1,140 @@
+# analysis_workers.py
+# Gaze analysis of a session, either in the session process (one
+# SessionAnalyzer per analysis thread) or in worker processes, so the
+# analysis doesn't compete for the GIL with the Flask request threads.
+#
+# In a worker process, the frames come through a SharedFrameRing: the
+# analysis thread of the pipeline copies its frame into a slot and only
+# sends the slot index (and the analysis settings) to its process, which
+# sends the GazeSample back.
+#
+#   pipeline thread --(slot index, settings)--> worker process
+#                   <--------(GazeSample)-------
+import multiprocessing
+import traceback
+
+from gaze_tracking import GazeTracking
+from shm_ring import SharedFrameRing
+
+
+class SessionAnalyzer(object):
+    """
+    Analyzes the frames of a session with its own GazeTracking (and calibration).
+
+    Arguments:
+        gaze_options (dict): Keyword arguments given to GazeTracking
+        calibration_profile (tuple): (left, right) thresholds to start from, or None
+    """
+
+    def __init__(self, gaze_options, calibration_profile=None):
+        self.gaze = GazeTracking(**gaze_options)
+        if calibration_profile is not None:
+            self.gaze.calibration.seed(*calibration_profile)
+
+    def __call__(self, frame, level):
+        """Analyzes a frame with the settings of a quality level, returns its GazeSample
+
+        Arguments:
+            frame (numpy.ndarray): The frame to analyze
+            level (rate_control.QualityLevel): Settings of the analysis
+        """
+        self.gaze.detection_interval = level.detection_interval
+        self.gaze.detection_scale = level.detection_scale
+        self.gaze.filter_size = level.filter_size
+        return self.gaze.refresh(frame)
+
+    @property
+    def calibration(self):
+        return self.gaze.calibration
+
+    def close(self):
+        """Returns the calibration of the session, like ProcessAnalyzer.close()"""
+        return self.calibration
+
+
+def _worker_main(connection, ring_name, slots, shape, gaze_options, calibration_profile):
+    """Entry point of a worker process: analyzes the frames of the slots it
+    receives until it receives None, then sends back its calibration"""
+    ring = SharedFrameRing.attach(ring_name, slots, shape)
+    analyzer = SessionAnalyzer(gaze_options, calibration_profile)
+    try:
+        while True:
+            message = connection.recv()
+            if message is None:
+                connection.send(analyzer.calibration)
+                break
+
+            index, level = message
+            try:
+                connection.send((True, analyzer(ring.slot(index), level)))
+            except Exception:
+                connection.send((False, traceback.format_exc()))
+    finally:
+        ring.close()
+        connection.close()
+
+
+class ProcessAnalyzer(object):
+    """
+    Runs a SessionAnalyzer in a worker process. Calling it from the
+    pipeline thread that owns it sends the frame through the ring and
+    waits for the GazeSample, the GIL is released while it waits.
+
+    Arguments:
+        ring (shm_ring.SharedFrameRing): Ring created by the session process
+        gaze_options (dict): Keyword arguments given to GazeTracking, picklable
+        calibration_profile (tuple): (left, right) thresholds to start from, or None
+    """
+
+    # Processes are started fresh, forking a process that runs threads isn't safe
+    CONTEXT = multiprocessing.get_context("spawn")
+
+    def __init__(self, ring, gaze_options, calibration_profile=None):
+        self._ring = ring
+        self._connection, child_connection = self.CONTEXT.Pipe()
+        self._process = self.CONTEXT.Process(
+            target=_worker_main,
+            args=(child_connection, ring.name, ring.slots, ring.shape, gaze_options, calibration_profile),
+            name="gaze-analysis-process",
+            daemon=True,
+        )
+        self._process.start()
+        child_connection.close()
+        self.calibration = None
+
+    def __call__(self, frame, level):
+        """Analyzes a frame in the worker process, returns its GazeSample
+
+        Arguments:
+            frame (numpy.ndarray): The frame to analyze
+            level (rate_control.QualityLevel): Settings of the analysis
+        """
+        index = self._ring.acquire()
+        try:
+            self._ring.write(index, frame)
+            self._connection.send((index, level))
+            ok, result = self._connection.recv()
+        finally:
+            self._ring.release(index)
+        if not ok:
+            raise RuntimeError(f"Gaze analysis failed in the worker process:\n{result}")
+        return result
+
+    def close(self, timeout=10.0):
+        """Stops the worker process and returns its calibration, or None if it didn't answer
+
+        Argument:
+            timeout (float): Seconds to wait for the process
+        """
+        try:
+            self._connection.send(None)
+            if self._connection.poll(timeout):
+                self.calibration = self._connection.recv()
+        except (EOFError, OSError):
+            pass
+        self._connection.close()
+
+        self._process.join(timeout)
+        if self._process.is_alive():
+            self._process.terminate()
+        return self.calibration
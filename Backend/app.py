@@ -1,4 +1,4 @@
-from flask import Flask, jsonify, request, send_file, url_for, send_from_directory
+from flask import Flask, jsonify, request, send_file, url_for, send_from_directory, Response, stream_with_context
 import os
 import glob
 import json
@@ -13,7 +13,9 @@ from database import db, User, Child, DoctorDetails, StimuliVideo, Report, Appoi
 from datetime import date, datetime
 from werkzeug.utils import secure_filename
 from io import BytesIO
-from main import handle_interrupt, run_gaze_session
+from main import handle_interrupt, run_gaze_session, get_pipeline_stats, preview_sink, MODEL_REGISTRY
+from main import finalize_job, FINALIZE_JOB
+from jobs import JobQueue, JobWorker
 import time
 app = Flask(__name__)
 CORS(app)
@@ -50,6 +52,11 @@ RESULTS_DIR = os.path.join(BASE_DIR, "results")
 current_session = None
 session_thread = None
 stop_requested = False
+
+# Post-processing of the sessions, run by JOB_WORKERS threads of the server
+# (0 when it is left to worker processes, see jobs.py)
+JOBS = JobQueue(os.path.join(BASE_DIR, "jobs.db"))
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 1))
 session_data = {}
 #--------------------------------------------Authentication------------------------------------------------------------#
 # ---------- Signup ----------
@@ -876,7 +883,8 @@ def start_session():
             base_dir=RESULTS_DIR,
             db=db,
             Report=Report,
-            app=app
+            app=app,
+            jobs=JOBS
         )
     session_thread = threading.Thread(target=run_session, daemon=True)
     session_thread.start()
@@ -902,18 +910,30 @@ def stop_session():
     with open(STOP_FILE, "w") as f:
         f.write("stop")
     stop_requested = True
-    session_thread.join()  # wait for session to finish
+    session_thread.join()  # wait for the capture to finish, the post-processing is queued
 
     results = current_session
     current_session = None
     session_data.clear()
 
+    if not results:
+        return jsonify({"status": "error", "message": "Session stopped, but its data could not be saved"}), 500
     return jsonify({
         "status": "success",
-        "message": "Session stopped"
+        "message": "Session stopped",
+        "job_id": results["job_id"]
     }), 200
 
 
+# State and progress of a post-processing job, its results once done
+@app.route('/jobs/<int:job_id>', methods=['GET'])
+def get_job(job_id):
+    job = JOBS.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Job not found"}), 404
+    return jsonify({"status": "success", "job": job}), 200
+
+
 # Check session status
 @app.route('/status', methods=['GET'])
 def get_status():
@@ -924,9 +944,57 @@ def get_status():
         return jsonify({"status": "idle"}), 200
 
 
+# Live queue depths and stage timings of the session pipeline
+@app.route('/pipeline-stats', methods=['GET'])
+def get_session_pipeline_stats():
+    stats = get_pipeline_stats()
+    if stats is None:
+        return jsonify({"status": "idle"}), 200
+    return jsonify({"status": "running", "stages": stats}), 200
+
+
+# Version and timings of the ASD model served to the sessions
+@app.route('/model', methods=['GET'])
+def get_model_info():
+    return jsonify({"status": "success", "model": MODEL_REGISTRY.info()}), 200
+
+
+# Loads a new version of the ASD model without restarting the server, the
+# sessions keep the current one until the new one is ready. The files are
+# names of the model folder (see ModelRegistry.resolve), no other path
+@app.route('/model/reload', methods=['POST'])
+def reload_model():
+    data = request.get_json(silent=True) or {}
+    try:
+        info = MODEL_REGISTRY.reload(data.get("model_file"), data.get("labels_file"))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"status": "error", "message": f"Could not load the model: {e}"}), 500
+    return jsonify({"status": "success", "model": info}), 200
+
+
+# Live MJPEG preview of the annotated session frames, frames are only
+# annotated while at least one client is connected
+@app.route('/preview', methods=['GET'])
+def preview_session():
+    if not session_thread or not session_thread.is_alive():
+        return jsonify({"status": "error", "message": "No active session"}), 400
+    return Response(
+        stream_with_context(preview_sink.stream()),
+        mimetype='multipart/x-mixed-replace; boundary=frame'
+    )
+
+
 # get a report for a child
 @app.route('/get-report/<string:child_id>', methods=['GET'])
 def get_latest_report(child_id):
+    # The report of the last session may still be processed by a job
+    for status in (JobQueue.QUEUED, JobQueue.RUNNING):
+        for job in JOBS.jobs(status):
+            if job["payload"].get("child_id") == child_id:
+                return jsonify({"message": "Report still processing", "job_id": job["id"]}), 202
+
     # Get the latest report for this session_id
     report = Report.query.filter_by(child_id=child_id).order_by(Report.created_at.desc()).first()
     print("data in report for a child api: ", report)
@@ -1078,4 +1146,12 @@ def get_system_status():
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 8000))  # Use port 8000 as default to avoid conflicts
+    # The model is ready before the first session ends
+    MODEL_REGISTRY.preload()
+    for i in range(JOB_WORKERS):
+        JobWorker(
+            JOBS,
+            {FINALIZE_JOB: lambda payload, progress: finalize_job(payload, progress, db, Report, app)},
+            name=f"api-worker-{i}"
+        ).start()
     app.run(debug=True, host='0.0.0.0', port=port, use_reloader=False)
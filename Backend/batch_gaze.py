@@ -0,0 +1,170 @@
+# batch_gaze.py
+# Offline gaze extraction from recorded session videos.
+#
+#   python batch_gaze.py recordings/*.mp4 --output batch_results --workers 8
+#
+# Every video is split into chunks of frames, the chunks are processed by a
+# pool of worker processes (one GazeTracking per worker) and the per-frame
+# records are merged back in frame order, so the output does not depend on
+# the number of workers.
+#
+# A frame whose analysis raises is logged as a frame without face (NO_FACE)
+# and counted, the rest of the video is still analyzed.
+import argparse
+import os
+import traceback
+from multiprocessing import Pool, cpu_count
+
+from frame_sources import VideoFileSource
+from gaze_log import GazeLog
+from gaze_tracking import GazeTracking, GazeSample, FrameQuality
+
+# Frames per chunk of work given to a worker
+CHUNK_SIZE = 1800
+# Frames analyzed before a chunk starts, so its calibration is complete
+# and its face is found when the first frame of the chunk is logged
+WARMUP_FRAMES = 30
+
+_gaze = None
+
+
+def _init_worker(gaze_options):
+    """Loads the face detector and the landmarks model once per worker"""
+    global _gaze
+    _gaze = GazeTracking(**gaze_options)
+
+
+def _process_chunk(task):
+    """Analyzes frames [start, stop) of a video, stop=None reads until the end.
+
+    Returns a list of (frame_index, GazeSample) and the number of frames
+    whose analysis failed.
+    """
+    path, start, stop = task
+    _gaze.reset()
+
+    first = max(start - WARMUP_FRAMES, 0)
+    video = VideoFileSource(path, start_frame=first)
+
+    records = []
+    failed = 0
+    index = first
+    try:
+        video.open()
+        while stop is None or index < stop:
+            ret, frame, _ = video.read()
+            if not ret:
+                break
+
+            try:
+                sample = _gaze.refresh(frame)
+            except Exception:
+                print(f"{path}: analysis of frame {index} failed\n{traceback.format_exc()}")
+                sample = GazeSample(quality=FrameQuality.NO_FACE)
+                failed += index >= start
+            if index >= start:
+                records.append((index, sample))
+            index += 1
+    finally:
+        video.release()
+
+    return records, failed
+
+
+def _video_info(path):
+    """Returns the frame rate and the frame count of a video"""
+    with VideoFileSource(path) as video:
+        return video.fps, video.frame_count
+
+
+def _split(path, frame_count, chunk_size):
+    """Splits a video into (path, start, stop) tasks, the last one reads until
+    the end of the video since the frame count of some containers is an estimate"""
+    starts = list(range(0, max(frame_count, 1), chunk_size))
+    tasks = [(path, start, start + chunk_size) for start in starts[:-1]]
+    tasks.append((path, starts[-1], None))
+    return tasks
+
+
+def _to_gaze_log(records, fps):
+    """Turns the analyzed frames of a video into its gaze log, with the
+    time of a frame being its position in the video (in seconds)"""
+    gaze_log = GazeLog(capacity=max(len(records), 1), record_settings=False)
+    for index, sample in records:
+        gaze_log.append(index / fps, sample)
+    return gaze_log
+
+
+def extract_gaze(video_paths, workers=None, chunk_size=CHUNK_SIZE, report=None, **gaze_options):
+    """Extracts the gaze log of recorded videos.
+
+    Arguments:
+        video_paths (list): Paths of the videos
+        workers (int): Number of worker processes, defaults to the number of CPUs
+        chunk_size (int): Frames per chunk of work
+        report (dict): If given, filled with the number of frames whose
+            analysis failed in each video (path -> count)
+        gaze_options: Keyword arguments given to GazeTracking in each worker
+
+    Returns:
+        A dict mapping each video path to its GazeLog, in frame order
+    """
+    infos = {path: _video_info(path) for path in video_paths}
+    tasks = []
+    for path in video_paths:
+        tasks.extend(_split(path, infos[path][1], chunk_size))
+
+    records = {path: [] for path in video_paths}
+    failed = {path: 0 for path in video_paths}
+    with Pool(workers or cpu_count(), initializer=_init_worker, initargs=(gaze_options,)) as pool:
+        # imap keeps the order of the tasks, whatever worker finishes first
+        for (path, _, _), (chunk_records, chunk_failed) in zip(tasks, pool.imap(_process_chunk, tasks)):
+            records[path].extend(chunk_records)
+            failed[path] += chunk_failed
+
+    if report is not None:
+        report.update(failed)
+
+    return {path: _to_gaze_log(records[path], infos[path][0]) for path in video_paths}
+
+
+def save_gaze_log(gaze_log, folder):
+    """Saves the gaze log of a video like a live session does: gaze_data.npz,
+    and gaze_data.xlsx in the same workbook layout. Returns the spreadsheet path."""
+    gaze_log.save(os.path.join(folder, "gaze_data.npz"))
+    filename = os.path.join(folder, "gaze_data.xlsx")
+    gaze_log.export_xlsx(filename, wall_clock=False)
+    return filename
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract gaze data from recorded session videos")
+    parser.add_argument("videos", nargs="+", help="Recorded session videos")
+    parser.add_argument("--output", default="batch_results", help="Output folder, one subfolder per video")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Frames per chunk of work")
+    parser.add_argument("--detection-interval", type=int, default=1, help="Run face detection every N frames")
+    parser.add_argument("--detection-scale", type=float, default=1.0, help="Scale of the frame used for face detection")
+    parser.add_argument("--no-quality-gate", action="store_true", help="Analyze every frame, even unusable ones")
+    args = parser.parse_args()
+
+    failed = {}
+    logs = extract_gaze(
+        args.videos,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        report=failed,
+        detection_interval=args.detection_interval,
+        detection_scale=args.detection_scale,
+        frame_quality=None if args.no_quality_gate else FrameQuality(),
+    )
+
+    for path, gaze_log in logs.items():
+        folder = os.path.join(args.output, os.path.splitext(os.path.basename(path))[0])
+        os.makedirs(folder, exist_ok=True)
+        filename = save_gaze_log(gaze_log, folder)
+        print(f"{path}: {len(gaze_log)} frames saved to {filename} ({failed[path]} failed)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+# benchmark.py
+# End-to-end benchmark of a gaze session, replayed from a recording instead
+# of the webcam.
+#
+#   python benchmark.py recordings/session.mp4 --output benchmark.json
+#   python benchmark.py recordings/frames/ --fps 30 --realtime
+#
+# The whole session runs (pipeline, gaze log, post-processing, prediction)
+# and a JSON report is written with the frame rate, the latency percentiles
+# of every stage, the peak memory and the post-processing time. Reports of
+# two releases can be diffed to spot regressions.
+#
+# By default the frames are replayed as fast as they are analyzed, every
+# frame is analyzed with the same settings, so two runs on the same
+# recording give the same gaze log. --realtime replays the recording at
+# its frame rate, like a camera (frames are dropped if the PC is too slow).
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import main
+from frame_sources import ImageSequenceSource, VideoFileSource
+from gaze_tracking import PROFILER
+
+REPORT_VERSION = 1
+PERCENTILES = (50, 90, 99)
+# Durations kept per stage, enough for every frame of a long recording
+PROFILER_CAPACITY = 1000000
+
+
+def _peak_memory_mb():
+    """Returns the peak resident memory of the process in MB, or None if unknown"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    if sys.platform == "darwin":
+        return round(peak / (1024 * 1024), 1)
+    return round(peak / 1024, 1)
+
+
+def _git_commit():
+    """Returns the commit of the working tree, or None outside a git checkout"""
+    try:
+        output = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=main.BASE_DIR, stderr=subprocess.DEVNULL
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode().strip()
+
+
+def stage_latencies(durations):
+    """Returns the count, mean, percentiles and max of each stage, in milliseconds
+
+    Arguments:
+        durations (dict): Stage name -> list of durations in seconds
+    """
+    stages = {}
+    for name, values in sorted(durations.items()):
+        values = np.asarray(values) * 1000
+        stages[name] = {
+            "count": int(values.size),
+            "mean_ms": round(float(values.mean()), 3),
+            "max_ms": round(float(values.max()), 3),
+        }
+        for percentile, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+            stages[name][f"p{percentile}_ms"] = round(float(value), 3)
+    return stages
+
+
+def open_source(path, fps=30.0, pattern="*.png", realtime=False):
+    """Returns the replay source of a video file or of a folder of frames"""
+    if os.path.isdir(path):
+        return ImageSequenceSource(path, pattern=pattern, fps=fps, realtime=realtime)
+    return VideoFileSource(path, realtime=realtime)
+
+
+def run_benchmark(path, fps=30.0, pattern="*.png", realtime=False, child_id="benchmark"):
+    """Replays a recording through a full gaze session and returns the report"""
+    if os.path.exists(main.STOP_FILE):
+        # A leftover stop file would end the session right away
+        print(f"Removing stale stop file {main.STOP_FILE}")
+        os.remove(main.STOP_FILE)
+
+    source = open_source(path, fps, pattern, realtime)
+    # Like on the server, the model is loaded before the session, not timed with it
+    try:
+        main.MODEL_REGISTRY.get()
+    except Exception as e:
+        print(f"Warning: could not load the model ({e}), the session won't have a prediction")
+    session = {}
+    PROFILER.enable(PROFILER_CAPACITY)
+    try:
+        result = main.run_gaze_session(
+            child_id, "benchmark", "benchmark", base_dir=None, db=None, Report=None, app=None,
+            source=source, report=session,
+        )
+    finally:
+        PROFILER.disable()
+
+    if not session:
+        raise IOError(f"Could not replay {path}")
+
+    frames = session["pipeline"]["write"]["count"]
+    return {
+        "report_version": REPORT_VERSION,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "recording": os.path.abspath(path),
+        "realtime": realtime,
+        "environment": {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "opencv": cv2.__version__,
+            "numpy": np.__version__,
+        },
+        "settings": {
+            "target_fps": main.TARGET_FPS,
+            "analysis_workers": main.ANALYSIS_WORKERS,
+            "detection_interval": main.DETECTION_INTERVAL,
+            "detection_scale": main.DETECTION_SCALE,
+            "quality_gate": main.QUALITY_GATE,
+        },
+        "source": session["source"],
+        "frames": frames,
+        "capture_seconds": round(session["capture_seconds"], 3),
+        "frames_per_second": round(frames / session["capture_seconds"], 2) if session["capture_seconds"] else None,
+        "stages": stage_latencies(PROFILER.durations()),
+        "counters": PROFILER.snapshot()["counters"],
+        "pipeline": session["pipeline"],
+        "rate_control": session["rate_control"],
+        "peak_memory_mb": _peak_memory_mb(),
+        "save_seconds": round(session.get("save_seconds", 0.0), 3),
+        "post_processing_seconds": round(session.get("post_processing_seconds", 0.0), 3),
+        "export_seconds": round(session.get("export_seconds", 0.0), 3),
+        "prediction_seconds": round(session.get("prediction_seconds", 0.0), 3),
+        "prediction": result,
+        "model": main.MODEL_REGISTRY.info(),
+        "session_folder": session.get("session_folder"),
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark a gaze session replayed from a recording")
+    parser.add_argument("recording", help="Recorded video, or folder of frames")
+    parser.add_argument("--output", default="benchmark.json", help="JSON report to write")
+    parser.add_argument("--realtime", action="store_true", help="Replay at the frame rate of the recording")
+    parser.add_argument("--fps", type=float, default=30.0, help="Frame rate of a folder of frames")
+    parser.add_argument("--pattern", default="*.png", help="Frame files in a folder of frames")
+    parser.add_argument("--child-id", default="benchmark", help="Results go to results/<child-id>/")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = run_benchmark(args.recording, args.fps, args.pattern, args.realtime, args.child_id)
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=4, sort_keys=True, default=str)
+
+    print(f"{report['frames']} frames at {report['frames_per_second']} frames/s")
+    for name, stage in report["stages"].items():
+        print(f"  {name:<10} p50 {stage['p50_ms']:>8.3f} ms   p99 {stage['p99_ms']:>8.3f} ms")
+    print(f"Post-processing: {report['post_processing_seconds']} s, peak memory: {report['peak_memory_mb']} MB")
+    print(f"Report saved to {args.output}")
@@ -0,0 +1,142 @@
+# compare_models.py
+# Regression check of a model variant (e.g. the int8 model made by
+# export_model.py --int8) against the model it comes from. Both models
+# predict the same scanpaths and the report gives:
+#   - the agreement rate of the predicted classes
+#   - the drift of the confidence (probability of the predicted class)
+#   - the risk level changes (Safe/Low/Moderate/High, see model_registry.risk_level)
+#   - the latency of one prediction and the memory taken by each model
+#
+#   python compare_models.py TFSMconverted_model.keras asd_model_int8.tflite --images results
+#
+# The variant passes if no risk level changes (see --max-risk-changes): its
+# speed and memory are only worth it if the reports stay the same.
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from export_model import load_scanpaths, parity_images
+from model_registry import INPUT_SHAPE, LOADERS, risk_level
+
+PERCENTILES = (50, 90, 99)
+LATENCY_RUNS = 50
+
+
+def _resident_memory_mb():
+    """Returns the memory used by the process in MB, or None if unknown (Linux only)"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+def load(path):
+    """Loads a model with its loader, returns its predict function and the
+    memory it took (load and first prediction), in MB. A runtime imported
+    for the first time (e.g. TensorFlow) is counted in the memory of its model."""
+    before = _resident_memory_mb()
+    predict = LOADERS[os.path.splitext(path)[1].lower()](path, INPUT_SHAPE)
+    predict(np.zeros((1,) + INPUT_SHAPE, np.float32))
+    after = _resident_memory_mb()
+    memory = round(after - before, 1) if before is not None and after is not None else None
+    return predict, memory
+
+
+def latency(predict, batch, runs=LATENCY_RUNS):
+    """Returns the percentiles of the time of a single image prediction, in milliseconds"""
+    durations = []
+    for i in range(runs):
+        image = batch[i % len(batch)][np.newaxis]
+        start = time.perf_counter()
+        predict(image)
+        durations.append(time.perf_counter() - start)
+    values = np.percentile(np.asarray(durations) * 1000, PERCENTILES)
+    return {f"p{percentile}_ms": round(float(value), 3) for percentile, value in zip(PERCENTILES, values)}
+
+
+def compare(reference, variant, batch, labels):
+    """Compares the predictions of two models on a batch of model inputs
+
+    Arguments:
+        reference (numpy.ndarray): Class probabilities of the reference model
+        variant (numpy.ndarray): Class probabilities of the variant
+        batch (numpy.ndarray): The model inputs
+        labels (list): Class names, in the order of the model outputs
+    """
+    expected_classes = reference.argmax(axis=1)
+    predicted_classes = variant.argmax(axis=1)
+    expected_confidence = reference.max(axis=1)
+    predicted_confidence = variant.max(axis=1)
+    drift = np.abs(predicted_confidence - expected_confidence)
+
+    # Risk level of each image with each model, and the changes between them
+    changes = {}
+    for i in range(len(batch)):
+        before = risk_level(labels[expected_classes[i]], float(expected_confidence[i]))
+        after = risk_level(labels[predicted_classes[i]], float(predicted_confidence[i]))
+        if before != after:
+            change = f"{before} -> {after}"
+            changes[change] = changes.get(change, 0) + 1
+
+    return {
+        "images": len(batch),
+        "agreement": round(float((expected_classes == predicted_classes).mean()), 4),
+        "confidence_drift_mean": round(float(drift.mean()), 5),
+        "confidence_drift_max": round(float(drift.max()), 5),
+        "probability_difference_max": round(float(np.abs(variant - reference).max()), 5),
+        "risk_level_changes": sum(changes.values()),
+        "risk_level_transitions": changes,
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare a model variant with its reference model")
+    parser.add_argument("reference", help="Reference model, e.g. TFSMconverted_model.keras")
+    parser.add_argument("variant", help="Model variant, e.g. asd_model_int8.tflite")
+    parser.add_argument("--labels", default="labels.txt", help="Class names, one per line")
+    parser.add_argument("--images", default=None,
+                        help="Folder of scanpath.png files (default: scanpaths of random walks)")
+    parser.add_argument("--limit", type=int, default=None, help="Number of scanpath.png files at most")
+    parser.add_argument("--max-risk-changes", type=int, default=0, help="Risk level changes accepted")
+    parser.add_argument("--output", default=None, help="JSON report to write")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    with open(args.labels) as f:
+        labels = [line.strip() for line in f if line.strip()]
+    batch = load_scanpaths(args.images, args.limit) if args.images else parity_images()
+
+    report = {"models": {}}
+    predictions = []
+    for name, path in (("reference", args.reference), ("variant", args.variant)):
+        predict, memory = load(path)
+        predictions.append(np.concatenate([predict(image[np.newaxis]) for image in batch]))
+        report["models"][name] = {
+            "path": os.path.abspath(path),
+            "file_mb": round(os.path.getsize(path) / (1024 * 1024), 2),
+            "memory_mb": memory,
+            "latency": latency(predict, batch),
+        }
+    report.update(compare(predictions[0], predictions[1], batch, labels))
+    report["passed"] = report["risk_level_changes"] <= args.max_risk_changes
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+
+    for name, model in report["models"].items():
+        print(f"{name:<9} {model['path']}: {model['file_mb']} MB on disk, {model['memory_mb']} MB in memory, "
+              f"p50 {model['latency']['p50_ms']} ms, p99 {model['latency']['p99_ms']} ms")
+    print(f"{report['images']} images: agreement {report['agreement']:.2%}, "
+          f"confidence drift mean {report['confidence_drift_mean']} max {report['confidence_drift_max']}")
+    print(f"Risk level changes: {report['risk_level_changes']} {report['risk_level_transitions']}")
+    print("PASSED, the variant can be served" if report["passed"] else "FAILED, keep serving the reference model")
+    sys.exit(0 if report["passed"] else 1)
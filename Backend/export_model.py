@@ -0,0 +1,205 @@
+# export_model.py
+# Exports the ASD model to a CPU runtime format, so the server can serve it
+# without TensorFlow (see model_registry.py), and checks that the exported
+# model gives the same predictions as the original one.
+#
+#   python export_model.py --format onnx                       # asd_model.onnx
+#   python export_model.py --format tflite --source converted_savedmodel/model.savedmodel
+#   python export_model.py --format onnx --images results/12/20250101_101500
+#   python export_model.py --format tflite --int8      # asd_model_int8.tflite
+#
+# Exporting needs TensorFlow (and tf2onnx for ONNX), serving the exported
+# model only needs onnxruntime (or tflite-runtime).
+#
+# The parity check predicts a fixed set of images with both models: the
+# scanpath.png files found under --images, or else PARITY_IMAGES scanpaths
+# rendered from seeded random walks. The export fails if a probability
+# differs by more than --tolerance or a predicted class changes.
+#
+# --int8 quantizes the weights and activations to 8 bits, calibrated on the
+# scanpath.png files of the sessions in --calibration (results/ by default).
+# A quantized model doesn't match to --tolerance, its parity is only
+# printed: compare_models.py tells whether its risk levels stay the same.
+import argparse
+import tempfile
+import glob
+import os
+import sys
+
+import cv2
+import numpy as np
+
+from model_registry import INPUT_SHAPE, LOADERS
+from scanpath import SIZE, random_walk, render_scanpath, to_model_input
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCE = os.path.join(BASE_DIR, "TFSMconverted_model.keras")
+PARITY_IMAGES = 16
+ONNX_OPSET = 13
+# Scanpaths the int8 ranges are calibrated on, at most
+CALIBRATION_IMAGES = 300
+
+
+def load_reference(source):
+    """Loads the original model (a Keras file or a SavedModel folder), returns
+    it as a tf.function taking a batch of model inputs, and the loaded model"""
+    import tensorflow as tf
+
+    if os.path.isdir(source):
+        model = tf.saved_model.load(source)
+        signature = model.signatures["serving_default"]
+        # Signatures only take keyword arguments
+        input_name = list(signature.structured_input_signature[1])[0]
+        call = lambda batch: signature(**{input_name: batch})
+    else:
+        from keras.models import load_model
+        model = load_model(source)
+        call = lambda batch: model(batch, training=False)
+
+    @tf.function(input_signature=[tf.TensorSpec((None,) + INPUT_SHAPE, tf.float32, name="input")])
+    def predict(batch):
+        outputs = call(batch)
+        if isinstance(outputs, dict):
+            outputs = list(outputs.values())[0]
+        return outputs
+
+    return predict, model
+
+
+def export_onnx(function, model, output, calibration=None):
+    import tf2onnx
+
+    if calibration is None:
+        tf2onnx.convert.from_function(
+            function, input_signature=function.input_signature, opset=ONNX_OPSET, output_path=output
+        )
+        return
+
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    class Reader(CalibrationDataReader):
+        def __init__(self):
+            self._images = iter(calibration)
+
+        def get_next(self):
+            image = next(self._images, None)
+            return None if image is None else {"input": image[np.newaxis]}
+
+    with tempfile.TemporaryDirectory() as folder:
+        float_model = os.path.join(folder, "float.onnx")
+        export_onnx(function, model, float_model)
+        quantize_static(
+            float_model, output, Reader(),
+            quant_format=QuantFormat.QDQ,
+            activation_type=QuantType.QInt8,
+            weight_type=QuantType.QInt8,
+            per_channel=True,
+        )
+
+
+def export_tflite(function, model, output, calibration=None):
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_concrete_functions([function.get_concrete_function()], model)
+    if calibration is not None:
+        # Integer kernels only, the inputs and outputs stay float
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = lambda: ([image[np.newaxis]] for image in calibration)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    with open(output, "wb") as f:
+        f.write(converter.convert())
+
+
+# Exporter of each format: (reference function, loaded model, output path,
+# calibration model inputs or None for a float model)
+EXPORTERS = {
+    "onnx": export_onnx,
+    "tflite": export_tflite,
+}
+
+
+def load_scanpaths(folder, limit=None):
+    """Returns the model inputs of the scanpath.png files found in a folder
+    (e.g. results/), as one batch
+
+    Arguments:
+        folder (str): Folder searched recursively
+        limit (int): Number of files at most, picked evenly across the sorted files
+    """
+    filenames = sorted(glob.glob(os.path.join(folder, "**", "scanpath.png"), recursive=True))
+    if not filenames:
+        raise IOError(f"No scanpath.png found in {folder}")
+    if limit is not None and len(filenames) > limit:
+        filenames = [filenames[i] for i in np.linspace(0, len(filenames) - 1, limit).astype(int)]
+
+    images = []
+    for filename in filenames:
+        image = cv2.cvtColor(cv2.imread(filename), cv2.COLOR_BGR2RGB)
+        images.append(cv2.resize(image, (SIZE, SIZE), interpolation=cv2.INTER_AREA))
+    return np.concatenate([to_model_input(image) for image in images])
+
+
+def parity_images(folder=None, count=PARITY_IMAGES):
+    """Returns the fixed set of model inputs of the parity check, as one batch
+
+    Arguments:
+        folder (str): Folder searched for scanpath.png files, None renders random walks
+        count (int): Number of images rendered from random walks
+    """
+    if folder is not None:
+        return load_scanpaths(folder)
+    images = [render_scanpath(*random_walk(2000, seed)) for seed in range(count)]
+    return np.concatenate([to_model_input(image) for image in images])
+
+
+def check_parity(reference, exported, batch):
+    """Predicts the batch with both models, returns the largest probability
+    difference and the number of images whose predicted class differs"""
+    expected = np.asarray(reference(batch))
+    predicted = np.asarray(exported(batch))
+    difference = float(np.abs(expected - predicted).max())
+    changed = int((expected.argmax(axis=1) != predicted.argmax(axis=1)).sum())
+    return difference, changed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export the ASD model to a CPU runtime format")
+    parser.add_argument("--format", choices=sorted(EXPORTERS), default="onnx", help="Format of the exported model")
+    parser.add_argument("--source", default=SOURCE, help="Keras model, or SavedModel folder")
+    parser.add_argument("--output", default=None, help="Exported model (default: asd_model.<format>)")
+    parser.add_argument("--images", default=None, help="Folder of scanpath.png files for the parity check")
+    parser.add_argument("--tolerance", type=float, default=1e-3,
+                        help="Largest probability difference accepted by the parity check")
+    parser.add_argument("--int8", action="store_true", help="Quantize the model to 8 bits integers")
+    parser.add_argument("--calibration", default=os.path.join(BASE_DIR, "results"),
+                        help="Folder of the scanpath.png files the int8 model is calibrated on")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    output = args.output or os.path.join(BASE_DIR, f"asd_model{'_int8' if args.int8 else ''}.{args.format}")
+
+    calibration = None
+    if args.int8:
+        calibration = load_scanpaths(args.calibration, CALIBRATION_IMAGES)
+        print(f"Calibrating the int8 model on {len(calibration)} scanpaths of {args.calibration}")
+
+    reference, model = load_reference(args.source)
+    print(f"Exporting {args.source} to {output}...")
+    EXPORTERS[args.format](reference, model, output, calibration)
+    print(f"Exported model: {os.path.getsize(output) / (1024 * 1024):.1f} MB")
+
+    batch = parity_images(args.images)
+    exported = LOADERS["." + args.format](output, INPUT_SHAPE)
+    difference, changed = check_parity(lambda images: reference(images).numpy(), exported, batch)
+    print(f"Parity on {len(batch)} images: largest probability difference {difference:.2e}, "
+          f"{changed} predicted classes changed")
+
+    if args.int8:
+        print(f"Check the risk levels before serving it: python compare_models.py {args.source} {output}")
+        sys.exit(0)
+    if difference > args.tolerance or changed:
+        print("Parity check failed, the exported model shouldn't be served")
+        sys.exit(1)
+    print(f"Parity check passed, set MODEL_FILE = \"{os.path.basename(output)}\" in main.py to serve it")
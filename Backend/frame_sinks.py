@@ -0,0 +1,103 @@
+# frame_sinks.py
+# Consumers of the annotated session frames. The session only draws the
+# annotations when at least one sink is active, so a headless session
+# never copies or draws on its frames.
+import threading
+
+import cv2
+
+
+class FrameSink(object):
+    """Base class of the annotated frame consumers"""
+
+    @property
+    def active(self):
+        """True if the sink wants frames right now"""
+        return True
+
+    def write(self, frame):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class VideoRecorderSink(FrameSink):
+    """Records the annotated frames to a video file, for debugging"""
+
+    def __init__(self, filename, fps=30.0, fourcc="MJPG"):
+        self.filename = filename
+        self.fps = fps
+        self.fourcc = fourcc
+        self._writer = None
+
+    def write(self, frame):
+        if self._writer is None:
+            height, width = frame.shape[:2]
+            self._writer = cv2.VideoWriter(
+                self.filename, cv2.VideoWriter_fourcc(*self.fourcc), self.fps, (width, height)
+            )
+        self._writer.write(frame)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.release()
+            self._writer = None
+
+
+class PreviewSink(FrameSink):
+    """Keeps the latest annotated frame for live preview clients. The sink
+    is only active while at least one client is streaming."""
+
+    def __init__(self, jpeg_quality=80):
+        self.jpeg_quality = jpeg_quality
+        self._condition = threading.Condition()
+        self._frame = None
+        self._frame_id = 0
+        self._consumers = 0
+        self._closed = False
+
+    @property
+    def active(self):
+        return self._consumers > 0
+
+    def write(self, frame):
+        with self._condition:
+            self._frame = frame
+            self._frame_id += 1
+            self._condition.notify_all()
+
+    def open(self):
+        """Accepts frames again after close(), for the next session"""
+        with self._condition:
+            self._closed = False
+            self._frame = None
+            self._frame_id = 0
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def stream(self, timeout=5.0):
+        """Yields the frames as a multipart MJPEG stream, until the sink is
+        closed or no frame came for `timeout` seconds"""
+        with self._condition:
+            self._consumers += 1
+        try:
+            last_id = 0
+            while True:
+                with self._condition:
+                    # No frame yet when the client connects before the session's first one
+                    has_new_frame = lambda: self._frame is not None and self._frame_id != last_id
+                    self._condition.wait_for(lambda: self._closed or has_new_frame(), timeout)
+                    if self._closed or not has_new_frame():
+                        return
+                    frame, last_id = self._frame, self._frame_id
+
+                ret, jpeg = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+                if ret:
+                    yield b"--frame\r\nContent-Type: image/jpeg\r\n\r\n" + jpeg.tobytes() + b"\r\n"
+        finally:
+            with self._condition:
+                self._consumers -= 1
@@ -0,0 +1,355 @@
+# frame_sources.py
+# Where the frames of a gaze session come from: a webcam, a video file or
+# a folder of images. Every source hands out (ok, frame, timestamp) and
+# reports the resolution and the frame rate it actually got.
+#
+# The webcam source negotiates a compressed format (MJPG) so the higher
+# resolutions keep their frame rate, and reads the camera in a background
+# thread that only keeps the newest frame: a slow consumer never gets a
+# stale frame out of the driver buffer.
+#
+# The file sources replay a recording, either as fast as it is consumed
+# (every frame is handed out, for deterministic runs) or in real time, as
+# if a camera was filming it.
+import glob
+import os
+import threading
+import time
+
+import cv2
+
+# Seconds without a new frame after which the webcam source logs a stall
+STALL_WARNING_SECONDS = 2.0
+
+
+def _fourcc_name(code):
+    """Turns a FOURCC code read from cv2.VideoCapture back into its 4 letters"""
+    code = int(code)
+    return "".join(chr((code >> (8 * i)) & 0xFF) for i in range(4))
+
+
+class FrameSource(object):
+    """Base class of the frame sources"""
+
+    # True if frames keep coming whether they are read or not, like a camera:
+    # frames the consumer can't keep up with are lost
+    live = True
+
+    def __init__(self):
+        self.width = None
+        self.height = None
+        self.fps = None
+
+    @property
+    def resolution(self):
+        """(width, height) of the frames, known once the source is open"""
+        return (self.width, self.height)
+
+    def open(self):
+        """Opens the source, raises IOError if it can't be read"""
+        raise NotImplementedError
+
+    def read(self):
+        """Returns (ok, frame, timestamp), ok is False once there are no more frames"""
+        raise NotImplementedError
+
+    def release(self):
+        pass
+
+    def describe(self):
+        """Returns the negotiated settings of the source, for the logs"""
+        return {"resolution": self.resolution, "fps": self.fps}
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class WebcamSource(FrameSource):
+    """
+    Reads a webcam. The requested settings are a wish, the camera picks the
+    closest mode it supports: width, height, fps and fourcc hold the
+    negotiated values once the source is open.
+
+    Arguments:
+        index (int): Index of the camera
+        width (int): Requested frame width
+        height (int): Requested frame height
+        fps (float): Requested frame rate
+        fourcc (str): Requested pixel format, None keeps the camera default
+        buffer_size (int): Frames buffered by the driver
+        latest_only (bool): Reads the camera in a background thread and
+            always hands out the newest frame, each frame at most once
+        backend (int): cv2.VideoCapture backend (cv2.CAP_ANY picks one)
+        stall_timeout (float): Seconds without a new frame after which read()
+            gives up, None waits until the camera fails or the source is released
+    """
+
+    def __init__(self, index=0, width=640, height=480, fps=30, fourcc="MJPG", buffer_size=1,
+                 latest_only=True, backend=cv2.CAP_ANY, stall_timeout=None):
+        super().__init__()
+        self.index = index
+        self.requested = {"width": width, "height": height, "fps": fps, "fourcc": fourcc}
+        self.buffer_size = buffer_size
+        self.latest_only = latest_only
+        self.backend = backend
+        self.stall_timeout = stall_timeout
+        self.fourcc = None
+
+        self._capture = None
+        self._thread = None
+        self._running = False
+        self._condition = threading.Condition()
+        self._latest = None
+        self._latest_seq = 0
+        self._read_seq = 0
+        self._failed = False
+        self.grabbed = 0
+        # Frames the grabber replaced before they were read
+        self.skipped = 0
+        # Waits for a frame longer than STALL_WARNING_SECONDS
+        self.stalls = 0
+
+    def open(self):
+        capture = cv2.VideoCapture(self.index, self.backend)
+        if not capture.isOpened():
+            raise IOError(f"Could not open camera {self.index}")
+
+        # The format goes first, some drivers only list the large sizes for MJPG
+        if self.requested["fourcc"]:
+            capture.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*self.requested["fourcc"]))
+        capture.set(cv2.CAP_PROP_FRAME_WIDTH, self.requested["width"])
+        capture.set(cv2.CAP_PROP_FRAME_HEIGHT, self.requested["height"])
+        capture.set(cv2.CAP_PROP_FPS, self.requested["fps"])
+        capture.set(cv2.CAP_PROP_BUFFERSIZE, self.buffer_size)
+
+        self.width = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.fps = capture.get(cv2.CAP_PROP_FPS) or None
+        self.fourcc = _fourcc_name(capture.get(cv2.CAP_PROP_FOURCC))
+        self._capture = capture
+
+        if self.latest_only:
+            self._running = True
+            self._thread = threading.Thread(target=self._grab, name="webcam-grabber", daemon=True)
+            self._thread.start()
+
+    def _grab(self):
+        """Reads the camera as fast as it delivers, keeping only the newest frame"""
+        while self._running:
+            if not self._capture.grab():
+                break
+            # Timestamp of the capture, before the frame is decoded
+            timestamp = time.time()
+            ret, frame = self._capture.retrieve()
+            if not ret:
+                break
+            with self._condition:
+                self._latest = (frame, timestamp)
+                self._latest_seq += 1
+                self.grabbed += 1
+                self._condition.notify_all()
+
+        with self._condition:
+            self._failed = True
+            self._condition.notify_all()
+
+    def read(self):
+        """Returns the newest frame not handed out yet, waiting for the
+        camera if needed. A camera that stops delivering for a while (USB
+        hiccup, exposure change) is waited for, ok is False once the camera
+        fails, the source is released or the wait exceeds stall_timeout."""
+        if not self.latest_only:
+            ret, frame = self._capture.read()
+            return ret, frame, time.time()
+
+        start = time.time()
+        warned = False
+        with self._condition:
+            while self._latest_seq == self._read_seq:
+                if self._failed or not self._running:
+                    return False, None, None
+                waited = time.time() - start
+                if self.stall_timeout is not None and waited >= self.stall_timeout:
+                    print(f"Camera {self.index} delivered no frame for {waited:.1f} s, giving up")
+                    return False, None, None
+                if waited >= STALL_WARNING_SECONDS and not warned:
+                    print(f"Camera {self.index} delivered no frame for {waited:.1f} s, still waiting")
+                    self.stalls += 1
+                    warned = True
+                self._condition.wait(STALL_WARNING_SECONDS)
+            if warned:
+                print(f"Camera {self.index} delivering again after {time.time() - start:.1f} s")
+            self.skipped += self._latest_seq - self._read_seq - 1
+            self._read_seq = self._latest_seq
+            frame, timestamp = self._latest
+            return True, frame, timestamp
+
+    def release(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+        if self._capture is not None:
+            self._capture.release()
+            self._capture = None
+
+    def describe(self):
+        info = super().describe()
+        info.update({
+            "camera": self.index,
+            "fourcc": self.fourcc,
+            "requested": self.requested,
+            "grabbed": self.grabbed,
+            "skipped": self.skipped,
+            "stalls": self.stalls,
+        })
+        return info
+
+
+class _ReplaySource(FrameSource):
+    """
+    Base class of the sources replaying recorded frames. The timestamp of
+    a frame is start_time plus its position in the recording, in seconds.
+
+    Arguments:
+        realtime (bool): Hands out the frames at the pace they were recorded
+            at, instead of as fast as they are read
+        start_time (float): Timestamp of the first frame, None for the time
+            the source is opened
+    """
+
+    def __init__(self, realtime=False, start_time=None):
+        super().__init__()
+        self.realtime = realtime
+        self.start_time = start_time
+        self._first_timestamp = None
+        self._clock_start = None
+
+    @property
+    def live(self):
+        return self.realtime
+
+    def _start(self):
+        self._first_timestamp = self.start_time if self.start_time is not None else time.time()
+        self._clock_start = time.perf_counter()
+
+    def _timestamp(self, position):
+        """Returns the timestamp of the frame at position (seconds into the
+        recording), waiting for its time first in real time mode"""
+        if self.realtime:
+            delay = self._clock_start + position - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        return self._first_timestamp + position
+
+    def describe(self):
+        info = super().describe()
+        info["realtime"] = self.realtime
+        return info
+
+
+class VideoFileSource(_ReplaySource):
+    """
+    Reads a recorded video.
+
+    Arguments:
+        path (str): Path of the video
+        start_frame (int): Index of the first frame to read
+        realtime (bool): Hands out the frames at the frame rate of the video
+        start_time (float): Timestamp of the first frame, None for the time
+            the source is opened
+    """
+
+    def __init__(self, path, start_frame=0, realtime=False, start_time=None):
+        super().__init__(realtime, start_time)
+        self.path = path
+        self.start_frame = start_frame
+        self.frame_count = None
+        self.index = start_frame
+        self._capture = None
+
+    def open(self):
+        capture = cv2.VideoCapture(self.path)
+        if not capture.isOpened():
+            raise IOError(f"Could not open video {self.path}")
+        if self.start_frame > 0:
+            capture.set(cv2.CAP_PROP_POS_FRAMES, self.start_frame)
+
+        self.width = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+        self.frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.index = self.start_frame
+        self._capture = capture
+        self._start()
+
+    def read(self):
+        ret, frame = self._capture.read()
+        if not ret:
+            return False, None, None
+        timestamp = self._timestamp((self.index - self.start_frame) / self.fps)
+        self.index += 1
+        return True, frame, timestamp
+
+    def release(self):
+        if self._capture is not None:
+            self._capture.release()
+            self._capture = None
+
+    def describe(self):
+        info = super().describe()
+        info.update({"path": self.path, "frame_count": self.frame_count})
+        return info
+
+
+class ImageSequenceSource(_ReplaySource):
+    """
+    Reads a folder of images in file name order, as if they were the
+    frames of a video recorded at the given frame rate.
+
+    Arguments:
+        folder (str): Folder of the images
+        pattern (str): Glob pattern of the image files in the folder
+        fps (float): Frame rate the timestamps are computed with
+        realtime (bool): Hands out the frames at the given frame rate
+        start_time (float): Timestamp of the first frame, None for the time
+            the source is opened
+    """
+
+    def __init__(self, folder, pattern="*.png", fps=30.0, realtime=False, start_time=None):
+        super().__init__(realtime, start_time)
+        self.folder = folder
+        self.pattern = pattern
+        self.fps = fps
+        self.paths = []
+        self.index = 0
+
+    def open(self):
+        self.paths = sorted(glob.glob(os.path.join(self.folder, self.pattern)))
+        if not self.paths:
+            raise IOError(f"No images matching {self.pattern} in {self.folder}")
+
+        first = cv2.imread(self.paths[0])
+        if first is None:
+            raise IOError(f"Could not read image {self.paths[0]}")
+        self.height, self.width = first.shape[:2]
+        self.index = 0
+        self._start()
+
+    def read(self):
+        while self.index < len(self.paths):
+            frame = cv2.imread(self.paths[self.index])
+            position = self.index / self.fps
+            self.index += 1
+            if frame is not None:
+                return True, frame, self._timestamp(position)
+        return False, None, None
+
+    def describe(self):
+        info = super().describe()
+        info.update({"folder": self.folder, "frame_count": len(self.paths)})
+        return info
@@ -0,0 +1,376 @@
+# gaze_log.py
+# Columnar log of the analyzed frames of a session. Each frame is a row of
+# a preallocated numpy structured array (typed columns, no strings), the
+# post-processing reads the columns directly.
+#
+# The log is saved as .npz. The spreadsheet layout of the earlier sessions
+# (gaze_data.xlsx) is an export, generated from the log afterwards.
+#
+# While the session runs, the rows are also streamed to an append-only file
+# (GazeLogWriter), so a crashed session can be recovered from the disk:
+#
+#   magic (8 bytes) | header size (uint32) | JSON header | row | row | ...
+#
+# The rows are the raw bytes of LOG_DTYPE. The file can be read while it is
+# written, an incomplete last row is ignored (read_stream).
+import json
+import os
+import struct
+import threading
+from datetime import datetime
+
+import numpy as np
+
+from gaze_tracking import FrameQuality
+
+DIRECTIONS = ("Center", "Left", "Right", "Blinking")
+QUALITY_CODES = (
+    "OK",
+    FrameQuality.NO_FACE,
+    FrameQuality.FACE_TOO_SMALL,
+    FrameQuality.BLURRY,
+    FrameQuality.EYES_OUT_OF_FRAME,
+    FrameQuality.EYES_TOO_SMALL,
+)
+
+LOG_DTYPE = np.dtype([
+    ("time", np.float64),           # Seconds since the start of the session, never decreases
+    ("left_x", np.float32),         # Pupil coordinates in the frame, NaN if not located
+    ("left_y", np.float32),
+    ("right_x", np.float32),
+    ("right_y", np.float32),
+    ("direction", np.uint8),        # Index in DIRECTIONS
+    ("blinking", np.bool_),
+    ("duration", np.float32),       # Seconds spent in the current direction
+    ("quality", np.uint8),          # Index in QUALITY_CODES
+    ("level", np.int8),             # Rate control level, -1 if not recorded
+    ("detection_interval", np.uint16),
+    ("detection_scale", np.float32),
+    ("filter_size", np.uint8),
+])
+
+XLSX_HEADER = ["Timestamp", "Left Pupil", "Right Pupil", "Gaze Direction", "Blinking", "Duration(s)", "Quality"]
+XLSX_SETTINGS_HEADER = ["Quality Level", "Detection Interval", "Detection Scale", "Filter Size"]
+
+STREAM_MAGIC = b"GAZELOG1"
+_HEADER_SIZE = struct.Struct("<I")
+
+_DIRECTION_INDEX = {direction: index for index, direction in enumerate(DIRECTIONS)}
+_QUALITY_INDEX = {code: index for index, code in enumerate(QUALITY_CODES)}
+
+
+class GazeLog(object):
+    """
+    Log of the analyzed frames of a session, one row per frame.
+
+    Arguments:
+        capacity (int): Rows allocated upfront, the log doubles its size when it is full
+        record_settings (bool): The analysis settings of each frame are exported too
+        stream (GazeLogWriter): File the rows are streamed to as they are logged, or None
+    """
+
+    def __init__(self, capacity=18000, record_settings=True, stream=None):
+        self.record_settings = record_settings
+        # Wall clock time of the first frame (None if the times aren't wall clock based)
+        self.start_time = None
+        self._rows = np.zeros(capacity, LOG_DTYPE)
+        self._size = 0
+        self._direction_start = None
+        self._stream = stream
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def rows(self):
+        """The logged rows, as a view of the structured array"""
+        return self._rows[:self._size]
+
+    def column(self, name):
+        """Returns a column of the logged rows
+
+        Argument:
+            name (str): Name of the column, see LOG_DTYPE
+        """
+        return self._rows[name][:self._size]
+
+    def append(self, timestamp, sample, level=None, level_index=-1):
+        """Logs an analyzed frame. Returns the time spent in the current
+        gaze direction, in seconds.
+
+        Arguments:
+            timestamp (float): Capture time of the frame, in seconds
+            sample (gaze_tracking.GazeSample): Result of the analysis of the frame
+            level (rate_control.QualityLevel): Settings the frame was analyzed with
+            level_index (int): Position of the level in the rate control levels
+        """
+        if self._size == len(self._rows):
+            self._rows = np.concatenate((self._rows, np.zeros(len(self._rows), LOG_DTYPE)))
+
+        if self.start_time is None:
+            self.start_time = timestamp
+            if self._stream is not None:
+                self._stream.start(self.start_time, self.record_settings)
+        # Capture times can't go back, even if the clock of the source does
+        time = timestamp - self.start_time
+        if self._size and time < self._rows[self._size - 1]["time"]:
+            time = self._rows[self._size - 1]["time"]
+
+        direction = _DIRECTION_INDEX[sample.direction]
+        previous = self._rows[self._size - 1] if self._size else None
+        if previous is None or previous["direction"] != direction:
+            self._direction_start = time
+        duration = time - self._direction_start
+
+        left_x, left_y = sample.pupil_left if sample.pupil_left is not None else (np.nan, np.nan)
+        right_x, right_y = sample.pupil_right if sample.pupil_right is not None else (np.nan, np.nan)
+        if level is not None:
+            settings = (level.detection_interval, level.detection_scale, level.filter_size)
+        else:
+            settings = (0, 0.0, 0)
+
+        self._rows[self._size] = (
+            time,
+            left_x, left_y,
+            right_x, right_y,
+            direction,
+            bool(sample.blinking),
+            duration,
+            _QUALITY_INDEX[sample.quality or "OK"],
+            level_index,
+        ) + settings
+
+        if self._stream is not None:
+            self._stream.append(self._rows[self._size:self._size + 1])
+        self._size += 1
+        return duration
+
+    def gaze_points(self):
+        """Returns the x and y arrays of the gaze points: the middle of the
+        two pupils, on the frames where the pupils are located and the eyes open"""
+        rows = self.rows
+        x = (rows["left_x"].astype(np.float64) + rows["right_x"]) / 2
+        y = (rows["left_y"].astype(np.float64) + rows["right_y"]) / 2
+        keep = ~rows["blinking"] & ~np.isnan(x)
+        return x[keep], y[keep]
+
+    def save(self, filename):
+        """Saves the log to a .npz file
+
+        Argument:
+            filename (str): Path of the file
+        """
+        np.savez_compressed(
+            filename,
+            rows=self.rows,
+            directions=np.array(DIRECTIONS),
+            quality_codes=np.array(QUALITY_CODES),
+            start_time=np.array(np.nan if self.start_time is None else self.start_time),
+            record_settings=np.array(self.record_settings),
+        )
+
+    @classmethod
+    def load(cls, filename):
+        """Loads a log saved with save()
+
+        Argument:
+            filename (str): Path of the file
+        """
+        with np.load(filename) as data:
+            start_time = float(data["start_time"])
+            return cls.from_rows(
+                data["rows"],
+                record_settings=bool(data["record_settings"]),
+                start_time=None if np.isnan(start_time) else start_time,
+            )
+
+    @classmethod
+    def from_rows(cls, rows, record_settings=True, start_time=None):
+        """Returns a log holding a copy of the given rows
+
+        Arguments:
+            rows (numpy.ndarray): Rows of type LOG_DTYPE
+            record_settings (bool): The analysis settings of each frame are exported too
+            start_time (float): Wall clock time of the first frame, or None
+        """
+        log = cls(capacity=max(len(rows), 1), record_settings=record_settings)
+        log._rows[:len(rows)] = rows
+        log._size = len(rows)
+        log.start_time = start_time
+        return log
+
+    def to_rows(self, wall_clock=True):
+        """Returns the log in the spreadsheet layout, one list per frame
+
+        Argument:
+            wall_clock (bool): Timestamps are dates (wall clock capture times),
+                otherwise seconds since the start of the session
+        """
+        def pupil(x, y):
+            return "None" if np.isnan(x) else str((int(x), int(y)))
+
+        table = []
+        for row in self.rows.tolist():
+            time, left_x, left_y, right_x, right_y, direction, blinking, duration, quality = row[:9]
+            if wall_clock:
+                timestamp = datetime.fromtimestamp(self.start_time + time).strftime("%Y%m%d_%H%M%S")
+            else:
+                timestamp = round(time, 3)
+            line = [
+                timestamp,
+                pupil(left_x, left_y),
+                pupil(right_x, right_y),
+                DIRECTIONS[direction],
+                "Yes" if blinking else "No",
+                round(duration, 2),
+                QUALITY_CODES[quality],
+            ]
+            if self.record_settings:
+                level, detection_interval, detection_scale, filter_size = row[9:]
+                line.extend([level, detection_interval, round(detection_scale, 3), filter_size])
+            table.append(line)
+        return table
+
+    def export_xlsx(self, filename, wall_clock=True):
+        """Saves the log as a spreadsheet, in the layout of the earlier sessions (needs openpyxl)
+
+        Arguments:
+            filename (str): Path of the file
+            wall_clock (bool): Timestamps are dates, otherwise seconds since the start
+        """
+        from openpyxl import Workbook
+
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("Eye Tracking Data")
+        ws.append(XLSX_HEADER + (XLSX_SETTINGS_HEADER if self.record_settings else []))
+        for line in self.to_rows(wall_clock):
+            ws.append(line)
+        wb.save(filename)
+
+
+class GazeLogWriter(object):
+    """
+    Streams the rows of a GazeLog to an append-only file while the session
+    runs. The rows are handed to a writer thread, which writes them in
+    batches of at most batch_rows rows, at least every flush_interval
+    seconds, so a crash loses the last second of the session at most.
+
+    Arguments:
+        filename (str): Path of the file
+        metadata (dict): JSON serializable information saved in the header, e.g. the child id
+        batch_rows (int): Rows written at most per write
+        flush_interval (float): Seconds a row waits at most before being written
+        sync (bool): Every write is forced to the disk, so it survives a power loss
+    """
+
+    def __init__(self, filename, metadata=None, batch_rows=256, flush_interval=1.0, sync=True):
+        self.filename = filename
+        self.metadata = metadata or {}
+        self.batch_rows = batch_rows
+        self.flush_interval = flush_interval
+        self.sync = sync
+        self.rows_written = 0
+        # Last error of the writer thread, the rows of a failed write are lost
+        self.error = None
+
+        self._file = open(filename, "wb")
+        self._pending = []
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread = None
+
+    def start(self, start_time, record_settings):
+        """Writes the header and starts the writer thread, called by the log on its first row
+
+        Arguments:
+            start_time (float): Wall clock time of the first frame, or None
+            record_settings (bool): The analysis settings of each frame are exported too
+        """
+        header = json.dumps({
+            "dtype": LOG_DTYPE.descr,
+            "directions": DIRECTIONS,
+            "quality_codes": QUALITY_CODES,
+            "start_time": start_time,
+            "record_settings": record_settings,
+            "metadata": self.metadata,
+        }).encode()
+        self._write(STREAM_MAGIC + _HEADER_SIZE.pack(len(header)) + header)
+
+        self._thread = threading.Thread(target=self._run, name="gaze-log-writer", daemon=True)
+        self._thread.start()
+
+    def append(self, rows):
+        """Queues rows to be written
+
+        Argument:
+            rows (numpy.ndarray): Rows of type LOG_DTYPE, copied
+        """
+        with self._condition:
+            self._pending.append(rows.copy())
+            if len(self._pending) >= self.batch_rows:
+                self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._closed or len(self._pending) >= self.batch_rows, self.flush_interval
+                )
+                batch = self._pending[:self.batch_rows]
+                del self._pending[:self.batch_rows]
+                done = self._closed and not self._pending
+
+            if batch:
+                rows = np.concatenate(batch)
+                if self._write(rows.tobytes()):
+                    self.rows_written += len(rows)
+            if done:
+                break
+
+    def _write(self, data):
+        try:
+            self._file.write(data)
+            self._file.flush()
+            if self.sync:
+                os.fsync(self._file.fileno())
+        except (OSError, ValueError) as e:
+            self.error = e
+            print(f"Warning: could not write the gaze log stream {self.filename}: {e}")
+            return False
+        return True
+
+    def close(self):
+        """Writes the rows still queued and closes the file"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+        self._file.close()
+
+
+def read_stream(filename):
+    """Reads a file written by a GazeLogWriter, even one still being written
+    or left by a crash. Returns the GazeLog of the rows found and the
+    metadata of the header.
+
+    Argument:
+        filename (str): Path of the file
+    """
+    with open(filename, "rb") as f:
+        data = f.read()
+
+    start = len(STREAM_MAGIC) + _HEADER_SIZE.size
+    if len(data) < start or data[:len(STREAM_MAGIC)] != STREAM_MAGIC:
+        raise ValueError(f"{filename} is not a gaze log stream, or its header was never written")
+    header_size, = _HEADER_SIZE.unpack_from(data, len(STREAM_MAGIC))
+    if len(data) < start + header_size:
+        raise ValueError(f"The header of {filename} is incomplete")
+    header = json.loads(data[start:start + header_size].decode())
+    if np.dtype([tuple(field) for field in header["dtype"]]) != LOG_DTYPE:
+        raise ValueError(f"{filename} was written with another version of the gaze log")
+
+    body = data[start + header_size:]
+    rows = np.frombuffer(body, LOG_DTYPE, len(body) // LOG_DTYPE.itemsize)
+    gaze_log = GazeLog.from_rows(rows, header["record_settings"], header["start_time"])
+    return gaze_log, header["metadata"]
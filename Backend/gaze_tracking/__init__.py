@@ -1 +1,5 @@
 from .gaze_tracking import GazeTracking
+from .gaze_sample import GazeSample
+from .calibration_store import CalibrationStore
+from .frame_quality import FrameQuality
+from .profiler import PROFILER
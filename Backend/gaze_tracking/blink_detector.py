@@ -0,0 +1,49 @@
+class BlinkDetector(object):
+    """
+    This class decides whether the eyes are closed from the eye aspect
+    ratio (EAR) of successive frames. It uses hysteresis, so the state
+    doesn't flicker when the EAR hovers around a single threshold:
+    the eyes are closed once the EAR stays below close_threshold for
+    closed_frames frames, and open again once it rises above open_threshold.
+
+    Arguments:
+        close_threshold (float): EAR below which the eyes are closing
+        open_threshold (float): EAR above which the eyes are open again
+        closed_frames (int): Consecutive frames under close_threshold to detect a blink
+    """
+
+    def __init__(self, close_threshold=0.26, open_threshold=0.29, closed_frames=2):
+        self.close_threshold = close_threshold
+        self.open_threshold = open_threshold
+        self.closed_frames = closed_frames
+        self.closed = False
+        self._frames_below = 0
+
+    def reset(self):
+        """Forgets the previous frames, the eyes are considered open"""
+        self.closed = False
+        self._frames_below = 0
+
+    def update(self, ear):
+        """Updates the state with the EAR of a new frame and returns True if
+        the eyes are closed
+
+        Argument:
+            ear (float): Eye aspect ratio of the frame, None if no face was found
+        """
+        if ear is None:
+            self.reset()
+            return self.closed
+
+        if ear < self.close_threshold:
+            self._frames_below += 1
+        else:
+            self._frames_below = 0
+
+        if self.closed:
+            if ear > self.open_threshold:
+                self.closed = False
+        elif self._frames_below >= self.closed_frames:
+            self.closed = True
+
+        return self.closed
@@ -1,22 +1,120 @@
 from __future__ import division
 import cv2
+import numpy as np
 from .pupil import Pupil
+from .profiler import PROFILER
 
 
 class Calibration(object):
     """
     This class calibrates the pupil detection algorithm by finding the
     best binarization threshold value for the person and the webcam.
+
+    Once an eye is calibrated, the intensity histogram of its frames is
+    watched. When the lighting changes, the eye is calibrated again on a
+    few frames (nb_recalibration_frames).
     """
 
+    # Candidate binarization thresholds, tried in this order
+    THRESHOLDS = np.arange(5, 100, 5)
+
+    # Share of the eye surface the iris takes up with the best threshold
+    AVERAGE_IRIS_SIZE = 0.48
+
+    # Bins of the eye frame histograms used to detect lighting changes
+    HISTOGRAM_BINS = 16
+
     def __init__(self):
         self.nb_frames = 20
-        self.thresholds_left = []
-        self.thresholds_right = []
 
-    def is_complete(self):
-        """Returns true if the calibration is completed"""
-        return len(self.thresholds_left) >= self.nb_frames and len(self.thresholds_right) >= self.nb_frames
+        # Seeded thresholds are checked on the first frames of the session
+        self.nb_validation_frames = 5
+        self.validation_tolerance = 0.12
+        self._validation = {}
+
+        # Lighting changes: the histogram of the recent frames (moving average)
+        # is compared to a reference histogram taken after the calibration
+        self.nb_reference_frames = 10
+        self.nb_recalibration_frames = 10
+        self.histogram_smoothing = 0.1
+        self.lighting_tolerance = 0.25
+        self.recalibrations = 0
+
+        # Running sum and count of the thresholds found for each eye
+        self._sums = [0, 0]
+        self._counts = [0, 0]
+        self._targets = [self.nb_frames, self.nb_frames]
+        self._references = [None, None]
+        self._reference_counts = [0, 0]
+        self._recent = [None, None]
+
+    def _restart(self, side, nb_frames):
+        """Forgets the thresholds of an eye, it is calibrated again on nb_frames frames"""
+        self._sums[side] = 0
+        self._counts[side] = 0
+        self._targets[side] = nb_frames
+        self._references[side] = None
+        self._reference_counts[side] = 0
+        self._recent[side] = None
+        self._validation.pop(side, None)
+
+    def seed(self, threshold_left, threshold_right):
+        """Starts from the thresholds of a previous session, so the calibration
+        is complete right away. They are checked on the next frames and a full
+        calibration starts over for an eye whose threshold no longer fits.
+
+        Arguments:
+            threshold_left (int): Threshold of the left eye
+            threshold_right (int): Threshold of the right eye
+        """
+        for side, threshold in enumerate((threshold_left, threshold_right)):
+            self._restart(side, self.nb_frames)
+            self._sums[side] = threshold * self.nb_frames
+            self._counts[side] = self.nb_frames
+        self._validation = {0: [], 1: []}
+
+    def recalibrate(self):
+        """Calibrates both eyes again, e.g. when the filter of the pupil
+        detection changes: an eye already calibrated is calibrated on
+        nb_recalibration_frames frames, the others start their calibration over"""
+        for side in (0, 1):
+            nb_frames = self.nb_recalibration_frames if self.is_complete(side) else self._targets[side]
+            self._restart(side, nb_frames)
+        self.recalibrations += 1
+        PROFILER.count("recalibrations")
+
+    def is_complete(self, side=None):
+        """Returns true if the calibration is completed
+
+        Argument:
+            side: Only checks the left eye (0) or the right eye (1), both eyes by default
+        """
+        if side is None:
+            return self.is_complete(0) and self.is_complete(1)
+        return self._counts[side] >= self._targets[side]
+
+    def is_validating(self, side):
+        """Returns true while the seeded threshold of the given eye is being checked"""
+        return side in self._validation
+
+    def validate(self, iris_frame, side):
+        """Checks the seeded threshold against a frame binarized with it. Once
+        enough frames are checked, the calibration of the eye starts over if the
+        iris size was too far from the expected one.
+
+        Arguments:
+            iris_frame (numpy.ndarray): Eye frame binarized with the seeded threshold
+            side: Indicates whether it's the left eye (0) or the right eye (1)
+        """
+        iris_sizes = self._validation[side]
+        iris_sizes.append(self.iris_size(iris_frame))
+        if len(iris_sizes) < self.nb_validation_frames:
+            return
+
+        del self._validation[side]
+        error = sum(abs(size - self.AVERAGE_IRIS_SIZE) for size in iris_sizes) / len(iris_sizes)
+        if error > self.validation_tolerance:
+            self._restart(side, self.nb_frames)
 
     def threshold(self, side):
         """Returns the threshold value for the given eye.
@@ -24,10 +122,7 @@ class Calibration(object):
         Argument:
             side: Indicates whether it's the left eye (0) or the right eye (1)
         """
-        if side == 0:
-            return int(sum(self.thresholds_left) / len(self.thresholds_left))
-        elif side == 1:
-            return int(sum(self.thresholds_right) / len(self.thresholds_right))
+        return int(self._sums[side] / self._counts[side])
 
     @staticmethod
     def iris_size(frame):
@@ -44,34 +139,90 @@ class Calibration(object):
         return nb_blacks / nb_pixels
 
     @staticmethod
-    def find_best_threshold(eye_frame):
+    def find_best_threshold(eye_frame, filter_size=Pupil.FILTER_SIZE):
         """Calculates the optimal threshold to binarize the
         frame for the given eye.
 
-        Argument:
+        The frame is filtered once, then the iris size for every candidate
+        threshold is read from the cumulative histogram of the filtered
+        frame: a pixel is black after binarization if it is <= threshold.
+
+        Arguments:
             eye_frame (numpy.ndarray): Frame of the eye to be analyzed
+            filter_size (int): Diameter of the bilateral filter used by the pupil detection
         """
-        average_iris_size = 0.48
-        trials = {}
+        average_iris_size = Calibration.AVERAGE_IRIS_SIZE
 
-        for threshold in range(5, 100, 5):
-            iris_frame = Pupil.image_processing(eye_frame, threshold)
-            trials[threshold] = Calibration.iris_size(iris_frame)
+        filtered = Pupil.filter(eye_frame, filter_size)[5:-5, 5:-5]
+        nb_pixels = filtered.shape[0] * filtered.shape[1]
+        cumulative = np.bincount(filtered.ravel(), minlength=256).cumsum()
+        iris_sizes = cumulative[Calibration.THRESHOLDS] / nb_pixels
 
-        best_threshold, iris_size = min(trials.items(), key=(lambda p: abs(p[1] - average_iris_size)))
-        return best_threshold
+        best = np.argmin(np.abs(iris_sizes - average_iris_size))
+        return int(Calibration.THRESHOLDS[best])
 
-    def evaluate(self, eye_frame, side):
+    def evaluate(self, eye_frame, side, filter_size=Pupil.FILTER_SIZE):
         """Improves calibration by taking into consideration the
         given image.
 
+        Arguments:
+            eye_frame (numpy.ndarray): Frame of the eye
+            side: Indicates whether it's the left eye (0) or the right eye (1)
+            filter_size (int): Diameter of the bilateral filter used by the pupil detection
+        """
+        with PROFILER.stage("calibration"):
+            threshold = self.find_best_threshold(eye_frame, filter_size)
+        self._sums[side] += threshold
+        self._counts[side] += 1
+        PROFILER.count("calibration_frames")
+
+    @staticmethod
+    def histogram(eye_frame):
+        """Returns the normalized intensity histogram of an eye frame. The white
+        pixels (255) around the eye are left out.
+
+        Argument:
+            eye_frame (numpy.ndarray): Frame of the eye
+        """
+        histogram = cv2.calcHist([eye_frame], [0], None, [Calibration.HISTOGRAM_BINS], [0, 255]).ravel()
+        total = histogram.sum()
+        if total == 0:
+            return None
+        return histogram / total
+
+    def observe(self, eye_frame, side):
+        """Watches the lighting on the eye once it is calibrated, and starts
+        a short calibration again if it changed. Returns true in that case.
+
         Arguments:
             eye_frame (numpy.ndarray): Frame of the eye
             side: Indicates whether it's the left eye (0) or the right eye (1)
         """
-        threshold = self.find_best_threshold(eye_frame)
+        histogram = self.histogram(eye_frame)
+        if histogram is None:
+            return False
+
+        # The reference is the average histogram of the first frames after calibration
+        count = self._reference_counts[side]
+        if count < self.nb_reference_frames:
+            reference = self._references[side]
+            if reference is None:
+                self._references[side] = histogram
+            else:
+                self._references[side] = reference + (histogram - reference) / (count + 1)
+            self._reference_counts[side] = count + 1
+            self._recent[side] = self._references[side]
+            return False
+
+        recent = self._recent[side]
+        recent = recent + self.histogram_smoothing * (histogram - recent)
+        self._recent[side] = recent
 
-        if side == 0:
-            self.thresholds_left.append(threshold)
-        elif side == 1:
-            self.thresholds_right.append(threshold)
+        # Total variation distance, between 0.0 (same) and 1.0 (disjoint)
+        distance = 0.5 * np.abs(recent - self._references[side]).sum()
+        if distance > self.lighting_tolerance:
+            self._restart(side, self.nb_recalibration_frames)
+            self.recalibrations += 1
+            PROFILER.count("recalibrations")
+            return True
+        return False
@@ -0,0 +1,68 @@
+import json
+import os
+import threading
+from datetime import datetime
+
+
+class CalibrationStore(object):
+    """
+    This class keeps the calibration thresholds of each child, per camera,
+    so that a new session can start from the thresholds of the last one.
+    There is one JSON file per child in the store folder.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._lock = threading.Lock()
+
+    def _path(self, child_id):
+        return os.path.join(self.folder, "{}.json".format(child_id))
+
+    def _read(self, child_id):
+        try:
+            with open(self._path(child_id), "r") as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def load(self, child_id, camera_id):
+        """Returns the stored (left, right) thresholds, or None if there are none
+
+        Arguments:
+            child_id: Identifier of the child
+            camera_id (str): Identifier of the camera and its resolution
+        """
+        with self._lock:
+            profile = self._read(child_id).get(camera_id)
+        if not profile:
+            return None
+        return profile["threshold_left"], profile["threshold_right"]
+
+    def save(self, child_id, camera_id, calibration):
+        """Stores the thresholds of a complete calibration. Returns false if
+        the calibration is not complete.
+
+        Arguments:
+            child_id: Identifier of the child
+            camera_id (str): Identifier of the camera and its resolution
+            calibration (calibration.Calibration): Calibration of the session
+        """
+        if not calibration.is_complete():
+            return False
+
+        with self._lock:
+            profiles = self._read(child_id)
+            profiles[camera_id] = {
+                "threshold_left": calibration.threshold(0),
+                "threshold_right": calibration.threshold(1),
+                "updated_at": datetime.now().strftime("%Y%m%d_%H%M%S"),
+            }
+
+            # Written next to the final file and renamed, so a crash never leaves half a profile
+            os.makedirs(self.folder, exist_ok=True)
+            path = self._path(child_id)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(profiles, f, indent=4)
+            os.replace(tmp_path, path)
+        return True
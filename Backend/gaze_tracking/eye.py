@@ -1,7 +1,36 @@
-import math
 import numpy as np
 import cv2
+from .landmarks import LEFT_EYE_POINTS, RIGHT_EYE_POINTS, eye_aspect_ratio, width_height_ratio
 from .pupil import Pupil
+from .profiler import PROFILER
+
+
+class EyeMask(object):
+    """
+    This class keeps the polygon mask of an eye between frames, so the
+    mask is only redrawn when the eye geometry changes.
+    """
+
+    def __init__(self):
+        self.mask = None
+        self._key = None
+
+    def get(self, region, shape):
+        """Returns a mask of the given shape where the eye polygon is
+        white (255) and everything else is black (0)
+
+        Arguments:
+            region (numpy.ndarray): Points of the eye polygon, relative to the crop
+            shape (tuple): Height and width of the crop
+        """
+        key = (shape, region.tobytes())
+        if key != self._key:
+            if self.mask is None or self.mask.shape != shape:
+                self.mask = np.empty(shape, np.uint8)
+            self.mask.fill(0)
+            cv2.fillPoly(self.mask, [region], 255)
+            self._key = key
+        return self.mask
 
 
 class Eye(object):
@@ -10,95 +39,59 @@ class Eye(object):
     initiates the pupil detection.
     """
 
-    LEFT_EYE_POINTS = [36, 37, 38, 39, 40, 41]
-    RIGHT_EYE_POINTS = [42, 43, 44, 45, 46, 47]
+    LEFT_EYE_POINTS = LEFT_EYE_POINTS
+    RIGHT_EYE_POINTS = RIGHT_EYE_POINTS
 
-    def __init__(self, original_frame, landmarks, side, calibration):
+    def __init__(self, original_frame, landmarks, side, calibration, eye_mask=None, filter_size=Pupil.FILTER_SIZE):
         self.frame = None
         self.origin = None
         self.center = None
         self.pupil = None
         self.landmark_points = None
+        self.blinking = None
+        self.aspect_ratio = None
+        self._eye_mask = eye_mask if eye_mask is not None else EyeMask()
+        self._filter_size = filter_size
 
-        self._analyze(original_frame, landmarks, side, calibration)
-
-    @staticmethod
-    def _middle_point(p1, p2):
-        """Returns the middle point (x,y) between two points
-
-        Arguments:
-            p1 (dlib.point): First point
-            p2 (dlib.point): Second point
-        """
-        x = int((p1.x + p2.x) / 2)
-        y = int((p1.y + p2.y) / 2)
-        return (x, y)
+        with PROFILER.stage("eye"):
+            self._analyze(original_frame, landmarks, side, calibration)
 
-    def _isolate(self, frame, landmarks, points):
+    def _isolate(self, frame, region):
         """Isolate an eye, to have a frame without other part of the face.
 
         Arguments:
             frame (numpy.ndarray): Frame containing the face
-            landmarks (dlib.full_object_detection): Facial landmarks for the face region
-            points (list): Points of an eye (from the 68 Multi-PIE landmarks)
+            region (numpy.ndarray): Points of the eye, as a (6, 2) array
         """
-        region = np.array([(landmarks.part(point).x, landmarks.part(point).y) for point in points])
-        region = region.astype(np.int32)
         self.landmark_points = region
 
-        # Applying a mask to get only the eye
-        height, width = frame.shape[:2]
-        black_frame = np.zeros((height, width), np.uint8)
-        mask = np.full((height, width), 255, np.uint8)
-        cv2.fillPoly(mask, [region], (0, 0, 0))
-        eye = cv2.bitwise_not(black_frame, frame.copy(), mask=mask)
-
         # Cropping on the eye
         margin = 5
-        min_x = np.min(region[:, 0]) - margin
-        max_x = np.max(region[:, 0]) + margin
-        min_y = np.min(region[:, 1]) - margin
-        max_y = np.max(region[:, 1]) + margin
-
-        self.frame = eye[min_y:max_y, min_x:max_x]
+        height, width = frame.shape[:2]
+        min_x = max(np.min(region[:, 0]) - margin, 0)
+        max_x = min(np.max(region[:, 0]) + margin, width)
+        min_y = max(np.min(region[:, 1]) - margin, 0)
+        max_y = min(np.max(region[:, 1]) + margin, height)
+        crop = frame[min_y:max_y, min_x:max_x]
+
+        # Applying a mask to get only the eye, the rest of the crop is white
+        mask = self._eye_mask.get(region - (min_x, min_y), crop.shape[:2])
+        eye = np.full(crop.shape[:2], 255, np.uint8)
+        cv2.copyTo(crop, mask, eye)
+
+        self.frame = eye
         self.origin = (min_x, min_y)
 
         height, width = self.frame.shape[:2]
         self.center = (width / 2, height / 2)
 
-    def _blinking_ratio(self, landmarks, points):
-        """Calculates a ratio that can indicate whether an eye is closed or not.
-        It's the division of the width of the eye, by its height.
-
-        Arguments:
-            landmarks (dlib.full_object_detection): Facial landmarks for the face region
-            points (list): Points of an eye (from the 68 Multi-PIE landmarks)
-
-        Returns:
-            The computed ratio
-        """
-        left = (landmarks.part(points[0]).x, landmarks.part(points[0]).y)
-        right = (landmarks.part(points[3]).x, landmarks.part(points[3]).y)
-        top = self._middle_point(landmarks.part(points[1]), landmarks.part(points[2]))
-        bottom = self._middle_point(landmarks.part(points[5]), landmarks.part(points[4]))
-
-        eye_width = math.hypot((left[0] - right[0]), (left[1] - right[1]))
-        eye_height = math.hypot((top[0] - bottom[0]), (top[1] - bottom[1]))
-
-        try:
-            ratio = eye_width / eye_height
-        except ZeroDivisionError:
-            ratio = None
-
-        return ratio
-
     def _analyze(self, original_frame, landmarks, side, calibration):
         """Detects and isolates the eye in a new frame, sends data to the calibration
         and initializes Pupil object.
 
         Arguments:
             original_frame (numpy.ndarray): Frame passed by the user
-            landmarks (dlib.full_object_detection): Facial landmarks for the face region
+            landmarks (numpy.ndarray): The 68 facial landmarks, as a (68, 2) array
             side: Indicates whether it's the left eye (0) or the right eye (1)
             calibration (calibration.Calibration): Manages the binarization threshold value
         """
@@ -109,11 +102,21 @@ class Eye(object):
         else:
             return
 
-        self.blinking = self._blinking_ratio(landmarks, points)
-        self._isolate(original_frame, landmarks, points)
+        region = landmarks[points]
+        self.blinking = width_height_ratio(region)
+        self.aspect_ratio = eye_aspect_ratio(region)
+        with PROFILER.stage("isolate"):
+            self._isolate(original_frame, region)
+
+        with PROFILER.stage("pupil"):
+            if not calibration.is_complete(side):
+                calibration.evaluate(self.frame, side, self._filter_size)
+            elif calibration.observe(self.frame, side):
+                # The lighting changed, the recalibration starts with this frame
+                calibration.evaluate(self.frame, side, self._filter_size)
 
-        if not calibration.is_complete():
-            calibration.evaluate(self.frame, side)
+            threshold = calibration.threshold(side)
+            self.pupil = Pupil(self.frame, threshold, self._filter_size)
 
-        threshold = calibration.threshold(side)
-        self.pupil = Pupil(self.frame, threshold)
+            if calibration.is_validating(side):
+                calibration.validate(self.pupil.iris_frame, side)
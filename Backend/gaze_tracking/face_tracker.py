@@ -0,0 +1,249 @@
+from __future__ import division
+import cv2
+import dlib
+import numpy as np
+from .landmarks import landmarks_to_array, bounding_box
+from .profiler import PROFILER
+
+
+class FaceTracker(object):
+    """
+    This class finds the face to analyze in each frame. The face detector
+    only runs on keyframes, in between the face region is predicted from
+    the facial landmarks of the previous frame.
+
+    The landmarks predictor always places its points inside the region it
+    is given, even when the face has left it. The tracking confidence is
+    therefore the correlation of the tracked face region with the face
+    found on the keyframe: it drops as soon as the region shows something
+    else, and the face is detected again.
+
+    The face detector can run on a downscaled copy of the frame, the face
+    it finds is mapped back so the landmarks are located at full resolution.
+
+    An optional face_check(frame, face) callable can reject the face region
+    before its landmarks are located. It returns a reason code, or None if
+    the face is usable; the reason of the last frame is kept in rejection.
+    """
+
+    # Width and height of the face patches compared to check the tracking
+    PATCH_SIZE = 32
+
+    def __init__(self, face_detector, predictor, detection_interval=1, min_confidence=0.5, detection_scale=1.0,
+                 face_check=None):
+        self.detection_interval = detection_interval
+        self.min_confidence = min_confidence
+        self.detection_scale = detection_scale
+        self.face_check = face_check
+        self.face = None
+        self.confidence = None
+        self.rejection = None
+
+        self._face_detector = face_detector
+        self._predictor = predictor
+        self._frames_since_detection = 0
+        self._box_fit = None
+        self._template = None
+
+    @staticmethod
+    def _overlap(rect_a, rect_b):
+        """Returns the intersection over union of two rectangles, between 0.0 and 1.0
+
+        Arguments:
+            rect_a (dlib.rectangle): First rectangle
+            rect_b (dlib.rectangle): Second rectangle
+        """
+        intersection = rect_a.intersect(rect_b)
+        if intersection.is_empty():
+            return 0.0
+        union = rect_a.area() + rect_b.area() - intersection.area()
+        return intersection.area() / union
+
+    def _fit(self, face, box):
+        """Remembers where the detector box lies relative to the landmarks box,
+        so that the next landmarks can be turned back into a detector-like box
+
+        Arguments:
+            face (dlib.rectangle): Face found by the detector
+            box (tuple): Bounding box of the landmarks found in that face
+        """
+        width = max(box[2] - box[0], 1)
+        height = max(box[3] - box[1], 1)
+        self._box_fit = (
+            (face.left() - box[0]) / width,
+            (face.top() - box[1]) / height,
+            face.width() / width,
+            face.height() / height,
+        )
+
+    def _patch(self, frame, face):
+        """Returns the face region resized to PATCH_SIZE x PATCH_SIZE, or None
+        if it lies outside of the frame
+
+        Arguments:
+            frame (numpy.ndarray): Grayscale frame
+            face (dlib.rectangle): Face region
+        """
+        height, width = frame.shape[:2]
+        left, top = max(face.left(), 0), max(face.top(), 0)
+        right, bottom = min(face.right() + 1, width), min(face.bottom() + 1, height)
+        if right - left < 2 or bottom - top < 2:
+            return None
+        size = (self.PATCH_SIZE, self.PATCH_SIZE)
+        return cv2.resize(frame[top:bottom, left:right], size, interpolation=cv2.INTER_AREA)
+
+    def _similarity(self, patch):
+        """Returns the normalized correlation of a face patch with the one of
+        the keyframe, between -1.0 and 1.0 (0.0 if it can't be compared)
+
+        Argument:
+            patch (numpy.ndarray): Face patch, see _patch()
+        """
+        if patch is None or self._template is None:
+            return 0.0
+        score = float(cv2.matchTemplate(patch, self._template, cv2.TM_CCOEFF_NORMED)[0, 0])
+        # A uniform patch has no correlation
+        return score if np.isfinite(score) else 0.0
+
+    def _predict_face(self, box):
+        """Returns the face rectangle matching a landmarks bounding box
+
+        Argument:
+            box (tuple): Bounding box of the landmarks
+        """
+        width = max(box[2] - box[0], 1)
+        height = max(box[3] - box[1], 1)
+        offset_x, offset_y, scale_x, scale_y = self._box_fit
+        left = int(round(box[0] + offset_x * width))
+        top = int(round(box[1] + offset_y * height))
+        right = int(round(left + scale_x * width)) - 1
+        bottom = int(round(top + scale_y * height)) - 1
+        return dlib.rectangle(left, top, right, bottom)
+
+    def _find_faces(self, frame):
+        """Runs the face detector, on a downscaled frame if detection_scale < 1,
+        and returns the faces in the coordinates of the full resolution frame
+
+        Argument:
+            frame (numpy.ndarray): Grayscale frame
+        """
+        scale = self.detection_scale
+        if scale >= 1.0:
+            return list(self._face_detector(frame))
+
+        small_frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        return [
+            dlib.rectangle(
+                int(face.left() / scale),
+                int(face.top() / scale),
+                int((face.right() + 1) / scale) - 1,
+                int((face.bottom() + 1) / scale) - 1,
+            )
+            for face in self._face_detector(small_frame)
+        ]
+
+    def _select(self, faces):
+        """Picks the face to follow among the detected ones: the one that
+        overlaps the most with the face followed so far, or the first one
+
+        Argument:
+            faces (list): Faces found by the detector (dlib.rectangle)
+        """
+        if self.face is None or len(faces) == 1:
+            return faces[0]
+        return max(faces, key=lambda face: self._overlap(face, self.face))
+
+    def _reject(self, frame, face):
+        """Runs the face check on a face region, returns true if it is rejected
+
+        Arguments:
+            frame (numpy.ndarray): Grayscale frame
+            face (dlib.rectangle): Face region
+        """
+        if self.face_check is not None:
+            self.rejection = self.face_check(frame, face)
+        return self.rejection is not None
+
+    def _track(self, frame):
+        """Locates the landmarks inside the face region predicted from the
+        previous frame. Returns None if the tracking confidence is too low.
+
+        Argument:
+            frame (numpy.ndarray): Grayscale frame
+        """
+        with PROFILER.stage("landmarks"):
+            landmarks = landmarks_to_array(self._predictor(frame, self.face))
+        face = self._predict_face(bounding_box(landmarks))
+        # The landmarks stay in the region even if the face left it, the content of the region tells
+        self.confidence = min(self._overlap(face, self.face), self._similarity(self._patch(frame, face)))
+
+        if self.confidence < self.min_confidence:
+            PROFILER.count("tracking_lost")
+            return None
+
+        self.face = face
+        self._frames_since_detection += 1
+        PROFILER.count("tracked_frames")
+        return landmarks
+
+    def _detect(self, frame):
+        """Runs the face detector and locates the landmarks of the selected face.
+        Returns None if there is no face in the frame.
+
+        Argument:
+            frame (numpy.ndarray): Grayscale frame
+        """
+        with PROFILER.stage("detect"):
+            faces = self._find_faces(frame)
+        PROFILER.count("detections")
+        PROFILER.count("faces_found", len(faces))
+        if len(faces) == 0:
+            self.reset()
+            return None
+
+        face = self._select(faces)
+        if self._reject(frame, face):
+            return None
+
+        with PROFILER.stage("landmarks"):
+            landmarks = landmarks_to_array(self._predictor(frame, face))
+        box = bounding_box(landmarks)
+        self._fit(face, box)
+
+        self.face = self._predict_face(box)
+        self._template = self._patch(frame, self.face)
+        self.confidence = 1.0
+        self._frames_since_detection = 0
+        return landmarks
+
+    def reset(self):
+        """Forgets the followed face, the next frame will be a keyframe"""
+        self.face = None
+        self.confidence = None
+        self._box_fit = None
+        self._template = None
+        self._frames_since_detection = 0
+
+    def landmarks(self, frame):
+        """Returns the facial landmarks of the followed face as a (68, 2) array,
+        or None if no face is found or if the face is rejected by the face check
+
+        Argument:
+            frame (numpy.ndarray): Grayscale frame
+        """
+        self.rejection = None
+        tracking = (
+            self.face is not None
+            and self._frames_since_detection + 1 < self.detection_interval
+        )
+        if tracking:
+            # A rejected frame still counts, so the face is detected again in time
+            if self._reject(frame, self.face):
+                self._frames_since_detection += 1
+                return None
+
+            landmarks = self._track(frame)
+            if landmarks is not None:
+                return landmarks
+
+        return self._detect(frame)
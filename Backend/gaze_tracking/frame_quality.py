@@ -0,0 +1,83 @@
+from __future__ import division
+import cv2
+from .landmarks import LEFT_EYE_POINTS, RIGHT_EYE_POINTS, bounding_box
+
+
+class FrameQuality(object):
+    """
+    This class rejects unusable frames early, with cheap checks made before
+    the expensive stages: the face region is checked before its landmarks
+    are located, the eye regions before the eyes are isolated and the
+    pupils detected. Each rejection has a reason code.
+
+    Arguments:
+        min_face_size (int): Minimum width of the face region, in pixels
+        min_sharpness (float): Minimum variance of the Laplacian of the face
+            region, once resized to SHARPNESS_WIDTH pixels wide (motion blur)
+        min_eye_width (int): Minimum width of each eye, in pixels
+        eye_margin (int): Space needed around the eyes, inside the frame
+    """
+
+    NO_FACE = "no_face"
+    FACE_TOO_SMALL = "face_too_small"
+    BLURRY = "blurry"
+    EYES_OUT_OF_FRAME = "eyes_out_of_frame"
+    EYES_TOO_SMALL = "eyes_too_small"
+
+    # The sharpness is measured at a fixed width, so it doesn't depend on the face size
+    SHARPNESS_WIDTH = 96
+
+    def __init__(self, min_face_size=60, min_sharpness=8.0, min_eye_width=10, eye_margin=5):
+        self.min_face_size = min_face_size
+        self.min_sharpness = min_sharpness
+        self.min_eye_width = min_eye_width
+        self.eye_margin = eye_margin
+
+    def sharpness(self, frame, face):
+        """Returns the variance of the Laplacian of the face region, low when it is blurred
+
+        Arguments:
+            frame (numpy.ndarray): Grayscale frame
+            face (dlib.rectangle): Face region
+        """
+        height, width = frame.shape[:2]
+        left, top = max(face.left(), 0), max(face.top(), 0)
+        right, bottom = min(face.right() + 1, width), min(face.bottom() + 1, height)
+        if right - left < 2 or bottom - top < 2:
+            return 0.0
+
+        region = frame[top:bottom, left:right]
+        scale = self.SHARPNESS_WIDTH / region.shape[1]
+        region = cv2.resize(region, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        return cv2.Laplacian(region, cv2.CV_32F).var()
+
+    def check_face(self, frame, face):
+        """Returns the reason code if the face region is unusable, None otherwise
+
+        Arguments:
+            frame (numpy.ndarray): Grayscale frame
+            face (dlib.rectangle): Face region
+        """
+        if face.width() < self.min_face_size:
+            return self.FACE_TOO_SMALL
+        if self.sharpness(frame, face) < self.min_sharpness:
+            return self.BLURRY
+        return None
+
+    def check_eyes(self, frame, landmarks):
+        """Returns the reason code if an eye is unusable, None otherwise
+
+        Arguments:
+            frame (numpy.ndarray): Grayscale frame
+            landmarks (numpy.ndarray): The 68 facial landmarks, as a (68, 2) array
+        """
+        height, width = frame.shape[:2]
+        margin = self.eye_margin
+
+        for points in (LEFT_EYE_POINTS, RIGHT_EYE_POINTS):
+            left, top, right, bottom = bounding_box(landmarks[points])
+            if left < margin or top < margin or right >= width - margin or bottom >= height - margin:
+                return self.EYES_OUT_OF_FRAME
+            if right - left < self.min_eye_width:
+                return self.EYES_TOO_SMALL
+        return None
@@ -0,0 +1,64 @@
+class GazeSample(object):
+    """
+    This class holds the result of the analysis of one frame. Everything
+    is computed once by GazeTracking, a sample can't be modified afterwards.
+
+    Attributes:
+        pupil_left (tuple): Coordinates (x,y) of the left pupil in the frame, or None
+        pupil_right (tuple): Coordinates (x,y) of the right pupil in the frame, or None
+        horizontal_ratio (float): Horizontal direction of the gaze, between 0.0 and 1.0
+        vertical_ratio (float): Vertical direction of the gaze, between 0.0 and 1.0
+        blinking_ratio (float): Average width/height ratio of the eyes
+        eye_aspect_ratio (float): Average eye aspect ratio (EAR) of the eyes
+        blinking (bool): True if the eyes are closed
+        direction (str): "Blinking", "Right", "Left" or "Center"
+        landmarks (numpy.ndarray): The 68 facial landmarks as a (68, 2) array, or None
+        quality (str): Reason code if the frame was rejected as unusable, None otherwise
+    """
+
+    __slots__ = (
+        "pupil_left",
+        "pupil_right",
+        "horizontal_ratio",
+        "vertical_ratio",
+        "blinking_ratio",
+        "eye_aspect_ratio",
+        "blinking",
+        "direction",
+        "landmarks",
+        "quality",
+    )
+
+    def __init__(self, pupil_left=None, pupil_right=None, horizontal_ratio=None, vertical_ratio=None,
+                 blinking_ratio=None, eye_aspect_ratio=None, blinking=False, direction="Center",
+                 landmarks=None, quality=None):
+        set_field = super(GazeSample, self).__setattr__
+        set_field("pupil_left", pupil_left)
+        set_field("pupil_right", pupil_right)
+        set_field("horizontal_ratio", horizontal_ratio)
+        set_field("vertical_ratio", vertical_ratio)
+        set_field("blinking_ratio", blinking_ratio)
+        set_field("eye_aspect_ratio", eye_aspect_ratio)
+        set_field("blinking", blinking)
+        set_field("direction", direction)
+        set_field("landmarks", landmarks)
+        set_field("quality", quality)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("GazeSample is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("GazeSample is immutable")
+
+    def __reduce__(self):
+        return (GazeSample, tuple(getattr(self, name) for name in self.__slots__))
+
+    def __repr__(self):
+        return "GazeSample(direction={!r}, pupil_left={!r}, pupil_right={!r})".format(
+            self.direction, self.pupil_left, self.pupil_right
+        )
+
+    @property
+    def pupils_located(self):
+        """True if both pupils have been located"""
+        return self.pupil_left is not None
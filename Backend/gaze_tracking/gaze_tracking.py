@@ -2,8 +2,13 @@ from __future__ import division
 import os
 import cv2
 import dlib
-from .eye import Eye
+from .eye import Eye, EyeMask
+from .pupil import Pupil
 from .calibration import Calibration
+from .face_tracker import FaceTracker
+from .gaze_sample import GazeSample
+from .blink_detector import BlinkDetector
+from .profiler import PROFILER
 
 
 class GazeTracking(object):
@@ -11,13 +16,37 @@ class GazeTracking(object):
     This class tracks the user's gaze.
     It provides useful information like the position of the eyes
     and pupils and allows to know if the eyes are open or closed
+
+    Arguments:
+        detection_interval (int): Run the face detector every N frames and
+            follow the face from its landmarks in between (1 = every frame)
+        min_tracking_confidence (float): Below this overlap between the
+            predicted and the found face region, the face is detected again
+        detection_scale (float): Scale factor of the frame given to the face
+            detector, landmarks and pupils still use the full resolution frame
+        frame_quality (frame_quality.FrameQuality): Rejects unusable frames
+            before the landmarks and the pupils are located (None = no check)
+        filter_size (int): Diameter of the bilateral filter of the pupil detection
+
+    The detection interval, detection scale and filter size can be changed
+    between frames, e.g. to lower the cost of the analysis under CPU load.
+    The thresholds depend on the filter, changing it calibrates the eyes again.
     """
 
-    def __init__(self):
+    def __init__(self, detection_interval=1, min_tracking_confidence=0.5, detection_scale=1.0,
+                 frame_quality=None, filter_size=Pupil.FILTER_SIZE):
         self.frame = None
         self.eye_left = None
         self.eye_right = None
+        self.frame_quality = frame_quality
+        self._filter_size = filter_size
+        self.rejection = None
+        self.sample = GazeSample()
         self.calibration = Calibration()
+        self.blink_detector = BlinkDetector()
+
+        # _eye_masks keeps the eye masks between frames, one per eye
+        self._eye_masks = (EyeMask(), EyeMask())
 
         # _face_detector is used to detect faces
         self._face_detector = dlib.get_frontal_face_detector()
@@ -27,107 +56,231 @@ class GazeTracking(object):
         model_path = os.path.abspath(os.path.join(cwd, "trained_models/shape_predictor_68_face_landmarks.dat"))
         self._predictor = dlib.shape_predictor(model_path)
 
+        # _face_tracker decides on which frames the face detector runs
+        self._face_tracker = FaceTracker(
+            self._face_detector, self._predictor, detection_interval, min_tracking_confidence, detection_scale,
+            frame_quality.check_face if frame_quality is not None else None
+        )
+
+    @property
+    def detection_interval(self):
+        """The face detector runs every detection_interval frames"""
+        return self._face_tracker.detection_interval
+
+    @detection_interval.setter
+    def detection_interval(self, value):
+        self._face_tracker.detection_interval = value
+
+    @property
+    def detection_scale(self):
+        """Scale factor of the frame given to the face detector"""
+        return self._face_tracker.detection_scale
+
+    @detection_scale.setter
+    def detection_scale(self, value):
+        self._face_tracker.detection_scale = value
+
+    @property
+    def filter_size(self):
+        """Diameter of the bilateral filter of the pupil detection"""
+        return self._filter_size
+
+    @filter_size.setter
+    def filter_size(self, value):
+        if value != self._filter_size:
+            self._filter_size = value
+            self.calibration.recalibrate()
+
     @property
     def pupils_located(self):
         """Check that the pupils have been located"""
-        try:
-            int(self.eye_left.pupil.x)
-            int(self.eye_left.pupil.y)
-            int(self.eye_right.pupil.x)
-            int(self.eye_right.pupil.y)
-            return True
-        except Exception:
-            return False
+        return self.sample.pupils_located
 
     def _analyze(self):
-        """Detects the face and initialize Eye objects"""
+        """Detects the face and initialize Eye objects. Returns None if there
+        is no usable face, the reason is kept in rejection when there is a frame check."""
         frame = cv2.cvtColor(self.frame, cv2.COLOR_BGR2GRAY)
-        faces = self._face_detector(frame)
+        landmarks = self._face_tracker.landmarks(frame)
+        self.eye_left = None
+        self.eye_right = None
+        self.rejection = None
+
+        if self.frame_quality is not None:
+            if landmarks is None:
+                self.rejection = self._face_tracker.rejection or self.frame_quality.NO_FACE
+            else:
+                self.rejection = self.frame_quality.check_eyes(frame, landmarks)
+            if self.rejection is not None:
+                return
+
+        if landmarks is None:
+            return
+
+        self.eye_left = Eye(frame, landmarks, 0, self.calibration, self._eye_masks[0], self.filter_size)
+        self.eye_right = Eye(frame, landmarks, 1, self.calibration, self._eye_masks[1], self.filter_size)
+        return landmarks
+
+    def _make_sample(self, landmarks):
+        """Computes everything there is to know about the analyzed frame, once
+
+        Arguments:
+            landmarks (numpy.ndarray): The 68 facial landmarks, or None if no face was found
+        """
+        if self.rejection is not None:
+            # A face that is there but unusable doesn't tell whether the eyes
+            # are closed, the blink state is kept. A missing face resets it,
+            # like when there is no frame check.
+            PROFILER.count("rejected_" + self.rejection)
+            if self.rejection == self.frame_quality.NO_FACE:
+                self.blink_detector.update(None)
+            return GazeSample(quality=self.rejection)
+
+        if landmarks is None:
+            PROFILER.count("no_face")
+            self.blink_detector.update(None)
+            return GazeSample()
 
-        try:
-            landmarks = self._predictor(frame, faces[0])
-            self.eye_left = Eye(frame, landmarks, 0, self.calibration)
-            self.eye_right = Eye(frame, landmarks, 1, self.calibration)
+        left, right = self.eye_left, self.eye_right
 
-        except IndexError:
-            self.eye_left = None
-            self.eye_right = None
+        eye_aspect_ratio = None
+        if left.aspect_ratio is not None and right.aspect_ratio is not None:
+            eye_aspect_ratio = (left.aspect_ratio + right.aspect_ratio) / 2
+        blinking = self.blink_detector.update(eye_aspect_ratio)
+
+        blinking_ratio = None
+        if left.blinking is not None and right.blinking is not None:
+            blinking_ratio = (left.blinking + right.blinking) / 2
+
+        if left.pupil.x is None or left.pupil.y is None or right.pupil.x is None or right.pupil.y is None:
+            return GazeSample(
+                blinking_ratio=blinking_ratio,
+                eye_aspect_ratio=eye_aspect_ratio,
+                blinking=blinking,
+                direction="Blinking" if blinking else "Center",
+                landmarks=landmarks,
+            )
+
+        pupil_left = (int(left.origin[0] + left.pupil.x), int(left.origin[1] + left.pupil.y))
+        pupil_right = (int(right.origin[0] + right.pupil.x), int(right.origin[1] + right.pupil.y))
+
+        horizontal_ratio = (
+            left.pupil.x / (left.center[0] * 2 - 10) + right.pupil.x / (right.center[0] * 2 - 10)
+        ) / 2
+        vertical_ratio = (
+            left.pupil.y / (left.center[1] * 2 - 10) + right.pupil.y / (right.center[1] * 2 - 10)
+        ) / 2
+
+        if blinking:
+            direction = "Blinking"
+        elif horizontal_ratio <= 0.35:
+            direction = "Right"
+        elif horizontal_ratio >= 0.65:
+            direction = "Left"
+        else:
+            direction = "Center"
+
+        return GazeSample(pupil_left, pupil_right, horizontal_ratio, vertical_ratio,
+                          blinking_ratio, eye_aspect_ratio, blinking, direction, landmarks)
+
+    def reset(self):
+        """Forgets the calibration and the followed face, as if the
+        object was just created (the models stay loaded)"""
+        self.frame = None
+        self.eye_left = None
+        self.eye_right = None
+        self.rejection = None
+        self.sample = GazeSample()
+        self.calibration = Calibration()
+        self.blink_detector.reset()
+        self._eye_masks = (EyeMask(), EyeMask())
+        self._face_tracker.reset()
 
     def refresh(self, frame):
         """Refreshes the frame and analyzes it.
 
         Arguments:
             frame (numpy.ndarray): The frame to analyze
+
+        Returns:
+            The GazeSample of the frame
         """
-        self.frame = frame
-        self._analyze()
+        PROFILER.count("frames")
+        with PROFILER.stage("refresh"):
+            self.frame = frame
+            with PROFILER.stage("analyze"):
+                landmarks = self._analyze()
+            self.sample = self._make_sample(landmarks)
+        return self.sample
 
     def pupil_left_coords(self):
         """Returns the coordinates of the left pupil"""
-        if self.pupils_located:
-            x = self.eye_left.origin[0] + self.eye_left.pupil.x
-            y = self.eye_left.origin[1] + self.eye_left.pupil.y
-            return (x, y)
+        return self.sample.pupil_left
 
     def pupil_right_coords(self):
         """Returns the coordinates of the right pupil"""
-        if self.pupils_located:
-            x = self.eye_right.origin[0] + self.eye_right.pupil.x
-            y = self.eye_right.origin[1] + self.eye_right.pupil.y
-            return (x, y)
+        return self.sample.pupil_right
 
     def horizontal_ratio(self):
         """Returns a number between 0.0 and 1.0 that indicates the
         horizontal direction of the gaze. The extreme right is 0.0,
         the center is 0.5 and the extreme left is 1.0
         """
-        if self.pupils_located:
-            pupil_left = self.eye_left.pupil.x / (self.eye_left.center[0] * 2 - 10)
-            pupil_right = self.eye_right.pupil.x / (self.eye_right.center[0] * 2 - 10)
-            return (pupil_left + pupil_right) / 2
+        return self.sample.horizontal_ratio
 
     def vertical_ratio(self):
         """Returns a number between 0.0 and 1.0 that indicates the
         vertical direction of the gaze. The extreme top is 0.0,
         the center is 0.5 and the extreme bottom is 1.0
         """
-        if self.pupils_located:
-            pupil_left = self.eye_left.pupil.y / (self.eye_left.center[1] * 2 - 10)
-            pupil_right = self.eye_right.pupil.y / (self.eye_right.center[1] * 2 - 10)
-            return (pupil_left + pupil_right) / 2
+        return self.sample.vertical_ratio
 
     def is_right(self):
         """Returns true if the user is looking to the right"""
-        if self.pupils_located:
-            return self.horizontal_ratio() <= 0.35
+        if self.sample.pupils_located:
+            return self.sample.horizontal_ratio <= 0.35
 
     def is_left(self):
         """Returns true if the user is looking to the left"""
-        if self.pupils_located:
-            return self.horizontal_ratio() >= 0.65
+        if self.sample.pupils_located:
+            return self.sample.horizontal_ratio >= 0.65
 
     def is_center(self):
         """Returns true if the user is looking to the center"""
-        if self.pupils_located:
+        if self.sample.pupils_located:
             return self.is_right() is not True and self.is_left() is not True
 
     def is_blinking(self):
         """Returns true if the user closes his eyes"""
-        if self.pupils_located:
-            blinking_ratio = (self.eye_left.blinking + self.eye_right.blinking) / 2
-            return blinking_ratio > 3.8
+        if self.sample.landmarks is not None:
+            return self.sample.blinking
 
-    def annotated_frame(self):
-        """Returns the main frame with pupils highlighted"""
-        frame = self.frame.copy()
+    def direction(self):
+        """Returns the gaze direction logged for the frame:
+        "Blinking", "Right", "Left" or "Center"
+        """
+        return self.sample.direction
+
+    @staticmethod
+    def annotate(frame, sample):
+        """Returns a copy of a frame with the pupils of its sample highlighted
 
-        if self.pupils_located:
+        Arguments:
+            frame (numpy.ndarray): The analyzed frame
+            sample (GazeSample): The result of its analysis
+        """
+        frame = frame.copy()
+
+        if sample.pupils_located:
             color = (0, 255, 0)
-            x_left, y_left = self.pupil_left_coords()
-            x_right, y_right = self.pupil_right_coords()
+            x_left, y_left = sample.pupil_left
+            x_right, y_right = sample.pupil_right
             cv2.line(frame, (x_left - 5, y_left), (x_left + 5, y_left), color)
             cv2.line(frame, (x_left, y_left - 5), (x_left, y_left + 5), color)
             cv2.line(frame, (x_right - 5, y_right), (x_right + 5, y_right), color)
             cv2.line(frame, (x_right, y_right - 5), (x_right, y_right + 5), color)
 
         return frame
+
+    def annotated_frame(self):
+        """Returns the main frame with pupils highlighted"""
+        return self.annotate(self.frame, self.sample)
@@ -0,0 +1,54 @@
+from __future__ import division
+import numpy as np
+
+# Points of each eye in the 68 Multi-PIE landmarks, starting at the outer
+# corner for the left eye (inner corner for the right eye), clockwise
+LEFT_EYE_POINTS = slice(36, 42)
+RIGHT_EYE_POINTS = slice(42, 48)
+
+
+def landmarks_to_array(landmarks):
+    """Returns the facial landmarks as a (68, 2) array of (x, y) coordinates
+
+    Argument:
+        landmarks (dlib.full_object_detection): Facial landmarks for the face region
+    """
+    return np.array([(point.x, point.y) for point in landmarks.parts()], np.int32)
+
+
+def bounding_box(points):
+    """Returns the bounding box (left, top, right, bottom) of an array of points"""
+    left, top = points.min(axis=0)
+    right, bottom = points.max(axis=0)
+    return (int(left), int(top), int(right), int(bottom))
+
+
+def eye_aspect_ratio(eye_points):
+    """Returns the eye aspect ratio (EAR) of an eye: the mean of its two
+    vertical openings divided by its width. It drops towards 0 when the eye closes.
+
+    Argument:
+        eye_points (numpy.ndarray): The 6 points of an eye, as a (6, 2) array
+    """
+    points = eye_points.astype(np.float64)
+    vertical = np.hypot(*(points[[1, 2]] - points[[5, 4]]).T)
+    width = np.hypot(*(points[0] - points[3]))
+    if width == 0:
+        return None
+    return float(vertical.sum() / (2 * width))
+
+
+def width_height_ratio(eye_points):
+    """Returns the width of an eye divided by its height, measured between the
+    middles of its upper and lower lids. It grows when the eye closes.
+
+    Argument:
+        eye_points (numpy.ndarray): The 6 points of an eye, as a (6, 2) array
+    """
+    top = (eye_points[1] + eye_points[2]) // 2
+    bottom = (eye_points[5] + eye_points[4]) // 2
+    width = np.hypot(*(eye_points[0] - eye_points[3]).astype(np.float64))
+    height = np.hypot(*(top - bottom).astype(np.float64))
+    if height == 0:
+        return None
+    return float(width / height)
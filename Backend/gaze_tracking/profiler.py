@@ -0,0 +1,191 @@
+import json
+import threading
+import time
+import numpy as np
+
+
+class _NoTiming(object):
+    """Context manager that does nothing, used while the profiler is disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class _Timing(object):
+    """Context manager timing one run of a stage"""
+
+    __slots__ = ("_profiler", "_name", "_start")
+
+    def __init__(self, profiler, name):
+        self._profiler = profiler
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._profiler.add(self._name, time.perf_counter() - self._start)
+        return False
+
+
+class _Ring(object):
+    """Fixed size buffer keeping the last durations of a stage"""
+
+    __slots__ = ("values", "index", "count", "total", "maximum")
+
+    def __init__(self, capacity):
+        # The pages of the buffer are only mapped once they are written
+        self.values = np.empty(capacity, np.float64)
+        self.index = 0
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def add(self, seconds):
+        self.values[self.index] = seconds
+        self.index = (self.index + 1) % self.values.size
+        self.count += 1
+        self.total += seconds
+        if seconds > self.maximum:
+            self.maximum = seconds
+
+    def recent(self):
+        """Returns the kept durations, the oldest first"""
+        if self.count < self.values.size:
+            return self.values[:self.count].copy()
+        return np.concatenate((self.values[self.index:], self.values[:self.index]))
+
+
+class Profiler(object):
+    """
+    This class times the stages of the gaze analysis (face detection,
+    landmarks, eye isolation, pupil detection...) and counts events
+    (faces found, calibration frames, pupil failures...). It is disabled
+    by default, a disabled profiler costs a method call per stage.
+
+        with PROFILER.stage("detect"):
+            faces = detector(frame)
+        PROFILER.count("faces_found", len(faces))
+
+    The last durations of each stage are kept in a ring buffer of the given
+    capacity, the totals (count, mean, max) cover every run since enable().
+
+    Argument:
+        capacity (int): Durations kept per stage
+    """
+
+    _NO_TIMING = _NoTiming()
+
+    PERCENTILES = (50, 90, 99)
+
+    def __init__(self, capacity=4096):
+        self.enabled = False
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._rings = {}
+        self._counters = {}
+        self._started_at = None
+
+    def enable(self, capacity=None):
+        """Forgets the previous timings and starts timing the stages
+
+        Argument:
+            capacity (int): Durations kept per stage, keeps the current capacity by default
+        """
+        if capacity is not None:
+            self.capacity = capacity
+        self.reset()
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self._rings = {}
+            self._counters = {}
+            self._started_at = time.time()
+
+    def stage(self, name):
+        """Returns a context manager timing the code it wraps as the given stage
+
+        Argument:
+            name (str): Name of the stage
+        """
+        if not self.enabled:
+            return self._NO_TIMING
+        return _Timing(self, name)
+
+    def add(self, name, seconds):
+        """Records a duration for a stage
+
+        Arguments:
+            name (str): Name of the stage
+            seconds (float): Duration of the stage
+        """
+        with self._lock:
+            ring = self._rings.get(name)
+            if ring is None:
+                ring = self._rings[name] = _Ring(self.capacity)
+            ring.add(seconds)
+
+    def count(self, name, value=1):
+        """Increments a counter, does nothing while the profiler is disabled
+
+        Arguments:
+            name (str): Name of the counter
+            value (int): Increment
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def durations(self):
+        """Returns a dict mapping each stage to its kept durations, in seconds, the oldest first"""
+        with self._lock:
+            return {name: ring.recent().tolist() for name, ring in self._rings.items()}
+
+    def snapshot(self):
+        """Returns the counters and, for each stage, its run count, mean and
+        max since enable() and the percentiles of its kept durations (in ms).
+        It can be called while the session runs."""
+        with self._lock:
+            rings = {name: (ring.count, ring.total, ring.maximum, ring.recent()) for name, ring in self._rings.items()}
+            counters = dict(self._counters)
+            started_at = self._started_at
+
+        stages = {}
+        for name, (count, total, maximum, recent) in sorted(rings.items()):
+            stage = {
+                "count": count,
+                "mean_ms": round(1000 * total / count, 3),
+                "max_ms": round(1000 * maximum, 3),
+            }
+            for percentile, value in zip(self.PERCENTILES, np.percentile(recent, self.PERCENTILES)):
+                stage[f"p{percentile}_ms"] = round(1000 * float(value), 3)
+            stages[name] = stage
+
+        return {
+            "enabled": self.enabled,
+            "seconds": round(time.time() - started_at, 3) if started_at is not None else None,
+            "stages": stages,
+            "counters": counters,
+        }
+
+    def dump(self, filename):
+        """Saves the snapshot to a JSON file
+
+        Argument:
+            filename (str): Path of the file
+        """
+        with open(filename, "w") as f:
+            json.dump(self.snapshot(), f, indent=4)
+
+
+# Profiler shared by the whole package
+PROFILER = Profiler()
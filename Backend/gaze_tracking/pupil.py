@@ -1,5 +1,7 @@
+import threading
 import numpy as np
 import cv2
+from .profiler import PROFILER
 
 
 class Pupil(object):
@@ -8,28 +10,73 @@ class Pupil(object):
     the position of the pupil
     """
 
-    def __init__(self, eye_frame, threshold):
+    # Erosion kernel, shared by every frame
+    KERNEL = np.ones((3, 3), np.uint8)
+
+    # Default diameter of the bilateral filter, smaller is faster
+    FILTER_SIZE = 10
+
+    # Per thread buffers for the intermediate frames of the filtering
+    _scratch = threading.local()
+
+    def __init__(self, eye_frame, threshold, filter_size=FILTER_SIZE):
         self.iris_frame = None
         self.threshold = threshold
+        self.filter_size = filter_size
         self.x = None
         self.y = None
 
-        self.detect_iris(eye_frame)
+        with PROFILER.stage("detect_iris"):
+            self.detect_iris(eye_frame)
+        if self.x is None:
+            PROFILER.count("pupil_failures")
+
+    @staticmethod
+    def _scratch_buffer(name, shape):
+        """Returns a buffer of the current thread, reused as long as the frames keep the same shape
+
+        Arguments:
+            name (str): Name of the buffer
+            shape (tuple): Shape of the frame it has to hold
+        """
+        buffer = getattr(Pupil._scratch, name, None)
+        if buffer is None or buffer.shape != shape:
+            buffer = np.empty(shape, np.uint8)
+            setattr(Pupil._scratch, name, buffer)
+        return buffer
 
     @staticmethod
-    def image_processing(eye_frame, threshold):
+    def filter(eye_frame, filter_size=FILTER_SIZE):
+        """Smooths and erodes the eye frame, before it gets binarized
+
+        Arguments:
+            eye_frame (numpy.ndarray): Frame containing an eye and nothing else
+            filter_size (int): Diameter of the bilateral filter
+
+        Returns:
+            The filtered frame. It is a scratch buffer that the next call
+            from the same thread overwrites.
+        """
+        smoothed = Pupil._scratch_buffer("smoothed", eye_frame.shape)
+        eroded = Pupil._scratch_buffer("eroded", eye_frame.shape)
+        cv2.bilateralFilter(eye_frame, filter_size, 15, 15, dst=smoothed)
+        cv2.erode(smoothed, Pupil.KERNEL, dst=eroded, iterations=3)
+
+        return eroded
+
+    @staticmethod
+    def image_processing(eye_frame, threshold, filter_size=FILTER_SIZE):
         """Performs operations on the eye frame to isolate the iris
 
         Arguments:
             eye_frame (numpy.ndarray): Frame containing an eye and nothing else
             threshold (int): Threshold value used to binarize the eye frame
+            filter_size (int): Diameter of the bilateral filter
 
         Returns:
             A frame with a single element representing the iris
         """
-        kernel = np.ones((3, 3), np.uint8)
-        new_frame = cv2.bilateralFilter(eye_frame, 10, 15, 15)
-        new_frame = cv2.erode(new_frame, kernel, iterations=3)
+        new_frame = Pupil.filter(eye_frame, filter_size)
         new_frame = cv2.threshold(new_frame, threshold, 255, cv2.THRESH_BINARY)[1]
 
         return new_frame
@@ -41,14 +88,26 @@ class Pupil(object):
         Arguments:
             eye_frame (numpy.ndarray): Frame containing an eye and nothing else
         """
-        self.iris_frame = self.image_processing(eye_frame, self.threshold)
+        self.iris_frame = self.image_processing(eye_frame, self.threshold, self.filter_size)
 
         contours, _ = cv2.findContours(self.iris_frame, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)[-2:]
-        contours = sorted(contours, key=cv2.contourArea)
-
-        try:
-            moments = cv2.moments(contours[-2])
-            self.x = int(moments['m10'] / moments['m00'])
-            self.y = int(moments['m01'] / moments['m00'])
-        except (IndexError, ZeroDivisionError):
-            pass
+        if len(contours) < 2:
+            return
+
+        # The iris is the second largest contour, found in a single pass.
+        # Ties go to the last contour, like with a stable sort by area.
+        largest = second = None
+        largest_area = second_area = -1.0
+        for contour in contours:
+            area = cv2.contourArea(contour)
+            if area >= largest_area:
+                second, second_area = largest, largest_area
+                largest, largest_area = contour, area
+            elif area >= second_area:
+                second, second_area = contour, area
+
+        moments = cv2.moments(second)
+        if moments['m00'] == 0:
+            return
+        self.x = int(moments['m10'] / moments['m00'])
+        self.y = int(moments['m01'] / moments['m00'])
@@ -0,0 +1,291 @@
+# jobs.py
+# Durable queue of the post-processing jobs of the sessions (scanpath,
+# heatmap, spreadsheet, ASD detection, report), so /stop returns as soon as
+# the capture is over instead of waiting for them.
+#
+# The jobs are rows of a SQLite database: they survive a restart of the
+# server, and the workers run either as threads of the server (JOB_WORKERS
+# in app.py) or as separate processes sharing the database:
+#
+#   python jobs.py --workers 2
+#
+# A job goes queued -> running -> done (or failed). Its worker updates its
+# progress (and heartbeat) while it runs, a running job whose worker stopped
+# (crash, killed process) for STALE_SECONDS is queued again, up to
+# MAX_ATTEMPTS times.
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATABASE = os.path.join(BASE_DIR, "jobs.db")
+STALE_SECONDS = 600
+MAX_ATTEMPTS = 3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    heartbeat_at REAL,
+    finished_at REAL
+)
+"""
+
+
+class JobQueue(object):
+    """
+    Jobs stored in a SQLite database, shared by the threads and processes
+    that open the same file.
+
+    Arguments:
+        path (str): Path of the database
+        stale_after (float): Seconds without heartbeat after which a running job is queued again
+        max_attempts (int): Runs of a job at most, it fails after that
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, path=DATABASE, stale_after=STALE_SECONDS, max_attempts=MAX_ATTEMPTS):
+        self.path = path
+        self.stale_after = stale_after
+        self.max_attempts = max_attempts
+        # sqlite3 connections can't be shared between threads, one per thread
+        self._local = threading.local()
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(_SCHEMA)
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Autocommit, the transactions that need it are explicit
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            self._local.connection = connection
+        return connection
+
+    def submit(self, kind, payload):
+        """Queues a job, returns its id
+
+        Arguments:
+            kind (str): Type of the job, picks its handler
+            payload (dict): JSON serializable arguments of the handler
+        """
+        cursor = self._connection().execute(
+            "INSERT INTO jobs (kind, payload, status, created_at) VALUES (?, ?, ?, ?)",
+            (kind, json.dumps(payload), self.QUEUED, time.time()),
+        )
+        return cursor.lastrowid
+
+    def claim(self, worker, kinds=None):
+        """Marks the oldest queued job as running and returns it, or None if
+        there is none. Stale running jobs are queued again first.
+
+        Arguments:
+            worker (str): Name of the worker, saved with the job
+            kinds (list): Types of jobs the worker can run, all by default
+        """
+        connection = self._connection()
+        now = time.time()
+        # One claim at a time, across threads and processes
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts < ? THEN ? ELSE ? END, "
+                "error = 'The worker stopped while running the job' "
+                "WHERE status = ? AND heartbeat_at < ?",
+                (self.max_attempts, self.QUEUED, self.FAILED, self.RUNNING, now - self.stale_after),
+            )
+            query = "SELECT * FROM jobs WHERE status = ?"
+            parameters = [self.QUEUED]
+            if kinds is not None:
+                query += f" AND kind IN ({', '.join('?' * len(kinds))})"
+                parameters.extend(kinds)
+            row = connection.execute(query + " ORDER BY id LIMIT 1", parameters).fetchone()
+            if row is not None:
+                connection.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, worker = ?, progress = 0, "
+                    "started_at = ?, heartbeat_at = ? WHERE id = ?",
+                    (self.RUNNING, worker, now, now, row["id"]),
+                )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return None if row is None else self.get(row["id"])
+
+    def update(self, job_id, progress, message=None):
+        """Saves the progress of a running job, which is also its heartbeat
+
+        Arguments:
+            job_id (int): Id of the job
+            progress (float): Fraction of the job done, in [0, 1]
+            message (str): Step in progress
+        """
+        self._connection().execute(
+            "UPDATE jobs SET progress = ?, message = ?, heartbeat_at = ? WHERE id = ?",
+            (progress, message, time.time(), job_id),
+        )
+
+    def finish(self, job_id, result):
+        """Marks a job as done
+
+        Arguments:
+            job_id (int): Id of the job
+            result (dict): JSON serializable result of the job
+        """
+        self._connection().execute(
+            "UPDATE jobs SET status = ?, progress = 1, message = NULL, result = ?, finished_at = ? WHERE id = ?",
+            (self.DONE, json.dumps(result), time.time(), job_id),
+        )
+
+    def fail(self, job_id, error):
+        """Marks a job as failed, it isn't run again
+
+        Arguments:
+            job_id (int): Id of the job
+            error (str): What went wrong
+        """
+        self._connection().execute(
+            "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+            (self.FAILED, error, time.time(), job_id),
+        )
+
+    def get(self, job_id):
+        """Returns a job as a dict, or None if there is no such job"""
+        row = self._connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    def jobs(self, status=None, limit=50):
+        """Returns the last jobs, the newest first
+
+        Arguments:
+            status (str): Only the jobs with this status, all by default
+            limit (int): Number of jobs at most
+        """
+        if status is None:
+            rows = self._connection().execute("SELECT id FROM jobs ORDER BY id DESC LIMIT ?", (limit,))
+        else:
+            rows = self._connection().execute(
+                "SELECT id FROM jobs WHERE status = ? ORDER BY id DESC LIMIT ?", (status, limit)
+            )
+        return [self.get(row["id"]) for row in rows.fetchall()]
+
+
+class JobWorker(object):
+    """
+    Thread running the jobs of a queue, one at a time.
+
+    Arguments:
+        queue (JobQueue): Queue the jobs are taken from
+        handlers (dict): Job type -> function(payload, progress) returning the result,
+            progress(fraction, message) reports the progress of the job
+        name (str): Name of the worker, saved with the jobs it runs
+        poll_interval (float): Seconds between two looks at an empty queue
+    """
+
+    def __init__(self, queue, handlers, name=None, poll_interval=1.0):
+        self.queue = queue
+        self.handlers = handlers
+        self.name = name or f"worker-{os.getpid()}"
+        self.poll_interval = poll_interval
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def run_once(self):
+        """Runs the next job, returns False if there was none"""
+        job = self.queue.claim(self.name, list(self.handlers))
+        if job is None:
+            return False
+
+        print(f"[{self.name}] Running job {job['id']} ({job['kind']})")
+
+        def progress(fraction, message=None):
+            self.queue.update(job["id"], fraction, message)
+
+        try:
+            result = self.handlers[job["kind"]](job["payload"], progress)
+        except Exception:
+            error = traceback.format_exc()
+            print(f"[{self.name}] Job {job['id']} failed:\n{error}")
+            self.queue.fail(job["id"], error)
+        else:
+            self.queue.finish(job["id"], result)
+            print(f"[{self.name}] Job {job['id']} done")
+        return True
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                if not self.run_once():
+                    self._stopping.wait(self.poll_interval)
+            except sqlite3.Error as e:
+                # e.g. the database is locked for too long, the job is claimed again later
+                print(f"[{self.name}] Job queue error: {e}")
+                self._stopping.wait(self.poll_interval)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """Stops the worker once its current job is done"""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the post-processing jobs of the sessions")
+    parser.add_argument("--workers", type=int, default=1, help="Worker threads of this process")
+    parser.add_argument("--database", default=DATABASE, help="Job database shared with the server")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    import signal
+
+    import main
+    from app import app
+    from database import db, Report
+
+    # main stops the running session on Ctrl+C, a worker only stops itself
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+
+    args = parse_args()
+    queue = JobQueue(args.database)
+    handlers = {main.FINALIZE_JOB: lambda payload, progress: main.finalize_job(payload, progress, db, Report, app)}
+    workers = [
+        JobWorker(queue, handlers, name=f"worker-{os.getpid()}-{i}").start() for i in range(args.workers)
+    ]
+    print(f"{len(workers)} workers running jobs from {args.database}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("Stopping the workers once their jobs are done...")
+        for worker in workers:
+            worker.stop()
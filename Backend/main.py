@@ -1,17 +1,22 @@
 import cv2
 import threading
 import queue
-from gaze_tracking import GazeTracking
-from openpyxl import Workbook
+from gaze_tracking import GazeTracking, CalibrationStore, FrameQuality, PROFILER
+from gaze_tracking.pupil import Pupil
+from analysis_workers import SessionAnalyzer, ProcessAnalyzer
+from shm_ring import SharedFrameRing
+from pipeline import GazePipeline
+from gaze_log import GazeLog, GazeLogWriter
+from scanpath import render_scanpath, save_scanpath, to_model_input
+from model_registry import ModelRegistry, risk_level
+from rate_control import RateController, build_levels
+from frame_sinks import PreviewSink, VideoRecorderSink
+from frame_sources import WebcamSource
 from datetime import datetime
-import pandas as pd
 import numpy as np
-import matplotlib
-matplotlib.use('Agg')  # Use non-interactive backend
-import matplotlib.pyplot as plt
+# Figures are built without pyplot, whose global state isn't thread-safe (jobs run in parallel)
+from matplotlib.figure import Figure
 import os
-from keras.models import load_model
-from PIL import Image, ImageOps
 import json
 import sys
 from scipy.ndimage import gaussian_filter
@@ -25,6 +30,78 @@ import sys
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 STOP_FILE = os.path.join(BASE_DIR, "session.stop")
 
+# Requested camera mode, landmarks and pupils are located at this resolution.
+# The camera may pick another mode, the session uses the one it got.
+CAMERA_INDEX = 0
+FRAME_WIDTH = 640
+FRAME_HEIGHT = 480
+CAMERA_FPS = 30
+CAMERA_FOURCC = "MJPG"
+# A camera delivering no frame for this long ends the session, shorter
+# stalls are waited out (None waits as long as the camera is open)
+CAMERA_STALL_SECONDS = 10.0
+
+# Pupil thresholds of each child are kept between sessions, per camera and resolution
+CALIBRATION_FOLDER = os.path.join(BASE_DIR, "calibration_profiles")
+calibration_store = CalibrationStore(CALIBRATION_FOLDER)
+
+# Face detection runs every DETECTION_INTERVAL frames, the face is tracked in between
+DETECTION_INTERVAL = 10
+# Face detection runs on the frame downscaled by DETECTION_SCALE,
+# lower it when FRAME_WIDTH/FRAME_HEIGHT are raised (e.g. 0.5 at 1280x720)
+DETECTION_SCALE = 1.0
+
+# Blurred frames, faces too small and eyes out of view are rejected before the
+# landmarks and the pupils are located, their reason is in the Quality column
+QUALITY_GATE = True
+
+# Analysis workers, and frames waiting for them before the oldest is dropped
+ANALYSIS_WORKERS = 1
+CAPTURE_QUEUE_SIZE = 2
+# Runs each analysis worker in its own process, the frames are passed through
+# shared memory. The analysis then scales across cores and doesn't slow down
+# the Flask requests (each process loads its own models when the session starts).
+ANALYSIS_PROCESSES = False
+
+# Sampling rate of the sessions: the quality of the analysis is lowered
+# when the PC can't keep up, so every session is sampled at the same rate
+TARGET_FPS = 20
+
+# Times the stages of the gaze analysis and counts its events (faces found,
+# pupil failures...). Readable live from /pipeline-stats and saved as
+# profile.json in the session folder.
+PROFILING = False
+
+# Pipeline of the session in progress, if any
+_active_pipeline = None
+_active_rate_controller = None
+
+# The gaze log is always saved as gaze_data.npz, and exported to the
+# gaze_data.xlsx spreadsheet (the file linked to the report) once processed
+EXPORT_XLSX = True
+# While the session runs, the log is streamed to this file of the session
+# folder (flushed every second), removed once gaze_data.npz is saved.
+# recover_session.py finishes the sessions left with this file by a crash.
+GAZE_STREAM_FILE = "gaze_data.bin"
+
+# ASD model and class names, loaded once per process (at the server startup
+# or by the first session) and shared by the sessions. Its type picks the
+# runtime: export it with export_model.py and set asd_model.onnx (or
+# asd_model.tflite) to serve it without TensorFlow
+MODEL_FILE = "TFSMconverted_model.keras"
+MODEL_REGISTRY = ModelRegistry(
+    os.path.join(BASE_DIR, MODEL_FILE),
+    os.path.join(BASE_DIR, "labels.txt"),
+)
+
+# Type of the post-processing jobs of the sessions, see jobs.py
+FINALIZE_JOB = "finalize_session"
+
+# Annotated frames are only drawn for the live preview (while a client
+# watches it) and for the debug recording (saved in the session folder)
+DEBUG_RECORDING = False
+preview_sink = PreviewSink()
+
 
 def create_session_folder(child_id):
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -33,6 +110,38 @@ def create_session_folder(child_id):
     return folder
 
 
+def get_pipeline_stats():
+    """Returns the queue depths and stage timings of the session in progress, or None"""
+    pipeline = _active_pipeline
+    rate_controller = _active_rate_controller
+    if pipeline is None:
+        return None
+    stats = pipeline.stats()
+    if rate_controller is not None:
+        stats["rate_control"] = rate_controller.snapshot()
+    if PROFILER.enabled:
+        stats["profile"] = PROFILER.snapshot()
+    return stats
+
+
+def annotate_frame(frame, sample, duration):
+    """Returns a copy of the frame with the pupils and the gaze information drawn on it"""
+    frame = GazeTracking.annotate(frame, sample)
+    left_pupil = sample.pupil_left
+    right_pupil = sample.pupil_right
+
+    if sample.direction == "Blinking":
+        text = "Blinking"
+    else:
+        text = "Looking " + sample.direction.lower()
+
+    cv2.putText(frame, text, (90, 60), cv2.FONT_HERSHEY_DUPLEX, 1.6, (147, 58, 31), 2)
+    cv2.putText(frame, f"Duration: {round(duration, 1)}s", (90, 100), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (147, 58, 31), 1)
+    cv2.putText(frame, f"Left pupil: {left_pupil}", (90, 130), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (147, 58, 31), 1)
+    cv2.putText(frame, f"Right pupil: {right_pupil}", (90, 160), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (147, 58, 31), 1)
+    return frame
+
+
 def handle_interrupt(sig, frame):
     print("Received interrupt signal, creating stop file...")
     with open(STOP_FILE, "w") as f:
@@ -43,298 +152,414 @@ signal.signal(signal.SIGINT, handle_interrupt)
 
 
 
-def run_gaze_session(child_id, stimulus_id, session_type, base_dir, db, Report,app):
+def run_gaze_session(child_id, stimulus_id, session_type, base_dir, db, Report,app, source=None, report=None,
+                     jobs=None):
+    # source: FrameSource to read instead of the webcam, e.g. a recording to replay
+    # report: dict filled with the stats and timings of the session, if given
+    # jobs: JobQueue the post-processing is queued to, the session returns
+    # {"job_id", "session_folder"} once the capture is over. Without it the
+    # post-processing runs here and the session returns its results.
     session_folder = create_session_folder(child_id)
 
     os.makedirs(session_folder, exist_ok=True)
 
     # -------------------- SETUP --------------------
-    # Initialize Excel workbook for logging eye tracking data
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Eye Tracking Data"
-    ws.append(["Timestamp", "Left Pupil", "Right Pupil", "Gaze Direction", "Blinking", "Duration(s)"])
-
-    current_direction = None
-    direction_start_time = None
-
-    gaze = GazeTracking()
-
     # Setup webcam (on Mac, using default backend; ensure permissions are granted)
-    webcam = cv2.VideoCapture(0)
-    webcam.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-    webcam.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+    replay = source is not None
+    if not replay:
+        source = WebcamSource(CAMERA_INDEX, FRAME_WIDTH, FRAME_HEIGHT, CAMERA_FPS, CAMERA_FOURCC,
+                              stall_timeout=CAMERA_STALL_SECONDS)
+    try:
+        source.open()
+    except IOError as e:
+        print(f"Error: {e}")
+        return None
+    frame_width, frame_height = source.resolution
+    camera_id = f"camera{CAMERA_INDEX}_{frame_width}x{frame_height}"
+    print(f"{'Replay' if replay else 'Camera'}: {source.describe()}")
+
+    # Columnar log of the analyzed frames, sized for a 15 minutes session
+    # (it grows past that), streamed to the disk as it is written with
+    # everything recover_session.py needs to finish the session
+    gaze_log_writer = GazeLogWriter(os.path.join(session_folder, GAZE_STREAM_FILE), metadata={
+        "child_id": child_id,
+        "stimulus_id": stimulus_id,
+        "session_type": session_type,
+        "frame_width": frame_width,
+        "frame_height": frame_height,
+    })
+    gaze_log = GazeLog(capacity=TARGET_FPS * 60 * 15, stream=gaze_log_writer)
+
+    # Consumers of the annotated frames
+    frame_sinks = [preview_sink]
+    if DEBUG_RECORDING:
+        frame_sinks.append(VideoRecorderSink(os.path.join(session_folder, "debug_recording.avi")))
+    preview_sink.open()
+
+    # Thresholds found in the previous session of the child, if any
+    # (a replay starts from scratch, so it gives the same results every time)
+    calibration_profile = None if replay else calibration_store.load(child_id, camera_id)
+    analyzers = []
+
+    # Chooses the analysis settings of each frame from the load of the PC.
+    # A replay that isn't paced in real time keeps the best settings and
+    # analyzes every frame, whatever the speed of the PC.
+    # Level 0 is the configured settings, the other levels are cheaper relative to them
+    levels = build_levels(DETECTION_INTERVAL, DETECTION_SCALE, Pupil.FILTER_SIZE)
+    rate_controller = RateController(TARGET_FPS, workers=ANALYSIS_WORKERS, levels=levels, adaptive=source.live)
+
+    gaze_options = {
+        "detection_interval": DETECTION_INTERVAL,
+        "detection_scale": DETECTION_SCALE,
+        "frame_quality": FrameQuality() if QUALITY_GATE else None,
+    }
+    # One slot per worker process, each worker has a single frame in flight
+    frame_ring = None
+    if ANALYSIS_PROCESSES:
+        frame_ring = SharedFrameRing(ANALYSIS_WORKERS, (frame_height, frame_width, 3))
+
+    def make_analyzer():
+        # Each analysis worker has its own tracker (and calibration)
+        if frame_ring is not None:
+            analyzer = ProcessAnalyzer(frame_ring, gaze_options, calibration_profile)
+        else:
+            analyzer = SessionAnalyzer(gaze_options, calibration_profile)
+        analyzers.append(analyzer)
+
+        def analyze(frame):
+            level = rate_controller.level
+            start = time.perf_counter()
+            with PROFILER.stage("analysis"):
+                sample = analyzer(frame, level)
+            rate_controller.record_analysis(time.perf_counter() - start, level)
+            return sample, level
+
+        return analyze
+
+    def write(capture_time, webcam_frame, result):
+        start = time.perf_counter()
+        sample, level = result
+
+        # Log the frame, the log tracks the duration of the current gaze direction
+        with PROFILER.stage("log"):
+            current_duration = gaze_log.append(capture_time, sample, level, rate_controller.levels.index(level))
+
+        # Annotate the frame only if someone is watching or recording it,
+        # and the PC has time for it (the sinks get the raw frame otherwise)
+        active_sinks = [sink for sink in frame_sinks if sink.active]
+        if active_sinks:
+            if level.annotate:
+                with PROFILER.stage("annotate"):
+                    frame = annotate_frame(webcam_frame, sample, current_duration)
+            else:
+                frame = webcam_frame
+            for sink in active_sinks:
+                sink.write(frame)
+        rate_controller.record_write(time.perf_counter() - start)
+
+    def read_frame():
+        # Frames coming faster than TARGET_FPS are skipped before the analysis,
+        # a replay that isn't paced in real time hands out every frame
+        while True:
+            ret, frame, timestamp = source.read()
+            if not ret or not source.live or rate_controller.admit(timestamp):
+                return ret, frame, timestamp
+
+    global _active_pipeline, _active_rate_controller
+    pipeline = GazePipeline(
+        read_frame,
+        make_analyzer,
+        write,
+        workers=ANALYSIS_WORKERS,
+        queue_size=CAPTURE_QUEUE_SIZE,
+        drop_frames=source.live,
+    )
 
 
     # -------------------- MAIN LOOP --------------------
+    # The profiler may already be on, e.g. for a benchmark
+    profiling = PROFILING and not PROFILER.enabled
+    if profiling:
+        PROFILER.enable()
+
+    session_start = time.perf_counter()
     try:
-        prev_frame_time = time.time()
+        pipeline.start()
+        _active_pipeline = pipeline
+        _active_rate_controller = rate_controller
 
         while True:
             if os.path.exists(STOP_FILE):
                 print("Stop signal detected, ending session...")
                 break
-        
-            webcam_ret, webcam_frame = webcam.read()
-            if not webcam_ret:
-                print("Error: Could not read from webcam")
-                break
-
-            gaze.refresh(webcam_frame)
-            frame = gaze.annotated_frame()
-
-            # Determine gaze direction and text for display
-            if gaze.is_blinking():
-                gaze_direction = "Blinking"
-                text = "Blinking"
-            elif gaze.is_right():
-                gaze_direction = "Right"
-                text = "Looking right"
-            elif gaze.is_left():
-                gaze_direction = "Left"
-                text = "Looking left"
-            else:
-                gaze_direction = "Center"
-                text = "Looking center"
-
-            # Track duration of the current gaze direction
-            current_time = time.time()
-            if gaze_direction != current_direction:
-                direction_start_time = current_time
-                current_direction = gaze_direction
-                current_duration = 0.0
-            else:
-                current_duration = current_time - direction_start_time
-
-            # Get pupil coordinates
-            left_pupil = gaze.pupil_left_coords()
-            right_pupil = gaze.pupil_right_coords()
-
-            # Log data to Excel workbook
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-
-            ws.append([
-                timestamp,
-                str(left_pupil),
-                str(right_pupil),
-                gaze_direction,
-                "Yes" if gaze.is_blinking() else "No",
-                round(current_duration, 2)
-            ])
-
-            # Overlay gaze information on the annotated frame
-            cv2.putText(frame, text, (90, 60), cv2.FONT_HERSHEY_DUPLEX, 1.6, (147, 58, 31), 2)
-            cv2.putText(frame, f"Duration: {round(current_duration, 1)}s", (90, 100), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (147, 58, 31), 1)
-            cv2.putText(frame, f"Left pupil: {left_pupil}", (90, 130), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (147, 58, 31), 1)
-            cv2.putText(frame, f"Right pupil: {right_pupil}", (90, 160), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (147, 58, 31), 1)
 
+            if not pipeline.capturing:
+                if replay:
+                    print("End of the replayed recording")
+                else:
+                    print("Error: Could not read from webcam")
+                break
 
+            time.sleep(0.05)
 
     except KeyboardInterrupt:
         print("\nReceived keyboard interrupt, saving data...")
 
     finally:
         # -------------------- CLEANUP --------------------
-        webcam.release()
+        pipeline.stop()
+        capture_seconds = time.perf_counter() - session_start
+        _active_pipeline = None
+        _active_rate_controller = None
+        for sink in frame_sinks:
+            sink.close()
+
+        calibrations = [analyzer.close() for analyzer in analyzers]
+        if frame_ring is not None:
+            frame_ring.close()
+
+        # Keep the calibration for the next session of the child
+        if not replay:
+            for calibration in calibrations:
+                if calibration is not None and calibration_store.save(child_id, camera_id, calibration):
+                    print(f"Calibration saved for child {child_id}")
+                    break
+        print(f"Pipeline stats: {pipeline.stats()}")
+        print(f"Rate control: {rate_controller.snapshot()}")
+        print(f"{'Replay' if replay else 'Camera'}: {source.describe()}")
+        if report is not None:
+            report.update({
+                "source": source.describe(),
+                "capture_seconds": capture_seconds,
+                "pipeline": pipeline.stats(),
+                "rate_control": rate_controller.snapshot(),
+            })
+        source.release()
+        if PROFILER.enabled:
+            profile_filename = os.path.join(session_folder, "profile.json")
+            PROFILER.dump(profile_filename)
+            print(f"Profile saved to {profile_filename}")
+        if profiling:
+            PROFILER.disable()
         if os.path.exists(STOP_FILE):
             os.remove(STOP_FILE)
-    
 
         # -------------------- SAVE DATA --------------------
-        
-        filename = os.path.join(session_folder, "gaze_data.xlsx")
+        step_start = time.perf_counter()
+        gaze_log_writer.close()
+        if gaze_log_writer.error is not None:
+            print(f"Warning: the gaze log stream is incomplete ({gaze_log_writer.error})")
+        save_session_log(gaze_log, session_folder)
+        if report is not None:
+            report["save_seconds"] = time.perf_counter() - step_start
+
+        session = {
+            "session_folder": session_folder,
+            "child_id": child_id,
+            "stimulus_id": stimulus_id,
+            "session_type": session_type,
+            "frame_width": frame_width,
+            "frame_height": frame_height,
+        }
+        if jobs is not None:
+            # The log is saved, the stream can go once the job is queued
+            job_id = jobs.submit(FINALIZE_JOB, session)
+            remove_session_stream(session_folder)
+            print(f"Post-processing queued as job {job_id}")
+            return {"job_id": job_id, "session_folder": session_folder}
 
-        wb.save(filename)
-        print(f"Data saved to {filename}")
-
-
-        # -------------------- DATA PROCESSING --------------------
-        df = pd.read_excel(filename, sheet_name='Eye Tracking Data')
-
-        def extract_coords(coord_str):
-            try:
-                if isinstance(coord_str, str) and coord_str.startswith("(") and coord_str.endswith(")"):
-                    stripped = coord_str.strip("()")
-                    parts = stripped.split(",")
-                    if len(parts) == 2:
-                        return [float(parts[0].strip()), float(parts[1].strip())]
-                return [None, None]
-            except Exception:
-                return [None, None]
-
-
-        # safer parsing for Left Pupil
-        left_coords = df["Left Pupil"].apply(lambda s: pd.Series(extract_coords(s)))
-        left_coords.columns = ["Left_X", "Left_Y"]
-        df = pd.concat([df, left_coords], axis=1)
-
-        # and for Right Pupil
-        right_coords = df["Right Pupil"].apply(lambda s: pd.Series(extract_coords(s)))
-        right_coords.columns = ["Right_X", "Right_Y"]
-        df = pd.concat([df, right_coords], axis=1)
-        if "Left_X" in df.columns and "Right_X" in df.columns:
-            df["Avg_X"] = df[["Left_X", "Right_X"]].mean(axis=1)
-            df["Avg_Y"] = df[["Left_Y", "Right_Y"]].mean(axis=1)
-        else:
-            print("Warning: Left_X or Right_X missing in DataFrame")
+        results = finalize_session(gaze_log, db=db, Report=Report, app=app, report=report, **session)
+        # Kept if the session couldn't be finished, recover_session.py can run it again
+        if results is not None:
+            remove_session_stream(session_folder)
+        return results
 
-        clean_df = df[(df['Blinking'] == 'No') & (df['Avg_X'].notna())].copy()
 
+def save_session_log(gaze_log, session_folder):
+    """Saves the gaze log of a session as gaze_data.npz, returns its path"""
+    filename = os.path.join(session_folder, "gaze_data.npz")
+    gaze_log.save(filename)
+    print(f"Data saved to {filename} ({len(gaze_log)} frames)")
+    return filename
 
 
-        # -------------------- SCANPATH GENERATION --------------------
-        fig, ax = plt.subplots(figsize=(2.24, 2.24), dpi=100)
-        fig.patch.set_facecolor('black')
-        ax.set_facecolor('black')
+def remove_session_stream(session_folder):
+    """Removes the gaze log stream of a session, once its log is saved"""
+    stream_filename = os.path.join(session_folder, GAZE_STREAM_FILE)
+    if os.path.exists(stream_filename):
+        os.remove(stream_filename)
 
-        for i in range(1, len(clean_df)):
-            x0, y0 = clean_df.iloc[i-1][['Avg_X', 'Avg_Y']]
-            x1, y1 = clean_df.iloc[i][['Avg_X', 'Avg_Y']]
-            color = plt.cm.jet(i / len(clean_df))
-            ax.plot([x0, x1], [y0, y1], color=color, alpha=0.5, linewidth=0.8)
 
-        ax.invert_yaxis()
-        ax.axis('off')
-        plt.subplots_adjust(left=0, right=1, top=1, bottom=0)
+def finalize_job(payload, progress, db=None, Report=None, app=None):
+    """Runs the post-processing of a session queued by run_gaze_session, see jobs.py
 
-        scanpath_filename = os.path.join(session_folder, "scanpath.png")
-        plt.savefig(scanpath_filename, dpi=100, facecolor='black')
-        plt.close()
-        print(f"Scanpath image saved as {scanpath_filename}")
+    Arguments:
+        payload (dict): Session folder and details of the session
+        progress (function): progress(fraction, message) reports the progress of the job
+        db, Report, app: Database of the app, the report is saved to it if given
+    """
+    gaze_log = GazeLog.load(os.path.join(payload["session_folder"], "gaze_data.npz"))
+    result = finalize_session(gaze_log, db=db, Report=Report, app=app, progress=progress, **payload)
+    if result is None:
+        raise RuntimeError("The ASD detection failed, see the log of the worker")
+    return result
 
 
+def finalize_session(gaze_log, session_folder, child_id, stimulus_id, session_type,
+                     frame_width, frame_height, db, Report, app, report=None, progress=None):
+    """Draws the scanpath and heatmap of a session from its saved gaze log, runs
+    the ASD detection on the scanpath and saves the results. Returns the
+    results, or None if the detection failed.
 
-        #  -------------------- HEATMAP GENERATION --------------------
-        print("Generating heatmap...")
-        
-        # Create a clean heatmap figure
-        fig, ax = plt.subplots(figsize=(10, 8))
-        fig.patch.set_facecolor('white')
-        ax.set_facecolor('white')
-        
-        # Extract gaze coordinates
-        x_coords = clean_df['Avg_X'].values
-        y_coords = clean_df['Avg_Y'].values
-        
-        # Create 2D histogram (heatmap)
-        heatmap, xedges, yedges = np.histogram2d(x_coords, y_coords, bins=50, 
-                                                range=[[0, 640], [0, 480]])
-        
-        # Apply Gaussian smoothing
-        heatmap = gaussian_filter(heatmap, sigma=1.5)
-        
-        # Display heatmap with 'hot' colormap
-        im = ax.imshow(heatmap.T, origin='lower', cmap='hot', 
-                    extent=[0, 640, 0, 480], aspect='auto')
-        
-        # Add colorbar
-        cbar = plt.colorbar(im, ax=ax)
-        cbar.set_label('Gaze Density', fontsize=12)
-        
-        # Set title and labels
-        ax.set_title('Gaze Heatmap', fontsize=14, pad=20)
-        ax.set_xlabel('X Coordinate (pixels)', fontsize=12)
-        ax.set_ylabel('Y Coordinate (pixels)', fontsize=12)
-        
-        # Add grid for better readability
-        ax.grid(True, alpha=0.3)
-        
-        # Invert y-axis to match image coordinates
-        ax.invert_yaxis()
-        
-        # Set axis limits
-        ax.set_xlim(0, 640)
-        ax.set_ylim(0, 480)
-        
-        heatmap_filename = os.path.join(session_folder, "heatmap.png")
-        plt.savefig(heatmap_filename, dpi=150, facecolor='white', bbox_inches='tight')
-        plt.close()
-        print(f"Heatmap image saved as {heatmap_filename}")
+    Also finishes a session recovered from its gaze log stream (see
+    recover_session.py). progress(fraction, message) is called before each step.
+    """
+    if progress is None:
+        progress = lambda fraction, message: None
+    step_start = time.perf_counter()
 
 
+    # -------------------- DATA PROCESSING --------------------
+    # Gaze points of the frames with both pupils located and the eyes open
+    x_coords, y_coords = gaze_log.gaze_points()
 
-        # -------------------- ASD DETECTION --------------------
-        print("Running ASD detection...")
-        result_data = None
 
-        try:
-            model = load_model("TFSMconverted_model.keras")
-            image = Image.open(scanpath_filename).convert("RGB")
-            image = ImageOps.fit(image, (224, 224), Image.Resampling.LANCZOS)
 
-            image_array = np.asarray(image)
-            normalized_image_array = (image_array.astype(np.float32) / 127.5) - 1
-            data = np.expand_dims(normalized_image_array, axis=0)
+    # -------------------- SCANPATH GENERATION --------------------
+    progress(0.1, "Drawing the scanpath")
+    # Drawn at the size of the model input, the model gets the image as is
+    scanpath_image = render_scanpath(x_coords, y_coords)
 
-            prediction = model.predict(data)
+    scanpath_filename = os.path.join(session_folder, "scanpath.png")
+    save_scanpath(scanpath_image, scanpath_filename)
+    print(f"Scanpath image saved as {scanpath_filename}")
 
-            if isinstance(prediction, dict):
-                prediction = list(prediction.values())[0]
 
-            index = np.argmax(prediction)
-            confidence_score = prediction[0][index]
 
-            class_names = open("labels.txt", "r").readlines()
-            class_name = class_names[index].strip()
-            print("Prediction:", class_name)
-            print("Confidence:", confidence_score)
-            #made changes here, added risk level safe
-            if class_name == "ASD":
-                if float(confidence_score) <= 0.6:
-                    risk_level = "Low"
-                elif 0.75 >= float(confidence_score) > 0.6:
-                    risk_level = "Moderate"
-                else:
-                    risk_level = "High"
-            elif class_name == "Non-ASD":
-                risk_level = "Safe"
-
-            result_filename = os.path.join(session_folder, "prediction_result.txt")
-            with open(result_filename, "w") as f:
-                f.write("ASD Prediction Result\n")
-                f.write("=====================\n")
-                f.write(f"Timestamp       : {datetime.now().strftime('%Y%m%d_%H%M%S')}\n")
-                f.write(f"Child_ID        : {child_id}\n")
-                f.write(f"Stimulus_ID     : {stimulus_id}\n")
-                f.write(f"Heatmap Image   : {heatmap_filename}\n")
-                f.write(f"Session_Type    : {session_type}\n")
-                f.write(f"Scanpath Image  : {scanpath_filename}\n")
-                f.write(f"Predicted Class : {class_name}\n")
-                f.write(f"Risk Level      : {risk_level}\n")
-                f.write(f"Confidence      : {confidence_score:.6f}\n")
-
-            print(f"Prediction result saved to {result_filename}")
-            print("Saving report for child_id:", child_id)
-
-
-
-            result_data = {
-            "child_id": child_id,
-            "stimulus_id": stimulus_id,
-            "session_type": session_type,
-            "predicted_class": class_name,
-            "risk_level": risk_level,
-            "confidence": float(confidence_score),
-            "scanpath_path": scanpath_filename,
-            "heatmap_path": heatmap_filename,
-            "gaze_data_path": filename,
-            "timestamp": datetime.now().strftime("%Y%m%d_%H%M%S")
-        }
+    #  -------------------- HEATMAP GENERATION --------------------
+    progress(0.2, "Drawing the heatmap")
+    print("Generating heatmap...")
+    
+    # Create a clean heatmap figure
+    fig = Figure(figsize=(10, 8))
+    ax = fig.add_subplot()
+    fig.patch.set_facecolor('white')
+    ax.set_facecolor('white')
+    
+    # Create 2D histogram (heatmap)
+    heatmap, xedges, yedges = np.histogram2d(x_coords, y_coords, bins=50, 
+                                            range=[[0, frame_width], [0, frame_height]])
+    
+    # Apply Gaussian smoothing
+    heatmap = gaussian_filter(heatmap, sigma=1.5)
+    
+    # Display heatmap with 'hot' colormap
+    im = ax.imshow(heatmap.T, origin='lower', cmap='hot', 
+                extent=[0, frame_width, 0, frame_height], aspect='auto')
+    
+    # Add colorbar
+    cbar = fig.colorbar(im, ax=ax)
+    cbar.set_label('Gaze Density', fontsize=12)
+    
+    # Set title and labels
+    ax.set_title('Gaze Heatmap', fontsize=14, pad=20)
+    ax.set_xlabel('X Coordinate (pixels)', fontsize=12)
+    ax.set_ylabel('Y Coordinate (pixels)', fontsize=12)
+    
+    # Add grid for better readability
+    ax.grid(True, alpha=0.3)
+    
+    # Invert y-axis to match image coordinates
+    ax.invert_yaxis()
+    
+    # Set axis limits
+    ax.set_xlim(0, frame_width)
+    ax.set_ylim(0, frame_height)
+    
+    heatmap_filename = os.path.join(session_folder, "heatmap.png")
+    fig.savefig(heatmap_filename, dpi=150, facecolor='white', bbox_inches='tight')
+    print(f"Heatmap image saved as {heatmap_filename}")
+
+    if report is not None:
+        report["post_processing_seconds"] = time.perf_counter() - step_start
+        step_start = time.perf_counter()
+
+    # -------------------- SPREADSHEET EXPORT --------------------
+    filename = os.path.join(session_folder, "gaze_data.npz")
+    if EXPORT_XLSX:
+        progress(0.5, "Exporting the spreadsheet")
+        filename = os.path.join(session_folder, "gaze_data.xlsx")
+        gaze_log.export_xlsx(filename)
+        print(f"Data exported to {filename}")
+        if report is not None:
+            report["export_seconds"] = time.perf_counter() - step_start
+            step_start = time.perf_counter()
 
-            # Save to JSON file (separate for each child & timestamp)
-            result_filename = os.path.join(session_folder, "results.json")
+    # -------------------- ASD DETECTION --------------------
+    progress(0.7, "Running the ASD detection")
+    print("Running ASD detection...")
+    result_data = None
 
-            with open(result_filename, "w") as f:
-                json.dump(result_data, f, indent=4)
-            
+    try:
+        # The model is loaded once per process, see MODEL_REGISTRY
+        data = to_model_input(scanpath_image)
+        class_name, confidence_score = MODEL_REGISTRY.classify(data)
+        print("Prediction:", class_name)
+        print("Confidence:", confidence_score)
+        risk = risk_level(class_name, confidence_score)
+
+        result_filename = os.path.join(session_folder, "prediction_result.txt")
+        with open(result_filename, "w") as f:
+            f.write("ASD Prediction Result\n")
+            f.write("=====================\n")
+            f.write(f"Timestamp       : {datetime.now().strftime('%Y%m%d_%H%M%S')}\n")
+            f.write(f"Child_ID        : {child_id}\n")
+            f.write(f"Stimulus_ID     : {stimulus_id}\n")
+            f.write(f"Heatmap Image   : {heatmap_filename}\n")
+            f.write(f"Session_Type    : {session_type}\n")
+            f.write(f"Scanpath Image  : {scanpath_filename}\n")
+            f.write(f"Predicted Class : {class_name}\n")
+            f.write(f"Risk Level      : {risk}\n")
+            f.write(f"Confidence      : {confidence_score:.6f}\n")
+
+        print(f"Prediction result saved to {result_filename}")
+        print("Saving report for child_id:", child_id)
+
+
+
+        result_data = {
+        "child_id": child_id,
+        "stimulus_id": stimulus_id,
+        "session_type": session_type,
+        "predicted_class": class_name,
+        "risk_level": risk,
+        "confidence": confidence_score,
+        "scanpath_path": scanpath_filename,
+        "heatmap_path": heatmap_filename,
+        "gaze_data_path": filename,
+        "timestamp": datetime.now().strftime("%Y%m%d_%H%M%S")
+    }
+
+        # Save to JSON file (separate for each child & timestamp)
+        result_filename = os.path.join(session_folder, "results.json")
+
+        with open(result_filename, "w") as f:
+            json.dump(result_data, f, indent=4)
+        
 
-            save_results_to_db(child_id,db, Report,app)
+        if db is not None:
+            progress(0.9, "Saving the report")
+            save_results_to_db(child_id,db, Report,app, session_folder)
 
-        
-        except Exception as e:
-            print(f"Error during ASD detection: {str(e)}")
-                    
-        return result_data
+    
+    except Exception as e:
+        print(f"Error during ASD detection: {str(e)}")
+
+    if report is not None:
+        report["prediction_seconds"] = time.perf_counter() - step_start
+        report["session_folder"] = session_folder
+                
+    return result_data
 
 
 
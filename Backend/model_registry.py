@@ -0,0 +1,284 @@
+# model_registry.py
+# ASD model of the server, loaded once per process instead of once per
+# session. The model is loaded at startup (preload) or on the first
+# prediction, warmed up with one inference, then served through a compiled
+# single-image function instead of model.predict (which builds a dataset
+# and a graph on every call).
+#
+#   registry = ModelRegistry("TFSMconverted_model.keras", "labels.txt")
+#   registry.preload()                      # at startup, in the background
+#   class_name, confidence = registry.classify(batch)
+#   registry.reload("new_model.keras")      # hot swap, no restart
+#
+# A reload loads and warms up the new version next to the current one, the
+# predictions switch to it once it is ready. A version that fails to load
+# leaves the current one in place. Only the files of the model folder (the
+# folder of the first model by default) can be reloaded: loading a Keras
+# file runs its code, and the labels are served back by info().
+#
+# The runtime is picked from the type of the model file (see LOADERS):
+#   .keras / .h5   Keras, needs TensorFlow
+#   .onnx          ONNX Runtime, needs onnxruntime only
+#   .tflite        TensorFlow Lite, needs tflite-runtime (or TensorFlow)
+# The .onnx and .tflite files are exported from the Keras model with export_model.py.
+import os
+import threading
+import time
+
+import numpy as np
+
+# Shape of one model input, see scanpath.to_model_input()
+INPUT_SHAPE = (224, 224, 3)
+# Type of the class names files
+LABELS_EXTENSION = ".txt"
+
+
+def _load_keras(path, input_shape):
+    """Loads a Keras model, returns its compiled single-batch predict function"""
+    import tensorflow as tf
+    from keras.models import load_model
+
+    model = load_model(path)
+
+    @tf.function(input_signature=[tf.TensorSpec((None,) + tuple(input_shape), tf.float32)])
+    def predict(batch):
+        outputs = model(batch, training=False)
+        if isinstance(outputs, dict):
+            outputs = list(outputs.values())[0]
+        return outputs
+
+    return lambda batch: predict(batch).numpy()
+
+
+def _load_onnx(path, input_shape):
+    """Loads an ONNX model in ONNX Runtime on the CPU, returns its predict function"""
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+    input_name = session.get_inputs()[0].name
+
+    return lambda batch: session.run(None, {input_name: batch})[0]
+
+
+def _load_tflite(path, input_shape):
+    """Loads a TensorFlow Lite model, returns its predict function. The
+    interpreter takes one image at a time, a batch is predicted image by image."""
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+
+    interpreter = Interpreter(model_path=path, num_threads=os.cpu_count())
+    interpreter.allocate_tensors()
+    input_details = interpreter.get_input_details()[0]
+    output_details = interpreter.get_output_details()[0]
+    # Quantized models may take and give integers, (scale, zero point) of each
+    input_scale, input_zero = input_details["quantization"]
+    output_scale, output_zero = output_details["quantization"]
+
+    def predict(batch):
+        outputs = []
+        for image in batch:
+            if input_scale:
+                limits = np.iinfo(input_details["dtype"])
+                image = np.clip(np.round(image / input_scale + input_zero), limits.min, limits.max)
+            interpreter.set_tensor(input_details["index"], image[np.newaxis].astype(input_details["dtype"]))
+            interpreter.invoke()
+            outputs.append(interpreter.get_tensor(output_details["index"])[0])
+        outputs = np.stack(outputs).astype(np.float32)
+        if output_scale:
+            outputs = (outputs - output_zero) * output_scale
+        return outputs
+
+    return predict
+
+
+# Loader of each model file type: (path, input_shape) -> predict function
+LOADERS = {
+    ".keras": _load_keras,
+    ".h5": _load_keras,
+    ".onnx": _load_onnx,
+    ".tflite": _load_tflite,
+}
+
+
+def risk_level(class_name, confidence):
+    """Returns the risk level reported for a prediction
+
+    Arguments:
+        class_name (str): Predicted class, "ASD" or "Non-ASD"
+        confidence (float): Probability of the predicted class
+    """
+    if class_name == "Non-ASD":
+        return "Safe"
+    if class_name != "ASD":
+        raise ValueError(f"Unknown class {class_name}")
+    if confidence <= 0.6:
+        return "Low"
+    if confidence <= 0.75:
+        return "Moderate"
+    return "High"
+
+
+class _LoadedModel(object):
+    """A loaded and warmed up version of the model"""
+
+    def __init__(self, path, labels_path, input_shape, version):
+        self.path = path
+        self.labels_path = labels_path
+        self.version = version
+        self.predictions = 0
+
+        start = time.perf_counter()
+        extension = os.path.splitext(path)[1].lower()
+        if extension not in LOADERS:
+            raise ValueError(f"No loader for the model {path}, known types: {', '.join(LOADERS)}")
+        self._predict = LOADERS[extension](path, input_shape)
+        with open(labels_path, "r") as f:
+            self.labels = [line.strip() for line in f if line.strip()]
+        self.load_seconds = time.perf_counter() - start
+
+        # Calls from several threads (sessions, reload checks) run one at a time
+        self._lock = threading.Lock()
+
+        # The first inference builds the graph, it is paid here and not by a session
+        start = time.perf_counter()
+        self.predict(np.zeros((1,) + tuple(input_shape), np.float32))
+        self.warmup_seconds = time.perf_counter() - start
+        self.predictions = 0
+        self.loaded_at = time.time()
+
+    def predict(self, batch):
+        with self._lock:
+            outputs = np.asarray(self._predict(np.asarray(batch, np.float32)))
+            self.predictions += 1
+        return outputs
+
+    def info(self):
+        return {
+            "loaded": True,
+            "model_path": self.path,
+            "labels_path": self.labels_path,
+            "labels": self.labels,
+            "version": self.version,
+            "loaded_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.loaded_at)),
+            "load_seconds": round(self.load_seconds, 3),
+            "warmup_seconds": round(self.warmup_seconds, 3),
+            "predictions": self.predictions,
+        }
+
+
+class ModelRegistry(object):
+    """
+    Holds the model of the process, shared by every session.
+
+    Arguments:
+        model_path (str): Model file, its type picks the loader (see LOADERS)
+        labels_path (str): Class names, one per line, in the order of the model outputs
+        input_shape (tuple): Shape of one model input
+        model_dir (str): Folder of the files reload() accepts, the folder of model_path by default
+    """
+
+    def __init__(self, model_path, labels_path, input_shape=INPUT_SHAPE, model_dir=None):
+        self.model_path = model_path
+        self.labels_path = labels_path
+        self.input_shape = tuple(input_shape)
+        self.model_dir = os.path.realpath(model_dir or os.path.dirname(os.path.abspath(model_path)))
+        self._model = None
+        self._versions = 0
+        # Loads and swaps happen one at a time, predictions don't wait for them
+        self._load_lock = threading.Lock()
+
+    def _load(self, model_path, labels_path):
+        version = self._versions + 1
+        print(f"Loading the model {model_path} (version {version})...")
+        model = _LoadedModel(model_path, labels_path, self.input_shape, version)
+        self._versions = version
+        print(f"Model loaded in {model.load_seconds:.2f} s, warmed up in {model.warmup_seconds:.2f} s")
+        return model
+
+    def get(self):
+        """Returns the current model, loading it if needed"""
+        model = self._model
+        if model is None:
+            with self._load_lock:
+                if self._model is None:
+                    self._model = self._load(self.model_path, self.labels_path)
+                model = self._model
+        return model
+
+    def preload(self):
+        """Loads the model in a background thread, so the first session doesn't wait for it"""
+        def load():
+            try:
+                self.get()
+            except Exception as e:
+                print(f"Error while preloading the model: {e}")
+
+        thread = threading.Thread(target=load, name="model-preload", daemon=True)
+        thread.start()
+        return thread
+
+    def resolve(self, name, extensions):
+        """Returns the real path of a file of the model folder, raises
+        ValueError if it is outside of it or of another type
+
+        Arguments:
+            name (str): File name, relative to the model folder
+            extensions (iterable): File types accepted, e.g. LOADERS
+        """
+        path = os.path.realpath(os.path.join(self.model_dir, name))
+        if os.path.commonpath([self.model_dir, path]) != self.model_dir:
+            raise ValueError(f"{name} is not in the model folder")
+        if os.path.splitext(path)[1].lower() not in extensions:
+            raise ValueError(f"{name} is not one of the accepted file types: {', '.join(extensions)}")
+        if not os.path.isfile(path):
+            raise ValueError(f"{name} is not a file of the model folder")
+        return path
+
+    def reload(self, model_file=None, labels_file=None):
+        """Loads a new version of the model and serves it once it is warmed up.
+        The current version keeps serving until then, and stays if the new
+        one fails to load (the error is raised). Returns the info of the new version.
+
+        Arguments:
+            model_file (str): Model file of the model folder, the current one by default
+            labels_file (str): Class names file of the model folder, the current one by default
+        """
+        model_path = self.resolve(model_file, LOADERS) if model_file else self.model_path
+        labels_path = self.resolve(labels_file, (LABELS_EXTENSION,)) if labels_file else self.labels_path
+        with self._load_lock:
+            model = self._load(model_path, labels_path)
+            self._model = model
+            self.model_path = model_path
+            self.labels_path = labels_path
+        return model.info()
+
+    def predict(self, batch):
+        """Returns the class probabilities of a batch of model inputs
+
+        Argument:
+            batch (numpy.ndarray): Model inputs, see scanpath.to_model_input()
+        """
+        return self.get().predict(batch)
+
+    def classify(self, batch):
+        """Returns the predicted class and its probability for the first input of a batch
+
+        Argument:
+            batch (numpy.ndarray): Model inputs, see scanpath.to_model_input()
+        """
+        model = self.get()
+        prediction = model.predict(batch)[0]
+        index = int(np.argmax(prediction))
+        return model.labels[index], float(prediction[index])
+
+    def info(self):
+        """Returns the paths, version and timings of the current model"""
+        model = self._model
+        if model is None:
+            return {"loaded": False, "model_path": self.model_path, "labels_path": self.labels_path}
+        return model.info()
@@ -0,0 +1,214 @@
+# pipeline.py
+# Staged gaze session pipeline: a capture thread, one or more analysis
+# workers and a writer thread, connected by bounded queues.
+#
+#   capture --(drop-oldest queue)--> analysis xN --(ordered queue)--> writer
+#
+# The capture queue drops its oldest frame when the analysis falls behind,
+# so the camera is always read at its own pace (unless frame dropping is
+# off, e.g. to replay a recording deterministically). The writer receives
+# the analyzed frames back in capture order.
+import heapq
+import queue
+import threading
+import time
+
+_STOP = object()
+
+
+class DropOldestQueue(queue.Queue):
+    """Bounded queue where putting into a full queue drops the oldest item"""
+
+    def __init__(self, maxsize):
+        super().__init__(maxsize)
+        self.dropped = 0
+
+    def put_latest(self, item):
+        """Puts an item without blocking, dropping the oldest items if the queue is full"""
+        with self.mutex:
+            while self._qsize() >= self.maxsize:
+                self._get()
+                self.unfinished_tasks -= 1
+                self.dropped += 1
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+
+class StageStats(object):
+    """Counts the items processed by a stage and how long they took"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.last_time = 0.0
+
+    def add(self, seconds):
+        with self._lock:
+            self.count += 1
+            self.total_time += seconds
+            self.last_time = seconds
+            if seconds > self.max_time:
+                self.max_time = seconds
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "count": self.count,
+                "avg_ms": round(1000 * self.total_time / self.count, 3) if self.count else None,
+                "max_ms": round(1000 * self.max_time, 3),
+                "last_ms": round(1000 * self.last_time, 3),
+            }
+
+
+class GazePipeline(object):
+    """
+    Runs a gaze session as three stages in their own threads.
+
+    Arguments:
+        read_frame: Callable returning (ok, frame, timestamp), like FrameSource.read
+        make_analyzer: Called once per analysis worker, returns a callable
+            analyze(frame) -> result
+        write: Called from the writer thread as write(timestamp, frame, result),
+            in capture order
+        workers (int): Number of analysis workers
+        queue_size (int): Frames waiting for analysis before the oldest is dropped
+        write_queue_size (int): Analyzed frames waiting for the writer
+        drop_frames (bool): Drops the oldest frame when the analysis falls behind,
+            otherwise the capture waits for the analysis and every frame is analyzed
+    """
+
+    def __init__(self, read_frame, make_analyzer, write, workers=1, queue_size=2, write_queue_size=64,
+                 drop_frames=True):
+        self._read_frame = read_frame
+        self._make_analyzer = make_analyzer
+        self._write = write
+        self._workers = workers
+        self._drop_frames = drop_frames
+
+        self._analysis_queue = DropOldestQueue(queue_size)
+        self._write_queue = queue.Queue(write_queue_size)
+        self._stop_event = threading.Event()
+        self._take_lock = threading.Lock()
+        self._next_seq = 0
+        self._threads = []
+
+        self._stats = {
+            "capture": StageStats(),
+            "analysis": StageStats(),
+            "write": StageStats(),
+        }
+        self.capture_failed = False
+
+    # -------------------- STAGES --------------------
+    def _capture(self):
+        stats = self._stats["capture"]
+        while not self._stop_event.is_set():
+            start = time.perf_counter()
+            ret, frame, timestamp = self._read_frame()
+            if not ret:
+                self.capture_failed = True
+                break
+            stats.add(time.perf_counter() - start)
+            if self._drop_frames:
+                self._analysis_queue.put_latest((timestamp, frame))
+            else:
+                self._analysis_queue.put((timestamp, frame))
+
+        for _ in range(self._workers):
+            self._analysis_queue.put(_STOP)
+
+    def _take(self):
+        """Takes the next frame to analyze along with its position in the
+        analysis order (frames dropped by the capture queue get none)"""
+        with self._take_lock:
+            item = self._analysis_queue.get()
+            if item is _STOP:
+                return None, item
+            seq = self._next_seq
+            self._next_seq += 1
+            return seq, item
+
+    def _analysis(self, analyze):
+        stats = self._stats["analysis"]
+        while True:
+            seq, item = self._take()
+            if item is _STOP:
+                break
+
+            timestamp, frame = item
+            start = time.perf_counter()
+            try:
+                result = analyze(frame)
+            except Exception as e:
+                print(f"Error during gaze analysis: {e}")
+                result = None
+            stats.add(time.perf_counter() - start)
+            self._write_queue.put((seq, timestamp, frame, result))
+
+    def _writer(self):
+        stats = self._stats["write"]
+        pending = []
+        next_seq = 0
+        while True:
+            item = self._write_queue.get()
+            if item is _STOP:
+                break
+            heapq.heappush(pending, item)
+
+            # With several workers frames can finish out of order
+            while pending and pending[0][0] == next_seq:
+                _, timestamp, frame, result = heapq.heappop(pending)
+                next_seq += 1
+                if result is None:
+                    continue
+                start = time.perf_counter()
+                try:
+                    self._write(timestamp, frame, result)
+                except Exception as e:
+                    print(f"Error while writing gaze data: {e}")
+                stats.add(time.perf_counter() - start)
+
+    # -------------------- CONTROL --------------------
+    def start(self):
+        """Starts the writer, the analysis workers and the capture, in that order"""
+        writer = threading.Thread(target=self._writer, name="gaze-writer", daemon=True)
+        analysts = [
+            threading.Thread(target=self._analysis, args=(self._make_analyzer(),), name=f"gaze-analysis-{i}", daemon=True)
+            for i in range(self._workers)
+        ]
+        capture = threading.Thread(target=self._capture, name="gaze-capture", daemon=True)
+
+        self._threads = [capture] + analysts + [writer]
+        writer.start()
+        for thread in analysts:
+            thread.start()
+        capture.start()
+
+    @property
+    def capturing(self):
+        """True until the capture stops (stop() was called or the source ran out of frames)"""
+        return bool(self._threads) and self._threads[0].is_alive()
+
+    def stop(self):
+        """Stops the capture, lets the workers finish the frames already
+        captured and waits until the writer has written them"""
+        if not self._threads:
+            return
+        self._stop_event.set()
+        capture, analysts, writer = self._threads[0], self._threads[1:-1], self._threads[-1]
+        capture.join()
+        for thread in analysts:
+            thread.join()
+        self._write_queue.put(_STOP)
+        writer.join()
+
+    def stats(self):
+        """Returns the queue depths and the timings of every stage"""
+        stats = {name: stage.snapshot() for name, stage in self._stats.items()}
+        stats["analysis"]["queue_depth"] = self._analysis_queue.qsize()
+        stats["analysis"]["dropped"] = self._analysis_queue.dropped
+        stats["write"]["queue_depth"] = self._write_queue.qsize()
+        return stats
@@ -0,0 +1,194 @@
+# rate_control.py
+# Keeps the gaze sampling rate of a session at a target rate, whatever the
+# load of the PC. Frames coming faster than the target are skipped before
+# the analysis, and when the analysis can't keep up the controller steps
+# down to cheaper settings (and back up once the load is low again).
+#
+# The levels are relative to the configured settings of the session, level 0
+# is those settings (see build_levels). With the defaults:
+#
+#   level  detection interval  detection scale  filter size  annotation
+#     0        10 (x1)            1.0 (x1)         10 (x1)        yes
+#     1        15 (x1.5)          0.75 (x0.75)      7 (x0.7)      yes
+#     2        20 (x2)            0.5 (x0.5)        5 (x0.5)      no
+#     3        30 (x3)            0.5 (x0.5)        5 (x0.5)      no
+#
+# The level used for each frame is logged with it, so sessions can be
+# compared on their settings as well as on their rate. The pupil thresholds
+# depend on the filter size, a level that changes it calibrates the eyes
+# again (see GazeTracking.filter_size).
+import threading
+from collections import deque, namedtuple
+
+QualityLevel = namedtuple(
+    "QualityLevel", ["detection_interval", "detection_scale", "filter_size", "annotate"]
+)
+
+# (detection interval multiplier, detection scale factor, filter size factor, annotation) of each level
+LEVEL_FACTORS = (
+    (1.0, 1.0, 1.0, True),
+    (1.5, 0.75, 0.7, True),
+    (2.0, 0.5, 0.5, False),
+    (3.0, 0.5, 0.5, False),
+)
+
+
+def build_levels(detection_interval=10, detection_scale=1.0, filter_size=10, factors=LEVEL_FACTORS):
+    """Returns the quality levels of a session, level 0 being its configured settings
+
+    Arguments:
+        detection_interval (int): Configured face detection interval, in frames
+        detection_scale (float): Configured scale of the frame used for face detection
+        filter_size (int): Configured size of the pupil filter (Pupil.FILTER_SIZE)
+        factors (tuple): Factors of each level, see LEVEL_FACTORS
+    """
+    return tuple(
+        QualityLevel(
+            max(1, int(round(detection_interval * interval_factor))),
+            detection_scale * scale_factor,
+            max(1, int(round(filter_size * filter_factor))),
+            annotate,
+        )
+        for interval_factor, scale_factor, filter_factor, annotate in factors
+    )
+
+
+LEVELS = build_levels()
+
+
+class RateController(object):
+    """
+    Chooses the quality level of the analysis from the time spent per frame.
+
+    The load is the share of the frame budget (1 / target_fps) used by the
+    slowest stage: the analysis (shared by its workers) or the writer.
+
+    Arguments:
+        target_fps (float): Sampling rate of the session, in frames per second
+        workers (int): Number of analysis workers sharing the frames
+        levels (tuple): QualityLevel settings, from the best to the cheapest
+        window (int): Frames the load is averaged over
+        high_load (float): Above this load the controller steps down
+        low_load (float): Below this load the controller steps back up
+        upgrade_delay (int): Frames to spend at a level before stepping back up,
+            so the level doesn't swing between two neighbours
+        adaptive (bool): Changes the level with the load, otherwise the first
+            level is kept (the results then don't depend on the speed of the PC)
+    """
+
+    def __init__(self, target_fps, workers=1, levels=LEVELS, window=30, high_load=0.9, low_load=0.6,
+                 upgrade_delay=300, adaptive=True):
+        self.target_fps = target_fps
+        self.adaptive = adaptive
+        self.workers = workers
+        self.levels = levels
+        self.window = window
+        self.high_load = high_load
+        self.low_load = low_load
+        self.upgrade_delay = upgrade_delay
+
+        self._lock = threading.Lock()
+        self._index = 0
+        self._frames_at_level = 0
+        self._analysis_times = deque(maxlen=window)
+        self._write_times = deque(maxlen=window)
+        self._next_due = None
+        self.skipped = 0
+        self.changes = 0
+        self.frames_per_level = [0] * len(levels)
+
+    @property
+    def index(self):
+        """Position of the current level in levels, 0 is the best"""
+        return self._index
+
+    @property
+    def level(self):
+        """Current QualityLevel"""
+        return self.levels[self._index]
+
+    def admit(self, timestamp):
+        """Returns true if a frame captured at timestamp is due for analysis,
+        false if it comes ahead of the target rate and should be skipped
+
+        Argument:
+            timestamp (float): Capture time of the frame, in seconds
+        """
+        period = 1.0 / self.target_fps
+        with self._lock:
+            if self._next_due is not None and timestamp < self._next_due:
+                self.skipped += 1
+                return False
+
+            # After a stall the schedule restarts from now, frames aren't admitted in a burst
+            if self._next_due is None or timestamp - self._next_due > period:
+                self._next_due = timestamp
+            self._next_due += period
+            return True
+
+    def load(self):
+        """Returns the share of the frame budget used by the slowest stage,
+        or None before the first frame"""
+        with self._lock:
+            return self._load()
+
+    def _load(self):
+        if not self._analysis_times:
+            return None
+        analysis = sum(self._analysis_times) / len(self._analysis_times) / self.workers
+        write = sum(self._write_times) / len(self._write_times) if self._write_times else 0.0
+        return max(analysis, write) * self.target_fps
+
+    def record_analysis(self, seconds, level):
+        """Adds the analysis time of a frame and adjusts the level once
+        a full window of frames has been analyzed at the current level
+
+        Arguments:
+            seconds (float): Time spent analyzing the frame
+            level (QualityLevel): Level the frame was analyzed with
+        """
+        with self._lock:
+            self.frames_per_level[self.levels.index(level)] += 1
+            if not self.adaptive or level != self.level:
+                # Analyzed before the last change, it says nothing about the current level
+                return
+            self._analysis_times.append(seconds)
+            self._frames_at_level += 1
+            if len(self._analysis_times) < self.window:
+                return
+
+            load = self._load()
+            if load > self.high_load and self._index < len(self.levels) - 1:
+                self._change(self._index + 1)
+            elif load < self.low_load and self._index > 0 and self._frames_at_level >= self.upgrade_delay:
+                self._change(self._index - 1)
+
+    def record_write(self, seconds):
+        """Adds the time the writer spent on a frame
+
+        Argument:
+            seconds (float): Time spent logging and annotating the frame
+        """
+        with self._lock:
+            self._write_times.append(seconds)
+
+    def _change(self, index):
+        self._index = index
+        self._frames_at_level = 0
+        self.changes += 1
+        self._analysis_times.clear()
+        self._write_times.clear()
+
+    def snapshot(self):
+        """Returns the current level and load, and how many frames used each level"""
+        with self._lock:
+            load = self._load()
+            return {
+                "target_fps": self.target_fps,
+                "level": self._index,
+                "settings": self.level._asdict(),
+                "load": round(load, 3) if load is not None else None,
+                "changes": self.changes,
+                "skipped": self.skipped,
+                "frames_per_level": list(self.frames_per_level),
+            }
@@ -0,0 +1,94 @@
+# recover_session.py
+# Finishes the gaze sessions interrupted by a crash, a killed process or a
+# power loss, from the gaze log they streamed to the disk (gaze_data.bin).
+#
+#   python recover_session.py                      # every interrupted session in results/
+#   python recover_session.py results/12/20250101_101500 --save-to-db
+#
+# The log is read up to its last complete row, then the session is finished
+# like a normal one: gaze_data.npz, scanpath, heatmap, gaze_data.xlsx,
+# prediction and results.json in the session folder. --save-to-db also adds
+# the report to the database of the app.
+import argparse
+import glob
+import os
+import time
+
+import main
+from gaze_log import read_stream
+
+# A stream modified more recently than this may belong to a running session
+MIN_AGE_SECONDS = 60
+
+
+def find_interrupted_sessions(results_dir="results", min_age=MIN_AGE_SECONDS):
+    """Returns the session folders left with a gaze log stream, the oldest first
+
+    Arguments:
+        results_dir (str): Folder of the results, one subfolder per child
+        min_age (float): Seconds since the last write of a stream, younger ones are skipped
+    """
+    now = time.time()
+    folders = []
+    for stream in glob.glob(os.path.join(results_dir, "*", "*", main.GAZE_STREAM_FILE)):
+        if now - os.path.getmtime(stream) >= min_age:
+            folders.append(os.path.dirname(stream))
+    return sorted(folders, key=lambda folder: os.path.getmtime(os.path.join(folder, main.GAZE_STREAM_FILE)))
+
+
+def recover_session(session_folder, db=None, Report=None, app=None):
+    """Finishes a session from its gaze log stream, returns its results or
+    None if the session couldn't be finished
+
+    Arguments:
+        session_folder (str): Folder of the session
+        db, Report, app: Database of the app, the report is saved to it if given
+    """
+    stream = os.path.join(session_folder, main.GAZE_STREAM_FILE)
+    try:
+        gaze_log, metadata = read_stream(stream)
+    except (OSError, ValueError) as e:
+        print(f"{session_folder}: can't be recovered ({e})")
+        return None
+    if not len(gaze_log):
+        print(f"{session_folder}: no frame was logged before the interruption")
+        return None
+
+    print(f"{session_folder}: recovering {len(gaze_log)} frames of child {metadata['child_id']}")
+    main.save_session_log(gaze_log, session_folder)
+    results = main.finalize_session(
+        gaze_log, session_folder, metadata["child_id"], metadata["stimulus_id"], metadata["session_type"],
+        metadata["frame_width"], metadata["frame_height"], db, Report, app,
+    )
+    # The stream goes once the session is finished, a failed run can be recovered again
+    if results is not None:
+        main.remove_session_stream(session_folder)
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Finish the gaze sessions interrupted by a crash")
+    parser.add_argument("folders", nargs="*", help="Session folders, every interrupted session by default")
+    parser.add_argument("--results", default="results", help="Folder of the results")
+    parser.add_argument("--min-age", type=float, default=MIN_AGE_SECONDS,
+                        help="Skip the streams written in the last N seconds (running sessions)")
+    parser.add_argument("--save-to-db", action="store_true", help="Add the reports to the database of the app")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    folders = args.folders or find_interrupted_sessions(args.results, args.min_age)
+    if not folders:
+        print("No interrupted session found")
+
+    db = Report = app = None
+    if args.save_to_db:
+        from app import app
+        from database import db, Report
+
+    recovered = 0
+    for folder in folders:
+        if recover_session(folder, db, Report, app) is not None:
+            recovered += 1
+    print(f"{recovered}/{len(folders)} sessions recovered")
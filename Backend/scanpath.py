@@ -0,0 +1,240 @@
+# scanpath.py
+# Scanpath image of a session, the input of the ASD model: the gaze points
+# joined by a line going from blue (first point) to red (last point) through
+# the jet colormap, on black, 224x224 pixels.
+#
+# The image is drawn with cv2 straight into a numpy buffer, which is given
+# to the model as is: no matplotlib figure (one artist per segment), no PNG
+# written and read back. The PNG is only saved for the report.
+#
+# It reproduces the matplotlib figure the model was trained on:
+#   - the axes fill the image, their limits are the range of the points plus
+#     a 5% margin on each side, the y axis is inverted (image coordinates)
+#   - the segments are drawn in order, 0.8 points wide (at 100 dpi), with an
+#     alpha of 0.5 over the previous ones
+# The line is drawn on a canvas SUPERSAMPLING times larger, then averaged
+# down, which anti-aliases it like matplotlib.
+#
+#   python scanpath.py validate results/*/*/gaze_data.npz --model TFSMconverted_model.keras
+#
+# compares the model inputs (and predictions) of this renderer with the ones
+# of the matplotlib figure, see validate().
+import argparse
+import io
+import sys
+
+import cv2
+import numpy as np
+
+from gaze_log import GazeLog
+
+SIZE = 224
+MARGIN = 0.05
+ALPHA = 0.5
+# 0.8 points at 100 dots per inch, in pixels
+LINE_WIDTH = 0.8 * 100 / 72
+SUPERSAMPLING = 4
+# Fractional bits of the coordinates given to cv2.line
+_SHIFT = 4
+
+# Anchors of the matplotlib jet colormap, (position, value) per channel
+_JET_ANCHORS = (
+    ((0.0, 0.0), (0.35, 0.0), (0.66, 1.0), (0.89, 1.0), (1.0, 0.5)),
+    ((0.0, 0.0), (0.125, 0.0), (0.375, 1.0), (0.64, 1.0), (0.91, 0.0), (1.0, 0.0)),
+    ((0.0, 0.5), (0.11, 1.0), (0.34, 1.0), (0.65, 0.0), (1.0, 0.0)),
+)
+# matplotlib looks the colors up in a table of 256 entries
+_JET = np.stack([np.interp(np.linspace(0, 1, 256), *zip(*anchors)) for anchors in _JET_ANCHORS], axis=1)
+
+
+def jet(values):
+    """Returns the RGB colors (floats in [0, 1]) of the jet colormap, like matplotlib's plt.cm.jet
+
+    Argument:
+        values (numpy.ndarray): Positions in the colormap, in [0, 1]
+    """
+    indices = np.clip((np.asarray(values) * len(_JET)).astype(int), 0, len(_JET) - 1)
+    return _JET[indices]
+
+
+def _axis_limits(values):
+    """Returns the (low, high) limits matplotlib autoscales an axis to"""
+    low, high = float(values.min()), float(values.max())
+    margin = (high - low) * MARGIN
+    return low - margin, high + margin
+
+
+def render_scanpath(x, y, size=SIZE):
+    """Draws the scanpath of gaze points, returns an RGB image (uint8, size x size x 3)
+
+    Arguments:
+        x (numpy.ndarray): x coordinates of the gaze points, in order
+        y (numpy.ndarray): y coordinates of the gaze points
+        size (int): Width and height of the image, in pixels
+    """
+    x = np.asarray(x, np.float64)
+    y = np.asarray(y, np.float64)
+    scale = size * SUPERSAMPLING
+    canvas = np.zeros((scale, scale, 3), np.float32)
+    if len(x) < 2:
+        return canvas[:size, :size].astype(np.uint8)
+
+    # Data coordinates to canvas coordinates (pixel centers), all points at once.
+    # Points on an axis without range are drawn in the middle of it.
+    coordinates = []
+    for values in (x, y):
+        low, high = _axis_limits(values)
+        if high > low:
+            pixels = (values - low) / (high - low) * scale - 0.5
+        else:
+            pixels = np.full(len(values), scale / 2 - 0.5)
+        coordinates.append(pixels)
+    points = np.round(np.column_stack(coordinates) * (1 << _SHIFT)).astype(np.int64)
+
+    thickness = max(1, int(round(LINE_WIDTH * SUPERSAMPLING)))
+    padding = thickness + 1
+    colors = jet(np.arange(1, len(x)) / len(x)).astype(np.float32)
+
+    # Pixels of the canvas covered by the points, limits of the bounding box of each segment
+    corners = np.clip(points >> _SHIFT, 0, scale - 1)
+    starts = np.clip(np.minimum(corners[:-1], corners[1:]) - padding, 0, scale)
+    ends = np.clip(np.maximum(corners[:-1], corners[1:]) + padding + 1, 0, scale)
+
+    mask = np.empty((scale, scale), np.uint8)
+    for i in range(len(x) - 1):
+        (left, top), (right, bottom) = starts[i], ends[i]
+        offset = np.array([left, top]) << _SHIFT
+        roi = mask[top:bottom, left:right]
+        roi[:] = 0
+        cv2.line(roi, tuple(map(int, points[i] - offset)), tuple(map(int, points[i + 1] - offset)),
+                 1, thickness, cv2.LINE_8, _SHIFT)
+
+        # Each segment is blended over the previous ones, like the matplotlib artists
+        covered = roi.view(bool)
+        region = canvas[top:bottom, left:right]
+        region[covered] = region[covered] * (1 - ALPHA) + colors[i] * ALPHA
+
+    image = cv2.resize(canvas, (size, size), interpolation=cv2.INTER_AREA)
+    return np.round(image * 255).astype(np.uint8)
+
+
+def save_scanpath(image, filename):
+    """Saves a scanpath image (RGB) as a PNG file"""
+    if not cv2.imwrite(filename, cv2.cvtColor(image, cv2.COLOR_RGB2BGR)):
+        raise IOError(f"Could not save the scanpath image {filename}")
+
+
+def to_model_input(image):
+    """Returns the input of the ASD model for a scanpath image: a batch of one
+    image, with the pixels scaled to [-1, 1]
+
+    Argument:
+        image (numpy.ndarray): RGB image of SIZE x SIZE pixels
+    """
+    return np.expand_dims(image.astype(np.float32) / 127.5 - 1, axis=0)
+
+
+def render_scanpath_matplotlib(x, y):
+    """Draws the scanpath like the sessions did before this module (a
+    matplotlib figure saved as PNG, read back and fitted to 224x224 with
+    PIL) and returns the RGB image. Only used to validate render_scanpath()."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from PIL import Image, ImageOps
+
+    fig, ax = plt.subplots(figsize=(2.24, 2.24), dpi=100)
+    fig.patch.set_facecolor('black')
+    ax.set_facecolor('black')
+    for i in range(1, len(x)):
+        color = plt.cm.jet(i / len(x))
+        ax.plot(x[i-1:i+1], y[i-1:i+1], color=color, alpha=0.5, linewidth=0.8)
+    ax.invert_yaxis()
+    ax.axis('off')
+    plt.subplots_adjust(left=0, right=1, top=1, bottom=0)
+
+    buffer = io.BytesIO()
+    plt.savefig(buffer, format="png", dpi=100, facecolor='black')
+    plt.close(fig)
+    buffer.seek(0)
+    image = Image.open(buffer).convert("RGB")
+    image = ImageOps.fit(image, (SIZE, SIZE), Image.Resampling.LANCZOS)
+    return np.asarray(image)
+
+
+def random_walk(points, seed):
+    """Returns gaze points wandering around a 640x480 frame, to validate without recorded sessions"""
+    rng = np.random.default_rng(seed)
+    steps = rng.normal(0, 4, (points, 2))
+    path = np.cumsum(steps, axis=0) + (320, 240)
+    return path[:, 0], path[:, 1]
+
+
+def validate(scanpaths, model=None):
+    """Compares the model inputs of render_scanpath() and of the matplotlib
+    figure, returns one dict per scanpath with the mean and max difference
+    of their pixels (0-255) and, with a model, both predictions
+
+    Arguments:
+        scanpaths (list): (name, x, y) of each scanpath
+        model: Keras model to compare the predictions with, or None
+    """
+    results = []
+    for name, x, y in scanpaths:
+        reference = render_scanpath_matplotlib(x, y)
+        image = render_scanpath(x, y)
+        difference = np.abs(reference.astype(np.int16) - image.astype(np.int16))
+        result = {
+            "name": name,
+            "points": len(x),
+            "mean_difference": float(difference.mean()),
+            "max_difference": int(difference.max()),
+        }
+        if model is not None:
+            expected = np.asarray(model.predict(to_model_input(reference), verbose=0))[0]
+            predicted = np.asarray(model.predict(to_model_input(image), verbose=0))[0]
+            result.update({
+                "same_class": bool(expected.argmax() == predicted.argmax()),
+                "confidence_difference": float(abs(expected.max() - predicted.max())),
+            })
+        results.append(result)
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Scanpath renderer tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    command = commands.add_parser("validate", help="Compare with the matplotlib scanpath")
+    command.add_argument("logs", nargs="*", help="Gaze logs (gaze_data.npz) of recorded sessions")
+    command.add_argument("--random", type=int, default=0, help="Also compare N random scanpaths")
+    command.add_argument("--model", default=None, help="Keras model to compare the predictions with")
+    command.add_argument("--tolerance", type=float, default=2.0,
+                         help="Largest mean pixel difference accepted (0-255)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    scanpaths = []
+    for filename in args.logs:
+        scanpaths.append((filename,) + GazeLog.load(filename).gaze_points())
+    for seed in range(args.random):
+        scanpaths.append((f"random walk {seed}",) + random_walk(2000, seed))
+
+    model = None
+    if args.model:
+        from keras.models import load_model
+        model = load_model(args.model)
+
+    failed = 0
+    for result in validate(scanpaths, model):
+        ok = result["mean_difference"] <= args.tolerance and result.get("same_class", True)
+        failed += not ok
+        line = (f"{'OK  ' if ok else 'FAIL'} {result['name']}: {result['points']} points, "
+                f"pixel difference mean {result['mean_difference']:.3f} max {result['max_difference']}")
+        if "same_class" in result:
+            line += (f", same class: {result['same_class']}, "
+                     f"confidence difference {result['confidence_difference']:.4f}")
+        print(line)
+    print(f"{len(scanpaths) - failed}/{len(scanpaths)} scanpaths equivalent")
+    sys.exit(1 if failed else 0)
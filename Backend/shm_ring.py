@@ -0,0 +1,104 @@
+# shm_ring.py
+# Preallocated ring of frame slots in shared memory. A frame is copied once
+# into a free slot and the slot index is all that goes to another process:
+# frames are never pickled.
+#
+#   ring = SharedFrameRing(slots=4, shape=(480, 640, 3))
+#   index = ring.acquire()
+#   ring.write(index, frame)        # in the owner process
+#   ...
+#   ring = SharedFrameRing.attach(name, 4, (480, 640, 3))
+#   frame = ring.slot(index)        # in a worker process, no copy
+#
+# Only the process that created the ring hands out and gets back the slots.
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class SharedFrameRing(object):
+    """
+    Frame slots of a fixed shape in a shared memory block.
+
+    Arguments:
+        slots (int): Number of frames the ring can hold
+        shape (tuple): Shape of a frame, e.g. (height, width, 3)
+        dtype: Type of the frame pixels
+        name (str): Name of an existing block to attach to, None creates one
+    """
+
+    def __init__(self, slots, shape, dtype=np.uint8, name=None):
+        self.slots = slots
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.owner = name is None
+
+        slot_size = int(np.prod(self.shape)) * self.dtype.itemsize
+        if self.owner:
+            self._memory = shared_memory.SharedMemory(create=True, size=slot_size * slots)
+        else:
+            self._memory = shared_memory.SharedMemory(name=name)
+        self._frames = np.ndarray((slots,) + self.shape, self.dtype, buffer=self._memory.buf)
+
+        self._free = list(range(slots))
+        self._condition = threading.Condition()
+
+    @classmethod
+    def attach(cls, name, slots, shape, dtype=np.uint8):
+        """Attaches to a ring created by another process"""
+        return cls(slots, shape, dtype, name=name)
+
+    @property
+    def name(self):
+        """Name of the shared memory block, to attach to it from another process"""
+        return self._memory.name
+
+    def slot(self, index):
+        """Returns the frame of a slot, as a view on the shared memory
+
+        Argument:
+            index (int): Index of the slot
+        """
+        return self._frames[index]
+
+    def write(self, index, frame):
+        """Copies a frame into a slot
+
+        Arguments:
+            index (int): Index of the slot
+            frame (numpy.ndarray): Frame with the shape and type of the ring
+        """
+        if frame.shape != self.shape:
+            raise ValueError(f"Frame of shape {frame.shape} doesn't fit the ring slots {self.shape}")
+        np.copyto(self._frames[index], frame, casting="no")
+
+    def acquire(self, timeout=None):
+        """Returns the index of a free slot, waiting for one if needed,
+        or None if no slot is freed before the timeout
+
+        Argument:
+            timeout (float): Seconds to wait, None waits forever
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._free, timeout):
+                return None
+            return self._free.pop()
+
+    def release(self, index):
+        """Gives a slot back once its frame isn't used anymore
+
+        Argument:
+            index (int): Index of the slot
+        """
+        with self._condition:
+            self._free.append(index)
+            self._condition.notify()
+
+    def close(self):
+        """Detaches from the shared memory, and frees it if this process created it"""
+        # The view has to go before the block can be closed
+        self._frames = None
+        self._memory.close()
+        if self.owner:
+            self._memory.unlink()
@@ -0,0 +1,34 @@
+import numpy as np
+import cv2
+
+from gaze_tracking.calibration import Calibration
+from gaze_tracking.eye import Eye
+
+
+def make_face(brightness):
+    """Returns a gray frame with a dark pupil in the left eye, and the 68 landmarks"""
+    frame = np.full((240, 320), brightness, np.uint8)
+    cv2.circle(frame, (100, 100), 6, brightness // 4, -1)
+
+    landmarks = np.zeros((68, 2), np.int32)
+    landmarks[Eye.LEFT_EYE_POINTS] = [(80, 100), (90, 92), (110, 92), (120, 100), (110, 108), (90, 108)]
+    landmarks[Eye.RIGHT_EYE_POINTS] = [(180, 100), (190, 92), (210, 92), (220, 100), (210, 108), (190, 108)]
+    return frame, landmarks
+
+
+def test_brightness_step():
+    """A lighting change restarts the calibration of the eye, the frame that
+    detects it must still get a threshold"""
+    calibration = Calibration()
+    for i in range(100):
+        frame, landmarks = make_face(60 if i < 40 else 200)
+        eye = Eye(frame, landmarks, 0, calibration)
+        assert eye.pupil is not None, f"No pupil on frame {i}"
+
+    assert calibration.recalibrations >= 1, "The brightness step wasn't detected"
+    assert calibration.is_complete(0)
+    print(f"Brightness step: {calibration.recalibrations} recalibrations, threshold {calibration.threshold(0)}")
+
+
+if __name__ == "__main__":
+    test_brightness_step()
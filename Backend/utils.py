@@ -2,23 +2,25 @@
 import os, json
 from datetime import datetime
 
-def save_results_to_db(child_id,db, Report, app):
+def save_results_to_db(child_id,db, Report, app, latest_folder=None):
+    # latest_folder: session folder of the results, the latest session of the child by default
     print("inside utils to store data to db")
-    session_folder = os.path.join("results", str(child_id))
-    if not os.path.exists(session_folder):
-        print(f"No session folder found for child {child_id}")
-        return False
+    if latest_folder is None:
+        session_folder = os.path.join("results", str(child_id))
+        if not os.path.exists(session_folder):
+            print(f"No session folder found for child {child_id}")
+            return False
 
-    subfolders = [
-        os.path.join(session_folder, d)
-        for d in os.listdir(session_folder)
-        if os.path.isdir(os.path.join(session_folder, d))
-    ]
-    if not subfolders:
-        print(f"No timestamp folders found for child {child_id}")
-        return False
+        subfolders = [
+            os.path.join(session_folder, d)
+            for d in os.listdir(session_folder)
+            if os.path.isdir(os.path.join(session_folder, d))
+        ]
+        if not subfolders:
+            print(f"No timestamp folders found for child {child_id}")
+            return False
 
-    latest_folder = max(subfolders, key=os.path.getmtime)
+        latest_folder = max(subfolders, key=os.path.getmtime)
     results_file = os.path.join(latest_folder, "results.json")
     if not os.path.exists(results_file):
         print(f"results.json not found in {latest_folder}")
@@ -727,7 +727,7 @@ import { useChildrenStore } from "@/store/childrenStore";
 import { useAssessmentStore } from "@/store/assessmentStore";
 import { useAuthStore } from "@/store/authStore";
 import { useToast } from "@/hooks/use-toast";
-import { gazeApi, type GazeResult } from "@/services/gazeApi";
+import { gazeApi, ReportProcessingError, type GazeResult } from "@/services/gazeApi";
 import { 
   ArrowLeft, 
   Download, 
@@ -755,6 +755,7 @@ export default function AssessmentReport() {
   const [isSaving, setIsSaving] = useState(false);
   const [backendResult, setBackendResult] = useState<GazeResult | null>(null);
   const [loading, setLoading] = useState(true);
+  const [processingStatus, setProcessingStatus] = useState<string | null>(null);
   const [error, setError] = useState<string | null>(null);
   const [imageLoading, setImageLoading] = useState({ scanpath: true, heatmap: true });
   const [imageErrors, setImageErrors] = useState({ scanpath: false, heatmap: false });
@@ -772,12 +773,60 @@ export default function AssessmentReport() {
   const childAssessments = childId ? getAssessmentsByChild(childId) : [];
   const latestAssessment = childAssessments[0];
 
-  // Fetch results from Flask backend with retry polling (handles write latency after stop)
+  // Fetch results from Flask backend. After stop the session is post-processed by a
+  // job (scanpath, heatmap, detection): the backend answers 202 with the job, which
+  // is followed until it is done
   useEffect(() => {
     if (!childId) return;
     let cancelled = false;
-    let attempts = 0;
-    const maxAttempts = 10; // ~10 seconds
+    const startedAt = Date.now();
+    const pollInterval = 1000;
+    // A job is retried by the backend when its worker stops, only give up on a queue nobody runs
+    const maxWait = 10 * 60 * 1000; // ~10 minutes
+
+    const showError = (error: unknown) => {
+      if (cancelled) return;
+      console.error('Failed to fetch backend results:', error);
+      setError('Failed to load backend results. Using mock data.');
+      setProcessingStatus(null);
+      setLoading(false);
+      toast({
+        title: "Using mock data",
+        description: "Could not load backend results.",
+        variant: "destructive",
+      });
+    };
+
+    const retry = (step: () => Promise<void>) => {
+      if (Date.now() - startedAt > maxWait) {
+        showError(new Error('Timed out waiting for the report'));
+        return;
+      }
+      setTimeout(() => { if (!cancelled) void step(); }, pollInterval);
+    };
+
+    const pollJob = async (jobId: number) => {
+      try {
+        const job = await gazeApi.getJob(jobId);
+        if (cancelled) return;
+        if (job.status === 'done') {
+          void tryFetch();
+          return;
+        }
+        if (job.status === 'failed') {
+          showError(new Error(job.error || 'The processing of the session failed'));
+          return;
+        }
+        setProcessingStatus(
+          job.status === 'queued'
+            ? 'Waiting for the analysis to start...'
+            : `${job.message || 'Analyzing the session'} (${Math.round(job.progress * 100)}%)`
+        );
+        retry(() => pollJob(jobId));
+      } catch (error) {
+        showError(error);
+      }
+    };
 
     const tryFetch = async () => {
       setLoading(true);
@@ -786,28 +835,20 @@ export default function AssessmentReport() {
         const result = await gazeApi.getResult(childId);
         if (!cancelled) {
           setBackendResult(result);
+          setProcessingStatus(null);
           setLoading(false);
           toast({ title: "Results loaded", description: "Analysis results are ready." });
         }
       } catch (error) {
-        const message = error instanceof Error ? error.message : '';
-        if (message === 'PROCESSING') {
-          attempts += 1;
-          if (attempts < maxAttempts && !cancelled) {
-            setTimeout(tryFetch, 1000);
-            return;
+        if (error instanceof ReportProcessingError) {
+          if (error.jobId !== null) {
+            void pollJob(error.jobId);
+          } else {
+            retry(tryFetch);
           }
+          return;
         }
-        if (!cancelled) {
-          console.error('Failed to fetch backend results:', error);
-          setError('Failed to load backend results. Using mock data.');
-          setLoading(false);
-          toast({
-            title: "Using mock data",
-            description: "Could not load backend results.",
-            variant: "destructive",
-          });
-        }
+        showError(error);
       }
     };
 
@@ -937,6 +978,9 @@ export default function AssessmentReport() {
         <div className="text-center py-12">
           <Loader2 className="h-8 w-8 animate-spin mx-auto mb-4" />
           <p className="text-muted-foreground">Loading assessment results...</p>
+          {processingStatus && (
+            <p className="text-sm text-muted-foreground mt-2">{processingStatus}</p>
+          )}
         </div>
       </DashboardLayout>
     );
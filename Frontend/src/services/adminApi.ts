@@ -68,6 +68,12 @@ class AdminApi {
         throw new Error(errorData.error || `HTTP ${response.status}`);
       }
 
+      // 202: accepted but not ready yet (e.g. a report still being processed), there is no data to return
+      if (response.status === 202) {
+        const data = await response.json().catch(() => ({}));
+        throw new Error(data.message || 'Still processing');
+      }
+
       return await response.json();
     } catch (error) {
       console.error(`Admin API request failed for ${endpoint}:`, error);
@@ -219,6 +219,12 @@ class DoctorPatientApi {
         throw new Error(errorData.error || `HTTP ${response.status}`);
       }
 
+      // 202: accepted but not ready yet (e.g. a report still being processed), there is no data to return
+      if (response.status === 202) {
+        const data = await response.json().catch(() => ({}));
+        throw new Error(data.message || 'Still processing');
+      }
+
       return await response.json();
     } catch (error) {
       console.error(`API request failed for ${endpoint}:`, error);
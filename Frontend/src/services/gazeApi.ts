@@ -21,6 +21,26 @@ export type GazeResult = {
   created_at: string;
 };
 
+// Post-processing job of a stopped session (GET /jobs/<id>)
+export type GazeJob = {
+  id: number;
+  kind: string;
+  status: 'queued' | 'running' | 'done' | 'failed';
+  progress: number;
+  message: string | null;
+  error: string | null;
+};
+
+// Thrown while the report is still being processed, with the job processing it
+export class ReportProcessingError extends Error {
+  jobId: number | null;
+
+  constructor(jobId: number | null) {
+    super('PROCESSING');
+    this.jobId = jobId;
+  }
+}
+
 export const gazeApi = {
   listResults: async (): Promise<GazeResult[]> => {
     const res = await fetch(`${API_BASE_URL}/results`);
@@ -69,8 +89,9 @@ export const gazeApi = {
   getResult: async (childId: string): Promise<GazeResult> => {
     const res = await fetch(`${API_BASE_URL}/get-report/${childId}`);
     if (res.status === 202) {
-      // Backend is still writing results; signal caller to retry
-      throw new Error('PROCESSING');
+      // The post-processing job of the session is still running; signal caller to wait for it
+      const data = await res.json().catch(() => ({}));
+      throw new ReportProcessingError(data.job_id ?? null);
     }
     if (!res.ok) {
       throw new Error('Result not found');
@@ -78,6 +99,16 @@ export const gazeApi = {
     return res.json();
   },
 
+  // Get the post-processing job of a session
+  getJob: async (jobId: number): Promise<GazeJob> => {
+    const res = await fetch(`${API_BASE_URL}/jobs/${jobId}`);
+    if (!res.ok) {
+      throw new Error('Job not found');
+    }
+    const data = await res.json();
+    return data.job;
+  },
+
   // Get scanpath image URL (optional helper)
   getScanpathImageUrl: (childId: string): string =>
     `${API_BASE_URL}/scanpath/${childId}`,